@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from cache import LRUCache, digest
+
+
+MODES = ("crop", "resample")
+
+# Interpolation matrices by (source grid, target grid, mode)
+alignment_cache = LRUCache(float(os.environ.get("DDD_ALIGNMENT_CACHE_MB", 32))*1024**2, name="alignment")
+
+
+def alignment(source, target, mode="crop"):
+    """
+    Linear interpolation from the source wavelengths (the spectra) onto
+    the target wavelengths (the database).
+    mode "crop" only keeps the target wavelengths inside the source
+    range, "resample" keeps all of them and repeats the edge values of
+    the spectra outside it.
+    Returns the indices of the target wavelengths kept and a sparse
+    matrix (kept x source) to multiply the spectra with, or None if
+    both grids are already the same. Cached per pair of grids.
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    if mode not in MODES:
+        raise ValueError(f"Unknown alignment mode: {mode}")
+    if np.array_equal(source, target):
+        return np.arange(target.size), None
+
+    key = (digest(source), digest(target), mode)
+    cached = alignment_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if source.size < 2:
+        raise ValueError("At least two wavelengths are needed to align the spectra.")
+    from scipy import sparse
+
+    order = np.argsort(source, kind="stable")
+    grid = source[order]
+    if mode == "crop":
+        rows = np.flatnonzero((target >= grid[0]) & (target <= grid[-1]))
+    else:
+        rows = np.arange(target.size)
+    if rows.size == 0:
+        raise ValueError("The spectra and the database wavelengths do not overlap.")
+
+    points = np.clip(target[rows], grid[0], grid[-1])
+    left = np.clip(np.searchsorted(grid, points, side="right") - 1, 0, grid.size - 2)
+    step = grid[left + 1] - grid[left]
+    weight = np.divide(points - grid[left], step, out=np.zeros_like(points), where=step > 0)
+
+    matrix = sparse.csr_matrix(
+        (np.concatenate([1 - weight, weight]),
+         (np.tile(np.arange(rows.size), 2), np.concatenate([order[left], order[left + 1]]))),
+        shape=(rows.size, source.size),
+    )
+    alignment_cache.put(key, (rows, matrix), nbytes=rows.nbytes + matrix.data.nbytes*3)
+    return rows, matrix
+
+
+def align(matrix, spectra):
+    """
+    Applies the alignment matrix to the spectra (one per column) in a
+    single sparse product.
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    if matrix is None:
+        return spectra
+    return matrix @ spectra
@@ -1,221 +1,426 @@
 # Utility imports
 # import io
 # import base64
+import functools
+import importlib
+import json
+import logging
+import os
 import pathlib
+import uuid
 
-# Science imports
+# Boot phases timing, before the rest (see startup.py)
+import startup
+
+# Science imports (scipy, pandas and plotly.graph_objects are imported
+# on first use)
 import numpy as np
-import pandas as pd
-from scipy.optimize import nnls, curve_fit
-import plotly.graph_objects as go
+startup.mark("imports.science")
 
 # Web imports
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
+import dash_table
 from dash_daq import BooleanSwitch
-from dash.dependencies import Output, Input, State
+from dash.dependencies import Output, Input, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
+startup.mark("imports.web")
 
 # Project imports
-from utils import lognormal, load_df, extend_list
+from utils import load_df, write_table, FORMATS, PARQUET
+from cache import digest
+import fitting
+import pipeline
+import databases
+from store import SessionStore
+from instrumentation import instrumented, install as install_instrumentation
+import uploads
+import jobs
+import plots
+import solvers
+import regularization
+import bootstrap
+import kinetics
+import results
+import transport
+startup.mark("imports.project")
 
 PATH = pathlib.Path(__file__).parent
 
+logging.basicConfig(level=os.environ.get("DDD_LOG_LEVEL", "INFO"), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+logger = logging.getLogger("ddd")
+
 app = dash.Dash(
     __name__,
     meta_tags=[{"name": "viewport", "content": "width=device-width"}],
+    # Compressed by transport.py instead
+    compress=False,
 )
 
 # Server variable for heroku deployment
 server = app.server
 
+# Brotli/gzip compression and orjson encoding of the responses (before
+# the instrumentation, which records their uncompressed sizes)
+transport.install(server)
+
+# Callback timing logs and /metrics route
+install_instrumentation(server)
+
+# Chunked upload routes for large files (see assets/chunked_upload.js)
+uploads.install(server)
+
 # To avoid "ID not found in layout" errors due to nested callbacks
 app.config.suppress_callback_exceptions = True
 
 # Browser tab name
 app.title = "DdD 2.0"
+startup.mark("server")
 
+# Per session server-side state (see store.py for the backends)
+store = SessionStore.from_env()
 
-# Web layout
-app.layout = html.Div(
-    children=[
-        html.Div(
-            [
-                html.Div([
-                    html.Img(src=app.get_asset_url("ddd.png"), className="ddd-logo"),
-                    html.Img(src=app.get_asset_url("conicet_blanco.png"), className="conicet-logo"),
-                    html.Img(src=app.get_asset_url("exactas_blanco.png"), className="exactas-logo"),
-                ]),
-                html.H1(children="Diameter distribution by Deconvolution for SNPs", style=dict(color="var(--creamy")),
-                html.A([
-                    """
-                DOI: XX.XXXX/XXXXXXXX"""], href="https://pubs.rsc.org/en/content/articlelanding/2019/na/c9na00344d",
-                    className="instructions-sidebar"),
-                html.Div(
-                    [
-                        html.Button(
-                            f"HOW TO CITE {chr(9660)}",
-                            className="button_instruction",
-                            id="learn-more-button",
-                            ),
-                        html.Button(
-                            f"ABOUT DdD {chr(9660)}",
-                            className="about-ddd",
-                            id="btn-about",
-                            ),
-                        ],
-                    className="mobile_buttons",
-                    ),
-                html.Div([
-                    # Empty child function for the callback
-                    html.Div(id="demo-explanation", children=[]),
-                    html.Div(id="div-about", children=[])
-                ]),
+# Route receiving the spectra of live kinetics runs, spooled for them in
+# kinetics.SPOOL_DIR
+kinetics.install(server)
+
+# Absorption databases shared by all the sessions, loaded on first use
+registry = databases.DatabaseRegistry.from_env(PATH / "data")
+
+# NNLS fits and PSDs computed before, kept across restarts (see results.py)
+result_cache = results.ResultCache.from_env()
+
+# NNLS fits and batch analyses run in the background (see jobs.py)
+job_queue = jobs.JobQueue.from_env()
+JOB_POLL_MS = int(os.environ.get("DDD_JOB_POLL_MS", 500))
+KINETICS_POLL_MS = int(os.environ.get("DDD_KINETICS_POLL_MS", 2000))
+# Imported on first use, by prewarm ahead of the requests
+PREWARM_MODULES = ("pandas", "scipy.optimize", "scipy.linalg", "scipy.sparse", "plotly.graph_objects",
+                   "plotly.subplots")
+startup.mark("state")
+
+
+# Web layout, built on the first page load (or by prewarm)
+@functools.lru_cache(maxsize=None)
+def static_layout():
+    """
+    The page, without the per session components of serve_layout.
+    """
+    with startup.phase("layout"):
+        return html.Div(
+            children=[
                 html.Div(
                     [
-                        html.A(
-                            html.Button(
-                                ["Start again"],
-                                className="button_instruction start",
-                                style={"background-color": "green", "margin-top": "2%"}
-                            ),
-                            href="/"
-                        ),
+                        html.Div([
+                            html.Img(src=app.get_asset_url("ddd.png"), className="ddd-logo"),
+                            html.Img(src=app.get_asset_url("conicet_blanco.png"), className="conicet-logo"),
+                            html.Img(src=app.get_asset_url("exactas_blanco.png"), className="exactas-logo"),
+                        ]),
+                        html.H1(children="Diameter distribution by Deconvolution for SNPs", style=dict(color="var(--creamy")),
+                        html.A([
+                            """
+                        DOI: XX.XXXX/XXXXXXXX"""], href="https://pubs.rsc.org/en/content/articlelanding/2019/na/c9na00344d",
+                            className="instructions-sidebar"),
                         html.Div(
                             [
-                                html.Label("1- Upload Absorption Spectra", id="uno"),
-                                dcc.Upload(
-                                    id="upload-AS",
-                                    children=html.Div([
-                                        'Drag and Drop or ',
-                                        html.A('Select Files'), ],
-                                        ),
-                                    multiple=False,
-                                    className="dcc_upload"),
-                                ]
+                                html.Button(
+                                    f"HOW TO CITE {chr(9660)}",
+                                    className="button_instruction",
+                                    id="learn-more-button",
+                                    ),
+                                html.Button(
+                                    f"ABOUT DdD {chr(9660)}",
+                                    className="about-ddd",
+                                    id="btn-about",
+                                    ),
+                                ],
+                            className="mobile_buttons",
                             ),
+                        html.Div([
+                            # Empty child function for the callback
+                            html.Div(id="demo-explanation", children=[]),
+                            html.Div(id="div-about", children=[])
+                        ]),
                         html.Div(
                             [
-                                html.Label("2- Upload Absorption Database"),
-                                dcc.Upload(
-                                    id="upload-AD",
-                                    children=html.Div([
-                                        'Drag and Drop or ',
-                                        html.A('Select Files'), ],
+                                html.A(
+                                    html.Button(
+                                        ["Start again"],
+                                        className="button_instruction start",
+                                        style={"background-color": "green", "margin-top": "2%"}
+                                    ),
+                                    href="/"
+                                ),
+                                html.Div(
+                                    [
+                                        html.Label("1- Upload Absorption Spectra", id="uno"),
+                                        dcc.Upload(
+                                            id="upload-AS",
+                                            children=html.Div([
+                                                'Drag and Drop or ',
+                                                html.A('Select Files'), ],
+                                                ),
+                                            multiple=False,
+                                            className="dcc_upload"),
+                                        ]
+                                    ),
+                                html.Div(
+                                    [
+                                        html.Label("2- Upload Absorption Database"),
+                                        dcc.Upload(
+                                            id="upload-AD",
+                                            children=html.Div([
+                                                'Drag and Drop or ',
+                                                html.A('Select Files'), ],
+                                                ),
+                                            multiple=False,
+                                            className="dcc_upload"),
+                                        html.Button(
+                                            "or upload a large file", className="chunked-upload",
+                                            **{"data-target": "handle-AD"}),
+                                        dcc.Input(id="handle-AD", type="text", style={"display": "none"}),
+                                        dcc.Dropdown(
+                                            id="select-AD",
+                                            options=[{"label": name, "value": name} for name in registry.names()],
+                                            placeholder="or select a database",
+                                        ),
+                                        ]
+                                    ),
+                                html.Div(
+                                    [
+                                        # html.Label("3- Fit"),
+                                        html.Button(
+                                            id="execute-nnls",
+                                            children="3- Execute NNLS"),
+                                        dcc.RadioItems(
+                                            id="radio-align",
+                                            options=[
+                                                {"label": "Crop to the common wavelengths", "value": "crop"},
+                                                {"label": "Resample to the database wavelengths", "value": "resample"},
+                                            ],
+                                            value="crop",
+                                        ),
+                                        dcc.Dropdown(
+                                            id="select-solver",
+                                            options=[
+                                                {"label": "Active set (scipy)", "value": "scipy"},
+                                                {"label": "Active set, warm started", "value": "active-set"},
+                                                {"label": "Projected gradient (FISTA, approximate)", "value": "fista"},
+                                            ],
+                                            value=solvers.DEFAULT,
+                                            clearable=False,
+                                        ),
+                                        dcc.Dropdown(
+                                            id="select-regularization",
+                                            options=[
+                                                {"label": "No regularization", "value": "none"},
+                                                {"label": "Tikhonov, lambda by GCV", "value": "gcv"},
+                                                {"label": "Tikhonov, lambda by L-curve", "value": "lcurve"},
+                                            ],
+                                            value="none",
+                                            clearable=False,
+                                        ),
+                                    ], className="btn-nnls"
+                                    ),
+                                html.Div(
+                                    [
+                                        html.Label("4- Upload Jacobian"),
+                                        dcc.Upload(
+                                            id="upload-Jac",
+                                            children=html.Div([
+                                                'Drag and Drop or ',
+                                                html.A('Select Files'), ],
+                                                ),
+                                            multiple=False,
+                                            className="dcc_upload"),
+                                        ]
+                                    ),
+                                html.Div(
+                                    [
+                                        html.Label("Batch: upload several spectra (optional)"),
+                                        dcc.Upload(
+                                            id="upload-batch",
+                                            children=html.Div([
+                                                'Drag and Drop or ',
+                                                html.A('Select Files'), ],
+                                                ),
+                                            multiple=False,
+                                            className="dcc_upload"),
+                                        html.Button(
+                                            "or upload a large file", className="chunked-upload",
+                                            **{"data-target": "handle-batch"}),
+                                        dcc.Input(id="handle-batch", type="text", style={"display": "none"}),
+                                        ]
+                                    ),
+                                html.Div(
+                                    [
+                                        html.Label("Live kinetics: deconvolve spectra as they arrive (optional)"),
+                                        dbc.Input(
+                                            id="input-kinetics-dir", type="text",
+                                            placeholder="Folder to watch, or empty to post the spectra",
+                                            className="my_inputs",
                                         ),
-                                    multiple=False,
-                                    className="dcc_upload"),
-                                ]
+                                        html.Button("Start live run", id="start-kinetics"),
+                                        html.Button("Stop", id="stop-kinetics"),
+                                        html.Div(id="kinetics-status"),
+                                        ]
+                                    ),
+                                ],
+                            className="mobile_forms",
                             ),
                         html.Div(
                             [
-                                # html.Label("3- Fit"),
+                                html.Hr(),
+                                html.Label("5- Input threshold to filter from left (nm)"),
+                                dbc.Input(
+                                    id="input-filter", type="number",
+                                    value=None, min=0, max=10,
+                                    step=0.05,
+                                    # step="any",
+                                    placeholder="E.g. 2,4",
+                                    style={"width": "10vw"},
+                                    className="my_inputs"
+                                ),
+                                BooleanSwitch(
+                                    id="switch-filter",
+                                    on=False,
+                                    color="#BE4B53",
+                                    style={"display": "inline-block", "width": "10vh",
+                                           "vertical-align": "bottom"}
+                                ),
+                                html.Label("6- Bin size for histogram", id="binsize"),
+                                dbc.Input(
+                                    id="input-binsize", type="number",
+                                    value=0.35, min=0, max=1000,
+                                    step="any",  # placeholder="E.g. 0,25",
+                                    style={"width": "10vw"},
+                                    className="my_inputs"
+                                ),
+                                html.Label("Lognormal components in the fit"),
+                                dbc.Input(
+                                    id="input-components", type="number",
+                                    value=1, min=1, max=4, step=1,
+                                    style={"width": "10vw"},
+                                    className="my_inputs"
+                                ),
+                                html.Label("Uncertainty: resamples of the spectrum"),
+                                dbc.Input(
+                                    id="input-samples", type="number",
+                                    value=bootstrap.SAMPLES, min=10, max=10000, step=1,
+                                    style={"width": "10vw"},
+                                    className="my_inputs"
+                                ),
+                                dcc.RadioItems(
+                                    id="radio-bootstrap",
+                                    options=[
+                                        {"label": "Resample the residuals", "value": "residual"},
+                                        {"label": "Gaussian noise", "value": "noise"},
+                                    ],
+                                    value="residual",
+                                ),
+                                html.Button("Bootstrap bands", id="execute-bootstrap"),
+                                html.Label("7- Input value to scale (only for export)"),
+                                dbc.Input(
+                                    id="input-scale", type="number",
+                                    value=None, min=0, max=1000,
+                                    step="any", placeholder="E.g. 30",
+                                    style={"width": "10vw"},
+                                    className="my_inputs"
+                                ),
+                                BooleanSwitch(
+                                    id="switch-scale",
+                                    on=False,
+                                    color="#BE4B53",
+                                    style={"display": "inline-block", "width": "10vh",
+                                           "vertical-align": "bottom"}
+                                ),
+                                html.Label("8- Download PSD data", id="ocho"),
+                                dcc.Dropdown(
+                                    id="select-export",
+                                    options=[
+                                        {"label": "CSV", "value": ".csv"},
+                                        {"label": "NumPy (npz)", "value": ".npz"},
+                                        *([{"label": "Parquet", "value": ".parquet"}] if PARQUET else []),
+                                    ],
+                                    value=".csv",
+                                    clearable=False,
+                                ),
+                                dcc.Checklist(
+                                    id="check-float32",
+                                    options=[{"label": "Single precision (smaller file)", "value": "float32"}],
+                                    value=[],
+                                ),
+                                dcc.Download(id="download-PSD"),
                                 html.Button(
-                                    id="execute-nnls",
-                                    children="3- Execute NNLS"),
-                            ], className="btn-nnls"
-                            ),
-                        html.Div(
-                            [
-                                html.Label("4- Upload Jacobian"),
-                                dcc.Upload(
-                                    id="upload-Jac",
-                                    children=html.Div([
-                                        'Drag and Drop or ',
-                                        html.A('Select Files'), ],
-                                        ),
-                                    multiple=False,
-                                    className="dcc_upload"),
-                                ]
-                            ),
-                        ],
-                    className="mobile_forms",
-                    ),
-                html.Div(
-                    [
-                        html.Hr(),
-                        html.Label("5- Input threshold to filter from left (nm)"),
-                        dbc.Input(
-                            id="input-filter", type="number",
-                            value=None, min=0, max=10,
-                            step=0.05,
-                            # step="any",
-                            placeholder="E.g. 2,4",
-                            style={"width": "10vw"},
-                            className="my_inputs"
-                        ),
-                        BooleanSwitch(
-                            id="switch-filter",
-                            on=False,
-                            color="#BE4B53",
-                            style={"display": "inline-block", "width": "10vh",
-                                   "vertical-align": "bottom"}
-                        ),
-                        html.Label("6- Bin size for histogram", id="binsize"),
-                        dbc.Input(
-                            id="input-binsize", type="number",
-                            value=0.35, min=0, max=1000,
-                            step="any",  # placeholder="E.g. 0,25",
-                            style={"width": "10vw"},
-                            className="my_inputs"
-                        ),
-                        html.Label("7- Input value to scale (only for export)"),
-                        dbc.Input(
-                            id="input-scale", type="number",
-                            value=None, min=0, max=1000,
-                            step="any", placeholder="E.g. 30",
-                            style={"width": "10vw"},
-                            className="my_inputs"
-                        ),
-                        BooleanSwitch(
-                            id="switch-scale",
-                            on=False,
-                            color="#BE4B53",
-                            style={"display": "inline-block", "width": "10vh",
-                                   "vertical-align": "bottom"}
-                        ),
-                        html.Label("8- Download PSD data to CSV file", id="ocho"),
-                        dcc.Download(id="download-PSD"),
-                        html.Button(
-                            "Export data", id="btn-download", className="button_submit"
+                                    "Export data", id="btn-download", className="button_submit"
+                                    ),
+                            ],
                             ),
+                        html.Div(["Web by ", html.A("Daniel T. Suárez", href="https://github.com/danisuar3z")],
+                                 style={"margin-left": "10%", "font-family": ["Geneva", "Tahoma", "Verdana", "sans-serif"],
+                                        "display": "none"})
                     ],
+                    className="four columns instruction",
+                ),
+                html.Div([
+                    dcc.Tabs(id="stitching-tabs",
+                             value="instructions-tab",
+                             children=[
+                                 dcc.Tab(label="HOW TO USE", value="instructions-tab"),
+                                 dcc.Tab(label="ABSORPTION SPECTRA", value="AS-tab"),
+                                 dcc.Tab(label="ABSORPTION DATABASE", value="AD-tab"),
+                                 dcc.Tab(label="FIT", value="NNLS-tab"),
+                                 dcc.Tab(label="PSD", value="PSD-tab"),
+                                 dcc.Tab(label="BATCH", value="batch-tab"),
+                                 dcc.Tab(label="KINETICS", value="kinetics-tab"),
+                                 ], className="tabs"
+                             ),
+                    html.Div(
+                        id="tabs-content-example",
+                        className="canvas",
+                        style={"text-align": "left", "margin": "auto"},
                     ),
-                html.Div(["Web by ", html.A("Daniel T. Suárez", href="https://github.com/danisuar3z")],
-                         style={"margin-left": "10%", "font-family": ["Geneva", "Tahoma", "Verdana", "sans-serif"],
-                                "display": "none"})
-            ],
-            className="four columns instruction",
-        ),
-        html.Div([
-            dcc.Tabs(id="stitching-tabs",
-                     value="instructions-tab",
-                     children=[
-                         dcc.Tab(label="HOW TO USE", value="instructions-tab"),
-                         dcc.Tab(label="ABSORPTION SPECTRA", value="AS-tab"),
-                         dcc.Tab(label="ABSORPTION DATABASE", value="AD-tab"),
-                         dcc.Tab(label="FIT", value="NNLS-tab"),
-                         dcc.Tab(label="PSD", value="PSD-tab"),
-                         ], className="tabs"
-                     ),
-            html.Div(
-                id="tabs-content-example",
-                className="canvas",
-                style={"text-align": "left", "margin": "auto"},
-            ),
-            html.Div(className="upload_zone", id="upload-stitch", children=[]),
-        ], className="eight columns result",)
-    ], className="row twelve columns",
+                    html.Div(className="upload_zone", id="upload-stitch", children=[]),
+                ], className="eight columns result",)
+            ], className="row twelve columns",
 
-)
+        )
+
+
+def serve_layout():
+    """
+    Called on every page load, gives each browser tab its own session id
+    to key the server-side state.
+    """
+    session_id = str(uuid.uuid4())
+    return html.Div([
+        dcc.Store(id="session-id", data=session_id),
+        # Read by assets/chunked_upload.js, which sends it with the uploads
+        html.Div(id="upload-session", hidden=True, **{"data-session": session_id}),
+        # Running background jobs and their polling
+        dcc.Store(id="job-NNLS"),
+        dcc.Interval(id="poll-NNLS", interval=JOB_POLL_MS, disabled=True),
+        dcc.Store(id="job-batch"),
+        dcc.Interval(id="poll-batch", interval=JOB_POLL_MS, disabled=True),
+        dcc.Store(id="job-bootstrap"),
+        dcc.Interval(id="poll-bootstrap", interval=JOB_POLL_MS, disabled=True),
+        dcc.Interval(id="poll-kinetics", interval=KINETICS_POLL_MS, disabled=True),
+        # Set by the PSD figure (clientside) when the filter needs a new fit
+        dcc.Store(id="refit-PSD"),
+        static_layout(),
+    ])
+
+
+app.layout = serve_layout
 
 
 @app.callback(
     Output("upload-stitch", "children"),
     Input("stitching-tabs", "value")
 )
+@instrumented()
 def render_content(tab):
     """
     Renders tab content when value of dcc.Tabs changes by click
@@ -228,7 +433,11 @@ def render_content(tab):
     elif tab == "NNLS-tab":
         return html.Div(id="graph-NNLS")
     elif tab == "PSD-tab":
-        return html.Div(id="graph-PSD")
+        return html.Div([html.Div(id="graph-PSD"), html.Div(id="graph-bootstrap")])
+    elif tab == "batch-tab":
+        return html.Div(id="graph-batch")
+    elif tab == "kinetics-tab":
+        return html.Div(id="graph-kinetics")
     elif tab == "instructions-tab":
         return [
             dcc.Download(id="download-template"),
@@ -270,6 +479,7 @@ def demo_explanation(name):
      Output("learn-more-button", "children")],
     [Input("learn-more-button", "n_clicks")],
 )
+@instrumented()
 def learn_more(n_clicks):
     """
     Simulates collapsable component adding the markdown text from
@@ -296,6 +506,7 @@ def learn_more(n_clicks):
      Output("btn-about", "children")],
     [Input("btn-about", "n_clicks")],
 )
+@instrumented()
 def about(n_clicks):
     """
     Simulates collapsable component adding the markdown text from
@@ -325,18 +536,30 @@ def about(n_clicks):
     Input("execute-nnls", "n_clicks"),
     Input("upload-AD", "filename"),
     Input("upload-Jac", "filename"),
+    Input("select-AD", "value"),
+    Input("upload-batch", "filename"),
+    Input("handle-AD", "value"),
+    Input("handle-batch", "value"),
+    Input("start-kinetics", "n_clicks"),
 )
-def change_focus(filename_AS, click, filename_AD, filename_Jac):
+@instrumented()
+def change_focus(filename_AS, click, filename_AD, filename_Jac, database_name, filename_batch,
+                 handle_AD, handle_batch, start_kinetics):
     """
     Brings focus to the needed tab given the user inputs (file uploads,
     button presses).
     """
+    triggered = dash.callback_context.triggered[0]["prop_id"]
+    if triggered in ("upload-batch.filename", "handle-batch.value"):
+        return "batch-tab"
+    if triggered == "start-kinetics.n_clicks":
+        return "kinetics-tab"
     # Return order is key to the correct behavior
     if filename_Jac:
         return "PSD-tab"
     elif click:
         return "NNLS-tab"
-    elif filename_AD:
+    elif filename_AD or database_name or handle_AD:
         return "AD-tab"
     elif filename_AS:
         return "AS-tab"
@@ -346,22 +569,24 @@ def change_focus(filename_AS, click, filename_AD, filename_Jac):
 # ABSORPTION SPECTRA
 
 
-def parse_AS(contents, filename):
+def parse_AS(contents, filename, session_id):
     """
     Reads file uploaded from the user and parses it into a pandas
     DataFrame, then uses it to graph the absorption spectrum.
     Returns dcc.Graph with figure in it.
     """
-    print("DEBUG: parse_AS being executed!")
-    global df_AS
+    import plotly.graph_objects as go
+
+    logger.debug("parse_AS being executed!")
 
     try:
         df_AS = load_df(contents, filename, ["Wavelength", "Absorbance"])
     except Exception as e:
-        print(e)  # TODO: Log? with open append mode --> datetime now() and exception
+        logger.warning("Could not parse %s: %s", filename, e)
         return html.H1(["There was an error processing this file. Please check metadata required and templates provided."])
     if type(df_AS) == str:
-        return html.H1("Only csv, xls and xlsx are supported.")
+        return html.H1(f"Only {FORMATS} are supported.")
+    store.update(session_id, df_AS=df_AS)
     return dcc.Graph(
         figure={
             "data": [go.Scatter(x=df_AS.Wavelength, y=df_AS.Absorbance, mode="lines")],
@@ -377,18 +602,20 @@ def parse_AS(contents, filename):
 @app.callback(
     Output("graph-AS", "children"),
     [Input("upload-AS", "contents"),
-     State("upload-AS", "filename")]
+     State("upload-AS", "filename"),
+     State("session-id", "data")]
 )
-def update_AS(contents, filename):
+@instrumented()
+def update_AS(contents, filename, session_id):
     """
     Called when the user uploads absorption file and calls parse_AS
     to make and put the graph in the respective graph div.
     """
-    print("DEBUG: CORRIENDO update_AS")
+    logger.debug("CORRIENDO update_AS")
     if contents:
         children = [
             html.H6([f"Using \"{filename}\""]),
-            parse_AS(contents, filename)
+            parse_AS(contents, filename, session_id)
         ]
     else:
         children = [html.H1(["Please upload the Absorption Spectra with"]),
@@ -400,52 +627,103 @@ def update_AS(contents, filename):
 # ABSORPTION DATABASE
 
 
-def parse_AD(contents, filename):
+def parse_AD(contents, filename, session_id, handle=None):
     """
-    Reads file uploaded from the user and parses it into a pandas
-    DataFrame, then uses it to graph the database spectra.
+    Reads file uploaded from the user (or spooled by a chunked upload,
+    given its handle) and parses it into a pandas DataFrame, then uses
+    it to graph the database spectra.
     Returns dcc.Graph with figure in it.
     """
-    print("DEBUG: parse_AD being executed!")
-    global df_AD
+    logger.debug("parse_AD being executed!")
 
     try:
-        df_AD = load_df(contents, filename)
+        df_AD = uploads.load_upload(handle, session_id) if handle else load_df(contents, filename)
     except Exception as e:
-        print(e)  # TODO: Log? with open append mode --> datetime now() and exception
+        logger.warning("Could not parse %s: %s", filename, e)
         return html.H1(["There was an error processing this file. Please check metadata required and templates provided."])
     if type(df_AD) == str:
-        return html.H1("Only csv, xls and xlsx are supported.")
+        return html.H1(f"Only {FORMATS} are supported.")
 
     df_AD.columns = ["Wavelength", *df_AD.columns[1:]]
+    store.update(session_id, df_AD=df_AD, database=None)
 
-    return dcc.Graph(
-        figure={
-            "data": [go.Scatter(x=df_AD.Wavelength, y=df_AD[col], mode="lines", name=col) for col in df_AD.columns[1:]],
-            "layout": {
-                "title": "Absorption Database",
-                "xaxis": dict(title="Wavelength (nm)"),
-                "yaxis": dict(title="Absorbance")
-            }
-        }
+    # Factorized now and cached for the NNLS
+    return database_graph(databases.from_upload(df_AD))
+
+
+def database_figure(database, x_range=None):
+    """
+    Figure of the database spectra, one trace per size (a heatmap for
+    large databases), see plots.py.
+    """
+    return plots.spectra_figure(
+        database.wavelengths, database.matrix, database.sizes, "Absorption Database",
+        x_range, revision=database.key,
     )
 
 
+def database_graph(database):
+    """
+    Returns dcc.Graph with the database spectra.
+    """
+    return dcc.Graph(id="figure-AD", figure=database_figure(database))
+
+
+@app.callback(
+    Output("figure-AD", "figure"),
+    Input("figure-AD", "relayoutData"),
+    State("session-id", "data"),
+)
+@instrumented()
+def zoom_AD(relayout, session_id):
+    """
+    Redraws the database figure with the points of the visible
+    wavelengths when the user zooms.
+    """
+    try:
+        x_range = plots.x_range_from(relayout or {})
+    except KeyError:
+        raise PreventUpdate
+    database = session_database(store.get(session_id))
+    if database is None:
+        raise PreventUpdate
+    return database_figure(database, x_range)
+
+
 @app.callback(
     Output("graph-AD", "children"),
     Input("upload-AD", "contents"),
-    State("upload-AD", "filename")
+    Input("select-AD", "value"),
+    Input("handle-AD", "value"),
+    State("upload-AD", "filename"),
+    State("session-id", "data")
 )
-def update_AD(contents, filename):
+@instrumented()
+def update_AD(contents, database_name, handle, filename, session_id):
     """
-    Called when the user uploads database file and calls parse_AD
-    to make and put the graph in the respective graph div.
+    Called when the user uploads database file (or finishes a chunked
+    upload) and calls parse_AD to make and put the graph in the
+    respective graph div, or when a database is selected from the
+    registry.
     """
-    print("DEBUG: CORRIENDO update_AD")
-    if contents:
+    logger.debug("CORRIENDO update_AD")
+    triggered = dash.callback_context.triggered[0]["prop_id"]
+    if handle and (triggered == "handle-AD.value" or not (contents or database_name)):
+        upload = json.loads(handle)
+        children = [
+            html.H6([f"Using \"{upload['filename']}\""]),
+            parse_AD(None, upload["filename"], session_id, upload["handle"])
+        ]
+    elif database_name and (triggered == "select-AD.value" or not contents):
+        store.update(session_id, database=database_name)
+        children = [
+            html.H6([f"Using \"{database_name}\""]),
+            database_graph(registry.get(database_name))
+        ]
+    elif contents:
         children = [
             html.H6([f"Using \"{filename}\""]),
-            parse_AD(contents, filename)
+            parse_AD(contents, filename, session_id)
         ]
     else:
         children = [html.H1(["Please upload the Absorption Database with"]),
@@ -457,75 +735,277 @@ def update_AD(contents, filename):
 # NNLS
 
 
+def nnls_job(progress, database, wavelengths, absorbance, align_mode, solver, x0, method="none", key=None):
+    """
+    Background job of update_NNLS, returns the solvers.SolveResult and
+    the regularization.Path of the lambdas tried (None without
+    regularization). Results are kept in the result cache by key.
+    """
+    cached = result_cache.get(key) if result_cache is not None and key else None
+    if cached is not None:
+        return results.unpack_fit(*cached)
+    database, absorbance = pipeline.align_spectra(database, wavelengths, absorbance, align_mode)
+    if method == "none":
+        # A single solve, the job can only be cancelled before it
+        progress(0.5)
+        result, path = database.nnls(absorbance, solver, x0), None
+    else:
+        path = regularization.tikhonov_path(database, absorbance, method=method, progress=progress)
+        result = regularization.chosen(path)
+    if result_cache is not None and key:
+        result_cache.put(key, *results.pack_fit(result, path))
+    return result, path
+
+
 @app.callback(
-    Output("graph-NNLS", "children"),
+    Output("job-NNLS", "data"),
     Input("execute-nnls", "n_clicks"),
     Input("upload-AS", "filename"),
-    Input("upload-AD", "filename")
+    Input("upload-AD", "filename"),
+    Input("select-AD", "value"),
+    Input("handle-AD", "value"),
+    Input("radio-align", "value"),
+    Input("select-solver", "value"),
+    Input("select-regularization", "value"),
+    State("session-id", "data")
 )
-def update_NNLS(click, fn_AS, fn_AD):
-    """
-    Fits the data with non-negative least squares method
-    and generates graph to return in the respective div.
-    """
-    global df_AD
-    global df_AS
-    global df_NNLS
-    global NPsizes_frequency
-    print("DEBUG: update_NNLS executed")
-    if click and fn_AS and fn_AD:  # Workaround to the global vars problem
-
-        # Dimension check. AS and AD should have same amount of rows
-        if df_AS.shape[0] != df_AD.shape[0]:
-            return html.H1(
-                children=[
-                    "Bad dimensions. Absorption Spectrum and Database should have the same amount of rows.",
-                    html.Br(),
-                    "Please check your files (and templates given) and upload again."
-                ]
-            )
+@instrumented()
+def update_NNLS(click, fn_AS, fn_AD, database_name, handle_AD, align_mode, solver, method, session_id):
+    """
+    Submits the non-negative least squares fit of the data as a
+    background job, show_NNLS polls it and graphs the result.
+    """
+    logger.debug("update_NNLS executed")
+    state = store.get(session_id)
+    database = session_database(state)
+    if click and "df_AS" in state and database is not None:
+        df_AS = state["df_AS"]
+        # Same inputs, same job: a finished fit is reused
+        key = digest("nnls", database.key, df_AS.to_numpy(), align_mode, solver, method)
+        # The previous solution is the starting point of the new fit
+        x0 = state.get("NPsizes_frequency")
+        if x0 is not None and x0.shape[0] != database.shape[1]:
+            x0 = None
+        job_id = job_queue.submit(
+            nnls_job, database, df_AS.Wavelength, df_AS.Absorbance, align_mode, solver, x0, method, key, key=key
+        )
+        return {"job": job_id}
+    return None
 
-        df_NNLS = df_AD[df_AD.columns[1:]]
-        NPsizes_frequency, _ = nnls(df_NNLS, df_AS.Absorbance)
-        trace_fit = go.Scatter(x=df_AS.Wavelength, y=np.matmul(df_NNLS, NPsizes_frequency),
-                               mode="lines", name="Fit",)
-        traces_AD_NNLS = [go.Scatter(x=df_AD.Wavelength, y=df_AD[col]*NPsizes_frequency[df_NNLS.columns.get_loc(col)], name=col) for col in df_NNLS.columns]
-        trace_AS = go.Scatter(x=df_AS.Wavelength, y=df_AS.Absorbance, mode="lines", name="Data")
-        traces = [trace_AS, trace_fit, *traces_AD_NNLS]
-        layout ={
-            "title": "Absorption Spectra",
-            "xaxis": dict(title="Wavelength (nm)"),
-            "yaxis": dict(title="Absorbance")
-            }
-        return dcc.Graph(figure={"data": traces, "layout": layout})
-    else:
+
+@app.callback(
+    Output("graph-NNLS", "children"),
+    Output("poll-NNLS", "disabled"),
+    Input("job-NNLS", "data"),
+    Input("poll-NNLS", "n_intervals"),
+    State("radio-align", "value"),
+    State("select-solver", "value"),
+    State("session-id", "data")
+)
+@instrumented()
+def show_NNLS(job, n_intervals, align_mode, solver, session_id):
+    """
+    Shows the progress of the NNLS job and, when it is done, generates
+    the graph to return in the respective div. Polling stops once the
+    job is finished.
+    """
+    status = job_queue.status(job and job["job"])
+    if status is None:
         return [html.H1("First upload Absorption Spectra and Database,"),
                 html.H1("then click EXECUTE NNLS"),
-                ]
+                ], True
+    if status["status"] not in jobs.FINISHED:
+        return job_progress("NNLS", status), False
+    if status["status"] == jobs.CANCELLED:
+        return html.H1("The fit was cancelled, click EXECUTE NNLS to run it again."), True
+    if status["status"] == jobs.FAILED:
+        return html.H1(
+            children=[
+                status["error"],
+                html.Br(),
+                "Please check your files (and templates given) and upload again."
+            ]
+        ), True
+
+    result, path = job_queue.result(job["job"])
+    NPsizes_frequency = result.x
+    state = store.get(session_id)
+    if "df_AS" not in state:
+        return html.H1("The session expired, please upload the files again."), True
+    df_AS = state["df_AS"]
+    database, _ = pipeline.align_spectra(
+        session_database(state), df_AS.Wavelength, df_AS.Absorbance, align_mode
+    )
+    store.update(session_id, NPsizes_frequency=NPsizes_frequency)
+    iterations = "" if result.iterations is None else f", {result.iterations} iterations"
+    children = [
+        html.H6([
+            f"Solver: {solver if path is None else 'active-set'}{iterations}, residual norm {result.rnorm:.4g}",
+            "" if result.converged else " (did not converge, try another solver)",
+        ]),
+        dcc.Graph(id="figure-NNLS", figure=nnls_figure(database, df_AS, NPsizes_frequency)),
+    ]
+    if path is not None:
+        criterion = "GCV" if path.method == "gcv" else "L-curve"
+        children[1:1] = [html.H6(
+            f"Tikhonov regularization: lambda = {path.lambdas[path.best]:.3g} chosen by {criterion} "
+            f"among {path.lambdas.size}"
+        )]
+        children.append(dcc.Graph(id="figure-regularization", figure=regularization_figure(database, path)))
+    return children, True
+
+
+def nnls_figure(database, df_AS, frequencies, x_range=None):
+    """
+    Figure of the data, the fit and the contribution of each size.
+    """
+    return plots.spectra_figure(
+        database.wavelengths, database.matrix*frequencies, database.sizes, "Absorption Spectra", x_range,
+        extra=[
+            (df_AS.Wavelength, df_AS.Absorbance, "Data"),
+            (database.wavelengths, database.matrix @ frequencies, "Fit"),
+        ],
+        revision=digest(database.key, frequencies),
+    )
+
+
+def regularization_figure(database, path, candidates=8):
+    """
+    Figure of the size distributions of some of the lambdas of the path
+    around the chosen one (in bold), and the criterion of each lambda.
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    shown = np.unique(np.linspace(0, path.lambdas.size - 1, candidates).round().astype(int))
+    figure = make_subplots(
+        rows=1, cols=2, column_widths=[0.65, 0.35],
+        subplot_titles=("Size distribution by lambda", "GCV" if path.method == "gcv" else "L-curve curvature"),
+    )
+    for k in shown:
+        if k != path.best:
+            figure.add_trace(go.Scatter(
+                x=database.sizes, y=path.frequencies[:, k], mode="lines", name=f"lambda = {path.lambdas[k]:.2g}",
+                line=dict(width=1), opacity=0.5,
+            ), row=1, col=1)
+    figure.add_trace(go.Scatter(
+        x=database.sizes, y=path.frequencies[:, path.best], mode="lines",
+        name=f"lambda = {path.lambdas[path.best]:.2g} (chosen)", line=dict(width=3, color="black"),
+    ), row=1, col=1)
+    score = path.gcv if path.method == "gcv" else np.where(np.isfinite(path.curvature), path.curvature, None)
+    figure.add_trace(go.Scatter(x=path.lambdas, y=score, mode="lines+markers", showlegend=False), row=1, col=2)
+    figure.add_trace(go.Scatter(
+        x=[path.lambdas[path.best]], y=[score[path.best]], mode="markers", showlegend=False,
+        marker=dict(size=12, color="black"),
+    ), row=1, col=2)
+    figure.update_xaxes(title_text="Size", row=1, col=1)
+    figure.update_yaxes(title_text="Frequency", row=1, col=1)
+    figure.update_xaxes(title_text="lambda", type="log", row=1, col=2)
+    figure.update_yaxes(type="log" if path.method == "gcv" else "linear", row=1, col=2)
+    return figure
+
+
+@app.callback(
+    Output("figure-NNLS", "figure"),
+    Input("figure-NNLS", "relayoutData"),
+    State("radio-align", "value"),
+    State("session-id", "data"),
+)
+@instrumented()
+def zoom_NNLS(relayout, align_mode, session_id):
+    """
+    Redraws the NNLS figure with the points of the visible wavelengths
+    when the user zooms.
+    """
+    try:
+        x_range = plots.x_range_from(relayout or {})
+    except KeyError:
+        raise PreventUpdate
+    state = store.get(session_id)
+    database = session_database(state)
+    if database is None or "NPsizes_frequency" not in state:
+        raise PreventUpdate
+    df_AS = state["df_AS"]
+    database, _ = pipeline.align_spectra(database, df_AS.Wavelength, df_AS.Absorbance, align_mode)
+    return nnls_figure(database, df_AS, state["NPsizes_frequency"], x_range)
+
+
+@app.callback(
+    Output("cancel-NNLS", "children"),
+    Input("cancel-NNLS", "n_clicks"),
+    State("job-NNLS", "data"),
+)
+@instrumented()
+def cancel_NNLS(click, job):
+    """
+    Cancels the running NNLS job.
+    """
+    if not click or not job:
+        raise PreventUpdate
+    job_queue.cancel(job["job"])
+    return "Cancelling..."
+
+
+def job_progress(name, status):
+    """
+    Progress bar and cancel button of a running job.
+    """
+    percent = round(100*status["progress"])
+    return html.Div([
+        html.H6("Queued..." if status["status"] == jobs.QUEUED else f"Running... {percent}%"),
+        dbc.Progress(value=percent, striped=True, animated=True),
+        html.Button("Cancelling..." if status["cancel"] else "Cancel", id=f"cancel-{name}"),
+    ])
+
+
+def session_database(state):
+    """
+    Returns the Database selected from the registry or uploaded in the
+    session, None if there is none yet.
+    """
+    if state.get("database"):
+        return registry.get(state["database"])
+    if state.get("df_AD") is not None:
+        return databases.from_upload(state["df_AD"])
+    return None
 
 
 # PSD
 
-def parse_Jac(contents, filename, filter_on, filter_value, bin_size):
+def cached_psd(frequencies, sizes, jacobian, threshold, components):
+    """
+    pipeline.compute_psd, through the result cache.
+    """
+    key = digest("psd", frequencies, sizes, jacobian, threshold, components)
+    cached = result_cache.get(key) if result_cache is not None else None
+    if cached is not None:
+        return results.unpack_psd(*cached)
+    # Each stage is memoized, only the ones downstream of a change run
+    psd = pipeline.compute_psd(frequencies, sizes, jacobian, threshold, None, components)
+    if result_cache is not None:
+        result_cache.put(key, *results.pack_psd(psd))
+    return psd
+
+
+def parse_Jac(contents, filename, threshold, components, session_id):
     """
     Reads file uploaded from the user and parses it into a pandas
-    DataFrame, then uses it to graph the PSD.
-    Returns dcc.Graph with figure in it.
+    DataFrame, then fits the PSD.
+    Returns a dcc.Store with the weighted size distribution and the fit,
+    and the dcc.Graph that psd_figure (assets/psd.js) draws from it in
+    the browser, applying the bin size and the filter there.
     """
-    global df_Jac
-    global NPsizes_frequency
-    global y_data
-    global extended_size
-    print("DEBUG: parse_Jac being executed!")
+    logger.debug("parse_Jac being executed!")
+    NPsizes_frequency = store.get(session_id)["NPsizes_frequency"]
 
     try:
-        df_Jac = load_df(contents, filename, ["Size", "J"])
+        df_Jac = pipeline.parse_jacobian(contents, filename)
     except Exception as e:
-        print(e)
+        logger.warning("Could not parse %s: %s", filename, e)
         return html.H1(["There was an error processing this file. Please check metadata required and templates provided."])
 
     if type(df_Jac) == str:
-        return html.H1("Only csv, xls and xlsx are supported.")
+        return html.H1(f"Only {FORMATS} are supported.")
 
     # Dimensions check (Jac values should match AD columns, ergo match NPsizes_frequency)
     if df_Jac.shape[0] != NPsizes_frequency.shape[0]:
@@ -540,91 +1020,75 @@ def parse_Jac(contents, filename, filter_on, filter_value, bin_size):
         )
 
     fit_x_values = np.linspace(df_Jac['Size'].min(), df_Jac['Size'].max(), 50)
-    y_data = NPsizes_frequency*df_Jac["J"]
-    y_data /= y_data.max()
-
-    if filter_on:
-        for i in df_Jac["Size"].index:
-            if df_Jac["Size"].iloc[i] < filter_value:
-                y_data.iloc[i] = 0
-
-    params, _ = curve_fit(lognormal, df_Jac["Size"], y_data)
-    y_fit = lognormal(fit_x_values, params[0], params[1])
 
-    # Convert the data to use histogram
-    extended_size = extend_list(y_data, df_Jac.Size)
+    psd = cached_psd(NPsizes_frequency, df_Jac["Size"].to_numpy(), df_Jac["J"].to_numpy(), threshold,
+                     int(components or 1))
+    fit = psd.fit
+    logger.debug("lognormal fit (%d components, %d starts) took %.1f ms",
+                 fit.components.shape[0], fit.starts, fit.seconds*1000)
 
-    factor = extended_size.value_counts().iloc[0]/extended_size.shape[0]
+    store.update(session_id, df_Jac=df_Jac, y_data=psd.y_data)
 
-    trace_hist = go.Histogram(
-        x=extended_size, name="PSD by DdD",
-        histnorm="probability", xbins={"size": bin_size},
-        marker_line_width=1,
-    )
-    traces = [
-        trace_hist,
-        go.Scatter(
-            x=fit_x_values, y=y_fit*factor,
-            name="Lognormal fit")
-    ]
-
-    mean = np.exp(np.log(params[0])+0.5*params[1]*params[1])
-    dev = np.exp(np.log(params[0])+0.5*params[1]*params[1])*np.sqrt(np.exp(params[1]*params[1])-1)
+    components = []
+    if fit.components.shape[0] > 1:
+        # Each lognormal of the mixture, with its share of the fitted curve
+        components = [
+            fitting.mixture(fit_x_values, *fit.params[3*k:3*k + 3]).tolist()
+            for k in range(fit.components.shape[0])
+        ]
 
-    annotation_mean = {
-        "x": 4/5*df_Jac["Size"].max(),
-        "y": 4.1/5*y_data.max()*factor,
-        "text": f"Mean = {mean:.2f} nm",
-        "showarrow": False,
-        "font": {"size": 25, "color": "black"}
-    }
-    annotation_dev = {
-        "x": 4/5*df_Jac["Size"].max(),
-        "y": 4.9/7*y_data.max()*factor,
-        "text": f"Deviation = {dev:.2f} nm",
-        "showarrow": False,
-        "font": {"size": 25, "color": "black"}
+    data = {
+        "sizes": df_Jac["Size"].tolist(),
+        # Before the filter, the browser applies it
+        "y": pipeline.weight_frequencies(NPsizes_frequency, df_Jac["J"].to_numpy()).tolist(),
+        "threshold": threshold,
+        "fit": {
+            "x": fit_x_values.tolist(),
+            "y": fitting.evaluate(fit, fit_x_values).tolist(),
+            "components": components,
+        },
+        "mean": psd.mean,
+        "deviation": psd.deviation,
     }
-
-    return dcc.Graph(
-        figure={
-            "data": traces,
-            "layout": go.Layout(
-                title="Particle Size Distribution by DdD",
-                xaxis=dict(title="Particle size (nm)"),
-                yaxis=dict(title="Density distribution"),
-                annotations=[annotation_mean, annotation_dev]
-            )
-        }
-    )
+    return [dcc.Store(id="data-PSD", data=data), dcc.Graph(id="figure-PSD")]
 
 
 @app.callback(
     Output("graph-PSD", "children"),
     Input("upload-Jac", "contents"),
-    Input("switch-filter", "on"),
-    Input("input-filter", "value"),
-    Input("input-binsize", "value"),
+    Input("refit-PSD", "data"),
+    Input("input-components", "value"),
     Input("upload-AS", "filename"),
     Input("upload-AD", "filename"),
+    State("switch-filter", "on"),
+    State("input-filter", "value"),
     State("upload-Jac", "filename"),
+    State("session-id", "data"),
 )
-def update_Jac(contents, filter_on, filter_value, bin_size, fn_AS, fn_AD, filename):
+@instrumented()
+def update_Jac(contents, refit, components, fn_AS, fn_AD, filter_on, filter_value, filename, session_id):
     """
     Called when the user uploads jacobian file and calls parse_Jac
-    to make and put the graph in the respective graph div.
+    to make and put the graph in the respective graph div. Changes of
+    the bin size and the filter are handled in the browser, which only
+    calls back (through refit-PSD) when the filter changes the data.
     """
-    print("DEBUG: FILTER VALUE:", filter_value)
-    print("DEBUG: BIN SIZE:", bin_size)
-    if contents and fn_AS and fn_AD:  # Workaround to the global vars problem
+    logger.debug("FILTER VALUE: %s", filter_value)
+    if contents and "NPsizes_frequency" in store.get(session_id):
         try:
-            psd_graph = parse_Jac(contents, filename, filter_on, filter_value, bin_size)
+            psd_graph = parse_Jac(
+                contents, filename, filter_value if filter_on else None, components, session_id
+            )
             children = [
                 html.H6([f"Using \"{filename}\""]),
                 psd_graph
             ]
+        except ValueError as e:
+            # Too many components for the sizes, the message says how many
+            logger.warning("update_Jac: %s", e)
+            children = [html.H1(str(e))]
         except Exception as e:
-            print("update_Jac:", e)
+            logger.exception("update_Jac: %s", e)
             children = [html.H1("There was an error."),
                         html.H1("Please check metadata required and templates provided.")
                         ]
@@ -635,6 +1099,420 @@ def update_Jac(contents, filter_on, filter_value, bin_size, fn_AS, fn_AD, filena
     return children
 
 
+app.clientside_callback(
+    ClientsideFunction(namespace="ddd", function_name="psd_figure"),
+    Output("figure-PSD", "figure"),
+    Output("refit-PSD", "data"),
+    Input("data-PSD", "data"),
+    Input("input-binsize", "value"),
+    Input("switch-filter", "on"),
+    Input("input-filter", "value"),
+)
+
+
+def bootstrap_job(progress, database, wavelengths, absorbance, align_mode, frequencies, sizes, jacobian,
+                  threshold, components, mode, samples, solver):
+    """
+    Background job of update_bootstrap, returns the bootstrap.Bands.
+    """
+    database, absorbance = pipeline.align_spectra(database, wavelengths, absorbance, align_mode)
+    return bootstrap.bootstrap(
+        database, absorbance, frequencies, sizes, jacobian, threshold, components, mode, samples,
+        solver=solver, progress=progress,
+    )
+
+
+@app.callback(
+    Output("job-bootstrap", "data"),
+    Input("execute-bootstrap", "n_clicks"),
+    State("input-samples", "value"),
+    State("radio-bootstrap", "value"),
+    State("switch-filter", "on"),
+    State("input-filter", "value"),
+    State("input-components", "value"),
+    State("radio-align", "value"),
+    State("select-solver", "value"),
+    State("session-id", "data"),
+)
+@instrumented()
+def update_bootstrap(click, samples, mode, filter_on, filter_value, components, align_mode, solver, session_id):
+    """
+    Submits the bootstrap of the current fit and PSD as a background
+    job, show_bootstrap polls it and graphs the bands.
+    """
+    state = store.get(session_id)
+    database = session_database(state)
+    if not click or database is None or state.get("df_Jac") is None or "NPsizes_frequency" not in state:
+        raise PreventUpdate
+    df_AS, df_Jac, frequencies = state["df_AS"], state["df_Jac"], state["NPsizes_frequency"]
+    threshold = filter_value if filter_on else None
+    samples = int(samples or bootstrap.SAMPLES)
+    components = int(components or 1)
+    key = digest(
+        "bootstrap", database.key, df_AS.to_numpy(), df_Jac.to_numpy(), frequencies, align_mode, threshold,
+        components, mode, samples, solver,
+    )
+    job_id = job_queue.submit(
+        bootstrap_job, database, df_AS.Wavelength, df_AS.Absorbance, align_mode, frequencies,
+        df_Jac["Size"].to_numpy(), df_Jac["J"].to_numpy(), threshold, components, mode, samples, solver,
+        key=key,
+    )
+    return {"job": job_id}
+
+
+@app.callback(
+    Output("graph-bootstrap", "children"),
+    Output("poll-bootstrap", "disabled"),
+    Input("job-bootstrap", "data"),
+    Input("poll-bootstrap", "n_intervals"),
+    State("session-id", "data"),
+)
+@instrumented()
+def show_bootstrap(job, n_intervals, session_id):
+    """
+    Shows the progress of the bootstrap job and, when it is done, the
+    bands of the size distribution, mean and deviation.
+    """
+    import plotly.graph_objects as go
+
+    status = job_queue.status(job and job["job"])
+    if status is None:
+        return None, True
+    if status["status"] not in jobs.FINISHED:
+        return job_progress("bootstrap", status), False
+    if status["status"] == jobs.CANCELLED:
+        return html.H6("The bootstrap was cancelled."), True
+    if status["status"] == jobs.FAILED:
+        return html.H6(status["error"]), True
+
+    bands = job_queue.result(job["job"])
+    state = store.get(session_id)
+    if state.get("df_Jac") is None:
+        return html.H6("The session expired, please upload the files again."), True
+    sizes = state["df_Jac"]["Size"].to_numpy()
+    low, median, high = bands.distribution.T
+    level = round(100*bootstrap.LEVEL)
+    budget = "" if bands.samples == bands.requested else f" (of {bands.requested}, time budget reached)"
+    figure = go.Figure([
+        go.Scatter(x=sizes, y=high, mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip"),
+        go.Scatter(
+            x=sizes, y=low, mode="lines", line=dict(width=0), fill="tonexty", fillcolor="rgba(190, 75, 83, 0.3)",
+            name=f"{level}% band",
+        ),
+        go.Scatter(x=sizes, y=median, mode="lines", line=dict(color="#BE4B53"), name="Median"),
+    ])
+    figure.update_layout(
+        title="Size distribution uncertainty (bootstrap)",
+        xaxis_title="Particle size (nm)", yaxis_title="Frequency (normalized)",
+    )
+    return [
+        html.H6(
+            f"{bands.samples} resamples{budget} in {bands.seconds:.1f} s. "
+            f"Mean {bands.mean[1]:.2f} nm ({level}%: {bands.mean[0]:.2f} to {bands.mean[2]:.2f}), "
+            f"deviation {bands.deviation[1]:.2f} nm ({level}%: {bands.deviation[0]:.2f} to {bands.deviation[2]:.2f})"
+        ),
+        dcc.Graph(id="figure-bootstrap", figure=figure),
+    ], True
+
+
+@app.callback(
+    Output("cancel-bootstrap", "children"),
+    Input("cancel-bootstrap", "n_clicks"),
+    State("job-bootstrap", "data"),
+)
+@instrumented()
+def cancel_bootstrap(click, job):
+    """
+    Cancels the running bootstrap job.
+    """
+    if not click or not job:
+        raise PreventUpdate
+    job_queue.cancel(job["job"])
+    return "Cancelling..."
+
+
+# BATCH
+
+def parse_batch(progress, contents, filename, jac_contents, jac_filename, database, threshold, align_mode,
+                solver=None, handle=None, session_id=None):
+    """
+    Background job of update_batch. Deconvolves every spectrum of the
+    batch file (Wavelength column and one absorbance column per spectrum)
+    and computes their PSDs. Returns the results table, the PSDs, the
+    sizes and the names of the spectra. Problems with the files are
+    raised as ValueError with the message for the user.
+    """
+    logger.debug("parse_batch being executed!")
+    try:
+        df_batch = uploads.load_upload(handle, session_id) if handle else load_df(contents, filename)
+        df_Jac = pipeline.parse_jacobian(jac_contents, jac_filename)
+    except Exception as e:
+        logger.warning("Could not parse %s: %s", filename, e)
+        raise ValueError("There was an error processing this file. Please check metadata required and templates provided.")
+    if type(df_batch) == str or type(df_Jac) == str:
+        raise ValueError(f"Only {FORMATS} are supported.")
+
+    if df_Jac.shape[0] != database.shape[1]:
+        raise ValueError("Bad dimensions. Jacobian values should match the database columns.")
+
+    # Every spectrum is aligned with the same sparse matrix product
+    database, spectra = pipeline.align_spectra(
+        database, df_batch.iloc[:, 0], df_batch.iloc[:, 1:].to_numpy(), align_mode
+    )
+
+    names = [str(col) for col in df_batch.columns[1:]]
+    table, psds = pipeline.analyze_batch(
+        database, spectra, names,
+        df_Jac["Size"].to_numpy(), df_Jac["J"].to_numpy(), threshold, progress, solver,
+    )
+    return table, psds, df_Jac["Size"].to_numpy(), names
+
+
+def batch_results(table, psds, sizes, names):
+    """
+    Returns a list with the results table and a graph with the PSDs
+    overlaid.
+    """
+    import plotly.graph_objects as go
+
+    traces = [
+        go.Scatter(x=sizes, y=psds[:, j], mode="lines+markers", name=name)
+        for j, name in enumerate(names)
+    ]
+    return [
+        dash_table.DataTable(
+            columns=[{"name": col, "id": col} for col in table.columns],
+            data=table.round(4).to_dict("records"),
+            export_format="csv",
+            style_table={"overflowX": "auto"},
+        ),
+        dcc.Graph(
+            figure={
+                "data": traces,
+                "layout": {
+                    "title": "Particle Size Distributions",
+                    "xaxis": dict(title="Particle size (nm)"),
+                    "yaxis": dict(title="Normalized frequency")
+                }
+            }
+        ),
+    ]
+
+
+@app.callback(
+    Output("job-batch", "data"),
+    Input("upload-batch", "contents"),
+    Input("handle-batch", "value"),
+    Input("upload-Jac", "contents"),
+    Input("upload-AD", "filename"),
+    Input("select-AD", "value"),
+    Input("switch-filter", "on"),
+    Input("input-filter", "value"),
+    Input("radio-align", "value"),
+    Input("select-solver", "value"),
+    State("upload-batch", "filename"),
+    State("upload-Jac", "filename"),
+    State("session-id", "data"),
+)
+@instrumented()
+def update_batch(contents, handle, jac_contents, fn_AD, database_name, filter_on, filter_value, align_mode,
+                 solver, filename, jac_filename, session_id):
+    """
+    Called when the user uploads a batch of spectra (or changes the
+    database, Jacobian or filter) and submits parse_batch as a
+    background job, show_batch polls it and puts the results in the
+    respective div.
+    """
+    logger.debug("CORRIENDO update_batch")
+    state = store.get(session_id)
+    database = session_database(state)
+
+    # The last of dcc.Upload and the chunked upload is the one used
+    triggered = dash.callback_context.triggered[0]["prop_id"]
+    if triggered in ("upload-batch.contents", "handle-batch.value"):
+        store.update(session_id, batch_source=triggered)
+    elif state.get("batch_source"):
+        triggered = state["batch_source"]
+    if handle and (triggered == "handle-batch.value" or not contents):
+        upload = json.loads(handle)
+        filename, handle = upload["filename"], upload["handle"]
+    else:
+        handle = None
+
+    if (contents or handle) and jac_contents and database is not None:
+        threshold = filter_value if filter_on else None
+        key = digest("batch", handle or contents, jac_contents, database.key, threshold, align_mode, solver)
+        job_id = job_queue.submit(
+            parse_batch, contents, filename, jac_contents, jac_filename, database, threshold, align_mode,
+            solver, handle, session_id, key=key
+        )
+        return {"job": job_id, "filename": filename}
+    return None
+
+
+@app.callback(
+    Output("graph-batch", "children"),
+    Output("poll-batch", "disabled"),
+    Input("job-batch", "data"),
+    Input("poll-batch", "n_intervals"),
+)
+@instrumented()
+def show_batch(job, n_intervals):
+    """
+    Shows the progress of the batch job and its results when it is done.
+    Polling stops once the job is finished.
+    """
+    status = job_queue.status(job and job["job"])
+    if status is None:
+        return [html.H1(["Please upload the Absorption Database, the Jacobian"]),
+                html.H1(["and a file with one spectrum per column first."])
+                ], True
+    if status["status"] not in jobs.FINISHED:
+        return job_progress("batch", status), False
+    if status["status"] == jobs.CANCELLED:
+        return html.H1("The batch analysis was cancelled, upload the file again to run it."), True
+    if status["status"] == jobs.FAILED:
+        return [html.H1([status["error"]]),
+                html.H1("Please check metadata required and templates provided.")
+                ], True
+    return [
+        html.H6([f"Using \"{job['filename']}\""]),
+        *batch_results(*job_queue.result(job["job"]))
+    ], True
+
+
+@app.callback(
+    Output("cancel-batch", "children"),
+    Input("cancel-batch", "n_clicks"),
+    State("job-batch", "data"),
+)
+@instrumented()
+def cancel_batch(click, job):
+    """
+    Cancels the running batch job.
+    """
+    if not click or not job:
+        raise PreventUpdate
+    job_queue.cancel(job["job"])
+    return "Cancelling..."
+
+
+# LIVE KINETICS
+
+@app.callback(
+    Output("kinetics-status", "children"),
+    Output("poll-kinetics", "disabled"),
+    Input("start-kinetics", "n_clicks"),
+    Input("stop-kinetics", "n_clicks"),
+    State("input-kinetics-dir", "value"),
+    State("switch-filter", "on"),
+    State("input-filter", "value"),
+    State("input-components", "value"),
+    State("radio-align", "value"),
+    State("select-solver", "value"),
+    State("session-id", "data"),
+)
+@instrumented()
+def control_kinetics(start, stop, directory, filter_on, filter_value, components, align_mode, solver, session_id):
+    """
+    Starts a live kinetics run with the database, Jacobian and PSD
+    settings of the session (see kinetics.py), or stops it.
+    """
+    triggered = dash.callback_context.triggered[0]["prop_id"]
+    if triggered == "stop-kinetics.n_clicks":
+        kinetics.stop(store, session_id)
+        return "Live run stopped.", True
+    if not start:
+        raise PreventUpdate
+    state = store.get(session_id)
+    database = session_database(state)
+    if database is None or state.get("df_Jac") is None:
+        return "First select the database and upload the Jacobian.", True
+    df_Jac = state["df_Jac"]
+    if df_Jac.shape[0] != database.shape[1]:
+        return "The Jacobian values should match the database columns.", True
+    try:
+        watched = kinetics.watched_directory(directory) if directory else None
+    except ValueError as e:
+        return str(e), True
+
+    # Starts from the last fit of the session
+    x0 = state.get("NPsizes_frequency")
+    try:
+        run = kinetics.Run(
+            database, df_Jac["Size"], df_Jac["J"], filter_value if filter_on else None, int(components or 1),
+            align_mode, solver, x0 if x0 is not None and x0.shape[0] == database.shape[1] else None,
+        )
+    except ValueError as e:
+        return str(e), True
+    kinetics.start(store, session_id, run, watched)
+    if watched is not None:
+        return f"Watching {watched}", False
+    return f"Post the spectra to /kinetics/{session_id}", False
+
+
+@app.callback(
+    Output("graph-kinetics", "children"),
+    Input("poll-kinetics", "n_intervals"),
+    State("session-id", "data"),
+)
+@instrumented()
+def show_kinetics(n_intervals, session_id):
+    """
+    Graphs the time series of the live run (only its last points, see
+    kinetics.HISTORY) and the size distribution of the last spectrum.
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    snapshot = store.get(session_id).get("kinetics")
+    if snapshot is None:
+        return [html.H1("Select the database, upload the Jacobian,"),
+                html.H1("then click START LIVE RUN")]
+    points = snapshot["points"]
+    status = [f"{snapshot['count']} spectra"]
+    if points:
+        status.append(f", last {points[-1]['name']} in {1000*points[-1]['latency']:.0f} ms")
+    if not snapshot["running"]:
+        status.append(" (stopped)")
+    children = [html.H6(status)]
+    if snapshot["error"]:
+        children.append(html.H6(snapshot["error"], style={"color": "#BE4B53"}))
+    if not points:
+        return children
+
+    times = [point["time"] for point in points]
+    figure = make_subplots(
+        rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.05, row_heights=[0.45, 0.35, 0.2],
+    )
+    figure.add_trace(go.Scattergl(
+        x=times, y=[point["mean"] for point in points], mode="lines+markers", name="Mean (nm)",
+        text=[point["name"] for point in points],
+    ), row=1, col=1)
+    figure.add_trace(go.Scattergl(
+        x=times, y=[point["deviation"] for point in points], mode="lines+markers", name="Deviation (nm)",
+    ), row=2, col=1)
+    figure.add_trace(go.Scattergl(
+        x=times, y=[1000*point["latency"] for point in points], mode="lines", name="Latency (ms)",
+    ), row=3, col=1)
+    figure.update_xaxes(title_text="Time (s)", row=3, col=1)
+    figure.update_yaxes(title_text="Mean (nm)", row=1, col=1)
+    figure.update_yaxes(title_text="Deviation (nm)", row=2, col=1)
+    figure.update_yaxes(title_text="ms", row=3, col=1)
+    figure.update_layout(title="Live kinetics", uirevision="kinetics", height=650)
+    children.append(dcc.Graph(id="figure-kinetics", figure=figure))
+    if snapshot["y"] is not None:
+        children.append(dcc.Graph(id="figure-kinetics-PSD", figure={
+            "data": [go.Bar(x=snapshot["sizes"], y=snapshot["y"], name="Last spectrum")],
+            "layout": {
+                "title": "Size distribution of the last spectrum",
+                "xaxis": dict(title="Particle size (nm)"), "yaxis": dict(title="Normalized frequency"),
+                "uirevision": "kinetics",
+            },
+        }))
+    return children
+
+
 # EXPORT
 
 @app.callback(
@@ -642,30 +1520,44 @@ def update_Jac(contents, filter_on, filter_value, bin_size, fn_AS, fn_AD, filena
     Input("btn-download", "n_clicks"),
     State("switch-scale", "on"),
     State("input-scale", "value"),
+    State("select-export", "value"),
+    State("check-float32", "value"),
+    State("session-id", "data"),
 )
-def download_df(click, scale_on, scale_value):
+@instrumented()
+def download_df(click, scale_on, scale_value, extension, precision, session_id):
     """
     Sends the PSD data to a Download component when
-    export button is clicked.
+    export button is clicked, in the format chosen (see
+    utils.write_table).
     """
+    import pandas as pd
+
     if click is None:
         raise PreventUpdate
-    print("DEBUG: CORRIENDO download_df")
-    global y_data
+    logger.debug("CORRIENDO download_df")
+    state = store.get(session_id)
+    if "y_data" not in state:
+        raise PreventUpdate
+    y_data = state["y_data"]
+    df_Jac = state["df_Jac"]
     if scale_on:
         data = y_data/y_data.sum()*scale_value
     else:
         data = y_data/y_data.sum()
-    df = pd.DataFrame(data=dict(freq=data.values), index=df_Jac["Size"])
-    df.index.name = "size"
+    df = pd.DataFrame(dict(size=df_Jac["Size"].to_numpy(), freq=data))
     if click:
-        return dcc.send_data_frame(df.to_csv, "PSD_data.csv")
+        return dcc.send_bytes(
+            lambda f: write_table(df, f, extension, float32="float32" in (precision or [])),
+            f"PSD_data{extension}",
+        )
 
 
 @app.callback(
     Output("download-template", "data"),
     Input("btn-template", "n_clicks")
 )
+@instrumented()
 def download_template(click):
     """
     Sends the templates.zip file to the Download component
@@ -679,6 +1571,7 @@ def download_template(click):
     Output("download-sample", "data"),
     Input("btn-sample", "n_clicks")
 )
+@instrumented()
 def download_sample(click):
     """
     Sends the sample_data.zip file to the Download component
@@ -689,6 +1582,26 @@ def download_sample(click):
     return dcc.send_file(PATH / "data" / "sample_data.zip")
 
 
+def prewarm():
+    """
+    Does now what the first requests of this process would wait for:
+    imports the modules imported on first use, loads the registry
+    databases and builds the layout. gunicorn.conf.py runs it in each
+    worker after fork.
+    """
+    with startup.phase("prewarm.imports"):
+        for module in PREWARM_MODULES:
+            importlib.import_module(module)
+    with startup.phase("prewarm.registry"):
+        registry.load()
+    static_layout()
+    startup.report("prewarm")
+
+
+startup.mark("callbacks")
+startup.report()
+
+
 if __name__ == '__main__':
     app.run_server(port=5050, debug=True)
     # app.run_server(host="0.0.0.0", debug=True)
@@ -0,0 +1,81 @@
+/* Chunked upload of large files (see uploads.py).
+   Buttons with class "chunked-upload" and a data-target attribute open
+   a file dialog, send the file in chunks to /upload and then write
+   {"handle": ..., "filename": ...} to the (hidden) dcc.Input with the
+   data-target id, which triggers the callbacks. The uploads belong to
+   the session id in the data-session attribute of #upload-session. */
+(function () {
+    var CHUNK = 4 * 1024 * 1024;
+
+    function setInputValue(input, value) {
+        // React only sees values set through the native setter
+        var setter = Object.getOwnPropertyDescriptor(window.HTMLInputElement.prototype, "value").set;
+        setter.call(input, value);
+        input.dispatchEvent(new Event("input", { bubbles: true }));
+    }
+
+    function checked(response) {
+        if (!response.ok) {
+            return response.json().then(function (body) {
+                throw new Error(body.error || response.statusText);
+            });
+        }
+        return response.json();
+    }
+
+    function upload(file, button, target) {
+        var label = button.textContent;
+        var session = document.getElementById("upload-session").getAttribute("data-session");
+        var query = "?session=" + encodeURIComponent(session);
+        var offset = 0;
+        var handle;
+
+        function next() {
+            if (offset >= file.size) {
+                return fetch("/upload/" + handle + "/finish" + query, { method: "POST" }).then(checked);
+            }
+            var chunk = file.slice(offset, offset + CHUNK);
+            return fetch("/upload/" + handle + query + "&offset=" + offset, {
+                method: "PUT",
+                headers: { "Content-Type": "application/octet-stream" },
+                body: chunk
+            }).then(checked).then(function (body) {
+                offset = body.received;
+                button.textContent = Math.round(100 * offset / file.size) + "%";
+                return next();
+            });
+        }
+
+        fetch("/upload/start", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ filename: file.name, session: session })
+        }).then(checked).then(function (body) {
+            handle = body.handle;
+            return next();
+        }).then(function () {
+            button.textContent = label;
+            setInputValue(target, JSON.stringify({ handle: handle, filename: file.name }));
+        }).catch(function (error) {
+            button.textContent = label;
+            window.alert("Upload failed: " + error.message);
+        });
+    }
+
+    document.addEventListener("click", function (event) {
+        var button = event.target.closest(".chunked-upload");
+        if (!button) {
+            return;
+        }
+        var target = document.getElementById(button.getAttribute("data-target"));
+        var picker = document.createElement("input");
+        picker.type = "file";
+        picker.accept = ".csv,.xls,.xlsx,.npz,.npy,.parquet";
+        picker.addEventListener("change", function () {
+            if (picker.files.length) {
+                upload(picker.files[0], button, target);
+            }
+        });
+        picker.click();
+    });
+})();
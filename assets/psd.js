@@ -0,0 +1,105 @@
+/* Clientside callbacks of the PSD tab (see update_Jac in app.py).
+   The server sends the weighted size distribution and the lognormal fit
+   once, the bin size and the filter are applied here. The histogram is
+   the same as binning.weighted_histogram. */
+(function () {
+    var no_update = window.dash_clientside.no_update;
+
+    function binEdges(sizes, binSize) {
+        var low = Math.min.apply(null, sizes);
+        var high = Math.max.apply(null, sizes);
+        if (!binSize || binSize <= 0) {
+            binSize = (high - low) / Math.max(sizes.length - 1, 1) || 1;
+        }
+        var start = Math.floor(low / binSize) * binSize;
+        var nBins = Math.floor((high - start) / binSize) + 1;
+        var edges = [];
+        for (var i = 0; i <= nBins; i++) {
+            edges.push(start + binSize * i);
+        }
+        return edges;
+    }
+
+    function weightedHistogram(sizes, weights, binSize) {
+        var edges = binEdges(sizes, binSize);
+        var nBins = edges.length - 1;
+        var width = edges[1] - edges[0];
+        var counts = new Array(nBins).fill(0);
+        var total = 0;
+        sizes.forEach(function (size, j) {
+            // Same bin as numpy.histogram, corrected for rounding at the edges
+            var i = Math.min(Math.floor((size - edges[0]) / width), nBins - 1);
+            if (size < edges[i]) {
+                i -= 1;
+            } else if (i < nBins - 1 && size >= edges[i + 1]) {
+                i += 1;
+            }
+            counts[i] += weights[j];
+            total += weights[j];
+        });
+        return {
+            centers: edges.slice(0, -1).map(function (edge, i) { return 0.5 * (edge + edges[i + 1]); }),
+            widths: edges.slice(0, -1).map(function (edge, i) { return edges[i + 1] - edge; }),
+            probabilities: counts.map(function (count) { return total > 0 ? count / total : count; })
+        };
+    }
+
+    function applyFilter(sizes, y, threshold) {
+        // Same as pipeline.apply_filter
+        return y.map(function (value, i) { return threshold !== null && sizes[i] < threshold ? 0 : value; });
+    }
+
+    function annotation(x, y, text) {
+        return { x: x, y: y, text: text, showarrow: false, font: { size: 25, color: "black" } };
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside);
+    window.dash_clientside.ddd = Object.assign({}, window.dash_clientside.ddd, {
+        /* Returns the PSD figure, and asks the server for a new fit only
+           when the filter changes the data the current fit used. */
+        psd_figure: function (data, binSize, filterOn, filterValue) {
+            if (!data) {
+                return [no_update, no_update];
+            }
+            var threshold = filterOn && filterValue !== null && filterValue !== undefined ? filterValue : null;
+            var y = applyFilter(data.sizes, data.y, threshold);
+            var fitted = applyFilter(data.sizes, data.y, data.threshold);
+            var refit = y.some(function (value, i) { return value !== fitted[i]; });
+
+            var hist = weightedHistogram(data.sizes, y, binSize);
+            var maximum = Math.max.apply(null, y);
+            var sum = y.reduce(function (a, b) { return a + b; }, 0);
+            // Probability of the most frequent size, scales the fit to the bars
+            var factor = sum > 0 ? maximum / sum : 0;
+            var scale = function (values) { return values.map(function (value) { return value * factor; }); };
+
+            var traces = [
+                {
+                    type: "bar", x: hist.centers, y: hist.probabilities, width: hist.widths,
+                    name: "PSD by DdD", marker: { line: { width: 1 } }
+                },
+                { type: "scatter", x: data.fit.x, y: scale(data.fit.y), name: "Lognormal fit" }
+            ];
+            (data.fit.components || []).forEach(function (component, k) {
+                traces.push({
+                    type: "scatter", x: data.fit.x, y: scale(component), name: "Component " + (k + 1),
+                    line: { dash: "dot" }
+                });
+            });
+            var xMax = Math.max.apply(null, data.sizes);
+            var figure = {
+                data: traces,
+                layout: {
+                    title: { text: "Particle Size Distribution by DdD" },
+                    xaxis: { title: { text: "Particle size (nm)" } },
+                    yaxis: { title: { text: "Density distribution" } },
+                    annotations: [
+                        annotation(4 / 5 * xMax, 4.1 / 5 * maximum * factor, "Mean = " + data.mean.toFixed(2) + " nm"),
+                        annotation(4 / 5 * xMax, 4.9 / 7 * maximum * factor, "Deviation = " + data.deviation.toFixed(2) + " nm")
+                    ]
+                }
+            };
+            return [figure, refit ? { threshold: threshold } : no_update];
+        }
+    });
+})();
@@ -0,0 +1,413 @@
+"""
+Load test: concurrent analyst sessions driving the callbacks of the app
+over HTTP, the way the browser does. Each session loads the layout (for
+its session id and the default values of the controls), then repeats
+the analysis: upload the spectrum, upload the database, execute the
+NNLS and poll it until it is drawn, upload the Jacobian, change the
+filter (which refits the PSD; bin size changes are drawn in the browser
+and never reach the server) and export the PSD.
+
+    python benchmarks/load.py --sessions 8 --iterations 3 --workers 2
+    python benchmarks/load.py --url http://127.0.0.1:8050 --sessions 20 --databases sample,500
+
+Without --url, a gunicorn server (app:server, as in the Procfile) is
+started on a free port with --workers and --threads, its stores and
+job queue in a temporary directory. Sessions take the databases of
+--databases in turn: "sample" is the data/ files, a number a synthetic
+database with that many sizes (see synthetic.py). Each session's
+spectrum has its own noise, so no fit is shared between sessions.
+
+Prints the throughput and the p50/p95/p99 latencies of every step, and
+saves every request to --output. A step fails when the server answers
+with an error or the answer is not the one expected for the session
+(an error message, a failed job or a PSD of the wrong dimensions, the
+usual signs of state mixed between sessions).
+"""
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import synthetic  # noqa: E402
+
+# Outputs of the callbacks of each step
+OUTPUTS = {
+    "upload_AS": "graph-AS.children",
+    "upload_AD": "graph-AD.children",
+    "execute_NNLS": "job-NNLS.data",
+    "poll_NNLS": "..graph-NNLS.children...poll-NNLS.disabled..",
+    "upload_Jac": "graph-PSD.children",
+    "refit_PSD": "graph-PSD.children",
+    "export": "download-PSD.data",
+}
+# Strings of the answers that mean the step went wrong
+ERRORS = ("There was an error", "Bad dimensions", "Please upload", "session expired", "was cancelled")
+
+
+def data_url(df, mimetype="text/csv"):
+    return f"data:{mimetype};base64," + base64.b64encode(df.to_csv(index=False).encode()).decode()
+
+
+def inputs_for(database, n_wavelengths, seed):
+    """
+    (name, data URL) of the spectrum, database and Jacobian of a session
+    on database ("sample" or a number of sizes).
+    """
+    if database == "sample":
+        df_AD = pd.read_csv(ROOT / "data" / "DataAD.csv")
+        df_AS = pd.read_csv(ROOT / "data" / "DataAS.csv")
+        df_Jac = pd.read_csv(ROOT / "data" / "Jacobian.csv")
+        rng = np.random.default_rng(seed)
+        df_AS.iloc[:, 1] *= 1 + 1e-3*rng.standard_normal(len(df_AS))
+    else:
+        df_AD = synthetic.make_database(int(database), n_wavelengths)
+        df_AS = synthetic.make_spectrum(df_AD, seed=seed)
+        df_Jac = synthetic.make_jacobian(df_AD)
+    return {
+        "AS": (f"AS-{seed}.csv", data_url(df_AS)),
+        "AD": (f"AD-{database}.csv", data_url(df_AD)),
+        "Jac": (f"Jac-{database}.csv", data_url(df_Jac)),
+        "sizes": df_AD.shape[1] - 1,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, threads, directory):
+    """
+    Starts gunicorn app:server and returns (process, url) once it answers.
+    """
+    port = free_port()
+    env = dict(
+        os.environ,
+        DDD_STORE_BACKEND=os.environ.get("DDD_STORE_BACKEND", "disk"),
+        DDD_STORE_DIR=os.path.join(directory, "sessions"),
+        DDD_JOB_BACKEND=os.environ.get("DDD_JOB_BACKEND", "sqlite"),
+        DDD_JOB_DB=os.path.join(directory, "jobs.sqlite"),
+        DDD_RESULT_CACHE_DIR=os.path.join(directory, "results"),
+    )
+    log = open(os.path.join(directory, "server.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:server", "--bind", f"127.0.0.1:{port}",
+         "--workers", str(workers), "--threads", str(threads), "--timeout", "300"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited, see {log.name}")
+        try:
+            urllib.request.urlopen(url + "/metrics", timeout=5).read()
+            return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"The server did not start, see {log.name}")
+
+
+def request(url, body=None, timeout=300):
+    """
+    (status, decoded answer, bytes received) of a GET, or of a POST of
+    body as JSON.
+    """
+    data = None if body is None else json.dumps(body).encode()
+    headers = {"Accept-Encoding": "gzip"}
+    if data is not None:
+        headers["Content-Type"] = "application/json"
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, headers), timeout=timeout) as response:
+            status, raw, encoding = response.status, response.read(), response.headers.get("Content-Encoding")
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode(errors="replace"), 0
+    text = (gzip.decompress(raw) if encoding == "gzip" else raw).decode()
+    return status, text, len(raw)
+
+
+def layout_values(layout):
+    """
+    Initial values of the props of the components of the layout, by
+    "id.property".
+    """
+    values = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            props = node.get("props", {})
+            if isinstance(props.get("id"), str):
+                for name, value in props.items():
+                    if name not in ("id", "children"):
+                        values[f"{props['id']}.{name}"] = value
+            stack.append(props.get("children"))
+    return values
+
+
+class Session:
+    """
+    One browser tab: the values of its controls and the timings of its
+    requests.
+    """
+
+    def __init__(self, url, callbacks, inputs, number, poll_seconds):
+        self.url = url
+        self.callbacks = callbacks
+        self.inputs = inputs
+        self.number = number
+        self.poll_seconds = poll_seconds
+        self.records = []
+        status, text, _ = request(url + "/_dash-layout")
+        if status != 200:
+            raise RuntimeError(f"/_dash-layout answered {status}")
+        self.values = layout_values(json.loads(text))
+
+    def call(self, step, changed, values):
+        """
+        Sets values (by "id.property"), then calls the callback of step as
+        if the props in changed had just changed, and records it. Returns
+        (ok, response).
+        """
+        self.values.update(values)
+        output = OUTPUTS[step]
+        callback = self.callbacks[output]
+
+        def props(items):
+            return [dict(item, value=self.values.get(f"{item['id']}.{item['property']}")) for item in items]
+
+        outputs = [
+            dict(id=item.split(".")[0], property=item.split(".")[1])
+            for item in output.strip(".").split("...")
+        ]
+        body = dict(
+            output=output, outputs=outputs if len(outputs) > 1 else outputs[0],
+            inputs=props(callback["inputs"]), state=props(callback["state"]), changedPropIds=changed,
+        )
+        start = time.perf_counter()
+        status, text, nbytes = request(self.url + "/_dash-update-component", body)
+        seconds = time.perf_counter() - start
+        response = json.loads(text).get("response", {}) if status == 200 else {}
+        ok = status in (200, 204) and not any(error in text for error in ERRORS)
+        self.records.append({
+            "step": step, "session": self.number, "status": status, "ok": ok, "seconds": seconds,
+            "bytes": nbytes, "time": time.time(),
+        })
+        return ok, response
+
+    def check(self, ok, step, condition):
+        """
+        Marks the last record of step as failed unless condition.
+        """
+        if ok and not condition:
+            self.records[-1]["ok"] = False
+            return False
+        return ok
+
+    def run(self):
+        """
+        One pass of the analysis. Returns whether every step succeeded.
+        """
+        begin = time.perf_counter()
+        inputs = self.inputs
+
+        name, contents = inputs["AS"]
+        ok, _ = self.call("upload_AS", ["upload-AS.contents"], {
+            "upload-AS.contents": contents, "upload-AS.filename": name,
+        })
+        name, contents = inputs["AD"]
+        ok &= self.call("upload_AD", ["upload-AD.contents"], {
+            "upload-AD.contents": contents, "upload-AD.filename": name,
+        })[0]
+
+        nnls_start = time.perf_counter()
+        ok_job, response = self.call("execute_NNLS", ["execute-nnls.n_clicks"], {
+            "execute-nnls.n_clicks": (self.values.get("execute-nnls.n_clicks") or 0) + 1,
+        })
+        job = response.get("job-NNLS", {}).get("data")
+        fitted = self.check(ok_job, "execute_NNLS", job is not None)
+        if fitted:
+            self.values["job-NNLS.data"] = job
+            polls = 0
+            while True:
+                fitted, response = self.call("poll_NNLS", ["poll-NNLS.n_intervals"], {
+                    "poll-NNLS.n_intervals": polls,
+                })
+                polls += 1
+                if not fitted or response.get("poll-NNLS", {}).get("disabled"):
+                    break
+                time.sleep(self.poll_seconds)
+            fitted = self.check(fitted, "poll_NNLS", "figure-NNLS" in json.dumps(response))
+            self.records.append({
+                "step": "NNLS_end_to_end", "session": self.number, "status": 200, "ok": fitted,
+                "seconds": time.perf_counter() - nnls_start, "bytes": 0, "time": time.time(),
+            })
+        ok &= fitted
+
+        name, contents = inputs["Jac"]
+        ok_psd, response = self.call("upload_Jac", ["upload-Jac.contents"], {
+            "upload-Jac.contents": contents, "upload-Jac.filename": name, "switch-filter.on": False,
+        })
+        # The PSD has the sizes of this session's database
+        psd = _find(response.get("graph-PSD", {}).get("children"), "data-PSD")
+        ok &= self.check(ok_psd, "upload_Jac", psd is not None and len(psd["data"]["sizes"]) == inputs["sizes"])
+
+        if psd is not None:
+            threshold = float(np.median(psd["data"]["sizes"]))
+            ok_refit, response = self.call("refit_PSD", ["refit-PSD.data"], {
+                "refit-PSD.data": {"threshold": threshold}, "switch-filter.on": True,
+                "input-filter.value": threshold,
+            })
+            refit = _find(response.get("graph-PSD", {}).get("children"), "data-PSD")
+            ok &= self.check(ok_refit, "refit_PSD", refit is not None and refit["data"]["threshold"] == threshold)
+
+        ok_export, response = self.call("export", ["btn-download.n_clicks"], {
+            "btn-download.n_clicks": (self.values.get("btn-download.n_clicks") or 0) + 1,
+        })
+        ok &= self.check(ok_export, "export", bool(response.get("download-PSD", {}).get("data")))
+        self.records.append({
+            "step": "session", "session": self.number, "status": 200, "ok": bool(ok),
+            "seconds": time.perf_counter() - begin, "bytes": 0, "time": time.time(),
+        })
+        return ok
+
+
+def _find(tree, component_id):
+    """
+    Props of the component with component_id in a layout tree.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            props = node.get("props", {})
+            if props.get("id") == component_id:
+                return props
+            stack.append(props.get("children"))
+    return None
+
+
+def percentiles(seconds):
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {"p50_s": p50, "p95_s": p95, "p99_s": p99, "mean_s": float(np.mean(seconds))}
+
+
+def report(records, wall):
+    """
+    Throughput, latencies and failures of each step.
+    """
+    summary = {}
+    order = [*OUTPUTS, "NNLS_end_to_end", "session"]
+    for step in sorted({record["step"] for record in records}, key=order.index):
+        selected = [record for record in records if record["step"] == step]
+        summary[step] = dict(
+            count=len(selected), failed=sum(not record["ok"] for record in selected),
+            per_second=len(selected)/wall, mean_bytes=float(np.mean([record["bytes"] for record in selected])),
+            **percentiles([record["seconds"] for record in selected]),
+        )
+    print(
+        f"{'step':>16} {'count':>6} {'failed':>6} {'per s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'KB':>8}",
+        file=sys.stderr,
+    )
+    for step, row in summary.items():
+        print(
+            f"{step:>16} {row['count']:6d} {row['failed']:6d} {row['per_second']:7.2f} {row['p50_s']*1000:9.1f} "
+            f"{row['p95_s']*1000:9.1f} {row['p99_s']*1000:9.1f} {row['mean_bytes']/1024:8.1f}",
+            file=sys.stderr,
+        )
+    return summary
+
+
+def run(url, sessions, iterations, databases, n_wavelengths, poll_seconds):
+    status, text, _ = request(url + "/_dash-dependencies")
+    if status != 200:
+        raise RuntimeError(f"/_dash-dependencies answered {status}")
+    callbacks = {callback["output"]: callback for callback in json.loads(text)}
+    inputs = [inputs_for(databases[i % len(databases)], n_wavelengths, i) for i in range(sessions)]
+    lock = threading.Lock()
+    records = []
+
+    def analyst(number):
+        session = Session(url, callbacks, inputs[number], number, poll_seconds)
+        for _ in range(iterations):
+            try:
+                session.run()
+            except Exception as e:
+                print(f"Session {number}: {type(e).__name__}: {e}", file=sys.stderr)
+                session.records.append({
+                    "step": "session", "session": number, "status": None, "ok": False, "seconds": 0,
+                    "bytes": 0, "time": time.time(),
+                })
+        with lock:
+            records.extend(session.records)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(analyst, range(sessions)))
+    wall = time.perf_counter() - start
+    return records, wall
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of concurrent analyst sessions.")
+    parser.add_argument("--url", default=None, help="Server to test (default: start one with gunicorn)")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="Analyses per session")
+    parser.add_argument("--databases", default="sample,200",
+                        help="Comma separated databases taken in turn by the sessions: sample or a number of sizes")
+    parser.add_argument("--wavelengths", type=int, default=300, help="Rows of the synthetic databases")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers of the started server")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--poll-ms", type=float, default=250, help="Time between polls of the NNLS job")
+    parser.add_argument("--output", default="load.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    databases = args.databases.split(",")
+    with tempfile.TemporaryDirectory(prefix="ddd-load-") as directory:
+        process, url = (None, args.url) if args.url else start_server(args.workers, args.threads, directory)
+        try:
+            records, wall = run(url, args.sessions, args.iterations, databases, args.wavelengths, args.poll_ms/1000)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(30)
+    summary = report(records, wall)
+    failed = sum(not record["ok"] for record in records if record["step"] == "session")
+    print(f"{args.sessions} sessions x {args.iterations} analyses in {wall:.1f} s, {failed} failed", file=sys.stderr)
+    with open(args.output, "w") as file:
+        json.dump({
+            "date": datetime.datetime.now().isoformat(timespec="seconds"), "url": args.url,
+            "sessions": args.sessions, "iterations": args.iterations, "databases": databases,
+            "workers": None if args.url else args.workers, "threads": None if args.url else args.threads,
+            "wall_s": wall, "summary": summary, "requests": records,
+        }, file, indent=2)
+    print(f"Results in {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Bytes and encoding time of the figure responses of the NNLS callback
+(the spectra figure of update_NNLS and show_NNLS, which parse_AD also
+draws for the database) with each JSON engine and array encoding, and
+their sizes and compression times with gzip and brotli.
+
+    python benchmarks/payload.py --sizes 11,100,1000 --output payload.json
+
+"before" is the figure as the app first built it (one go.Scatter per
+size, every point, inside a dcc.Graph) in the JSON of Dash 1 (json.dumps
+with PlotlyJSONEncoder), without compression.
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import numpy as np  # noqa: E402
+import plotly.graph_objs as go  # noqa: E402
+import plotly.io.json  # noqa: E402
+from _plotly_utils.utils import PlotlyJSONEncoder  # noqa: E402
+
+import synthetic  # noqa: E402
+import databases  # noqa: E402
+import plots  # noqa: E402
+import transport  # noqa: E402
+
+# (name, plotly JSON engine, typed arrays), typed arrays None for the
+# figure of the original app
+VARIANTS = [
+    ("before", "json", None),
+    ("orjson", "orjson", "0"),
+    ("orjson_typed", "orjson", "1"),
+]
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        times.append(time.perf_counter() - start)
+    return value, statistics.median(times)
+
+
+def nnls_response(n_sizes, n_wavelengths):
+    """
+    Body of the response of the NNLS figure callback, as Dash builds it.
+    """
+    df_AD = synthetic.make_database(n_sizes, n_wavelengths)
+    df_AS = synthetic.make_spectrum(df_AD)
+    database = databases.Database.from_frame("bench", df_AD)
+    frequencies, _ = database.solve(df_AS.Absorbance.to_numpy())
+    figure = plots.spectra_figure(
+        database.wavelengths, database.matrix*frequencies, database.sizes, "Absorption Spectra",
+        extra=[
+            (df_AS.Wavelength.to_numpy(), df_AS.Absorbance.to_numpy(), "Data"),
+            (database.wavelengths, database.matrix @ frequencies, "Fit"),
+        ],
+    )
+    return {"multi": True, "response": {"figure-NNLS": {"figure": figure}}}
+
+
+def baseline_response(n_sizes, n_wavelengths):
+    """
+    Body of the response of the NNLS callback of the original app, which
+    returned a dcc.Graph with a go.Scatter of every point of every size.
+    """
+    import dash_core_components as dcc
+
+    df_AD = synthetic.make_database(n_sizes, n_wavelengths)
+    df_AS = synthetic.make_spectrum(df_AD)
+    database = databases.Database.from_frame("bench", df_AD)
+    frequencies, _ = database.solve(df_AS.Absorbance.to_numpy())
+    df_NNLS = df_AD[df_AD.columns[1:]]
+    traces = [
+        go.Scatter(x=df_AS.Wavelength, y=df_AS.Absorbance, mode="lines", name="Data"),
+        go.Scatter(x=df_AS.Wavelength, y=np.matmul(df_NNLS, frequencies), mode="lines", name="Fit"),
+        *[go.Scatter(x=df_AD.Wavelength, y=df_AD[col]*frequencies[j], name=col)
+          for j, col in enumerate(df_NNLS.columns)],
+    ]
+    layout = {
+        "title": "Absorption Spectra",
+        "xaxis": dict(title="Wavelength (nm)"),
+        "yaxis": dict(title="Absorbance"),
+    }
+    graph = dcc.Graph(figure={"data": traces, "layout": layout})
+    return {"multi": True, "response": {"graph-NNLS": {"children": graph}}}
+
+
+def run(sizes, n_wavelengths, repeat):
+    encoders = {
+        "json": lambda body: json.dumps(body, cls=PlotlyJSONEncoder),
+        "orjson": lambda body: plotly.io.json.to_json_plotly(body, engine="orjson"),
+    }
+    encodings = ["gzip"] + (["br"] if transport._brotli() is not None else [])
+    results = []
+    for n_sizes in sizes:
+        for name, engine, typed in VARIANTS:
+            plotly.io.json.config.default_engine = engine
+            if typed is None:
+                body = baseline_response(n_sizes, n_wavelengths)
+            else:
+                plots.TYPED_ARRAYS = typed
+                body = nnls_response(n_sizes, n_wavelengths)
+            text, seconds = timed(lambda: encoders[engine](body), repeat)
+            data = text.encode()
+            result = {
+                "name": name, "n_sizes": n_sizes, "n_wavelengths": n_wavelengths,
+                "bytes": len(data), "encode_s": seconds,
+            }
+            for encoding in encodings:
+                compressed, compress_s = timed(lambda: transport.compress(data, encoding), repeat)
+                result[f"{encoding}_bytes"] = len(compressed)
+                result[f"{encoding}_s"] = compress_s
+            results.append(result)
+            print(
+                f"{name:>14} {n_wavelengths:>5}x{n_sizes:<5} {len(data)/1024:9.1f} KB {seconds*1000:8.2f} ms"
+                + "".join(
+                    f"  {encoding} {result[f'{encoding}_bytes']/1024:8.1f} KB {result[f'{encoding}_s']*1000:7.2f} ms"
+                    for encoding in encodings
+                ),
+                file=sys.stderr,
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sizes and encoding times of the figure responses.")
+    parser.add_argument("--sizes", default="11,100,1000",
+                        help="Comma separated amounts of database columns (sizes)")
+    parser.add_argument("--wavelengths", type=int, default=1000, help="Rows of the databases")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each step")
+    parser.add_argument("--output", default="payload.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    results = run([int(size) for size in args.sizes.split(",")], args.wavelengths, args.repeat)
+    with open(args.output, "w") as file:
+        json.dump({"benchmarks": results}, file, indent=2)
+    print(f"Results in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmarks of the deconvolution hot paths on synthetic databases of
+increasing size. Each step is timed on its own and end to end, and its
+peak memory is measured in a separate (tracemalloc) run.
+
+    python benchmarks/run.py --sizes 11,100,1000 --output bench.json
+    python benchmarks/run.py --compare before.json after.json
+"""
+import argparse
+import base64
+import datetime
+import io
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import numpy as np  # noqa: E402
+import plotly  # noqa: E402
+import plotly.graph_objects as go  # noqa: E402
+import plotly.io.json  # noqa: E402
+import scipy  # noqa: E402
+from scipy.optimize import curve_fit, nnls  # noqa: E402
+
+import synthetic  # noqa: E402
+import databases  # noqa: E402
+import fitting  # noqa: E402
+import pipeline  # noqa: E402
+import plots  # noqa: E402
+import transport  # noqa: E402
+import utils  # noqa: E402
+from binning import weighted_histogram  # noqa: E402
+
+
+def data_url(payload):
+    return "data:application/octet-stream;base64," + base64.b64encode(payload).decode()
+
+
+def measure(func, repeat):
+    """
+    Median and minimum wall time of func over repeat runs, after one
+    untimed run (imports, lazy factorizations and first allocations are
+    not part of any step), and the peak memory of one more run traced
+    with tracemalloc.
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": statistics.median(times), "min_s": min(times), "peak_bytes": peak}
+
+
+def cases(n_sizes, n_wavelengths, xlsx):
+    """
+    (name, function) of every step for a database of the given shape.
+    """
+    df_AD = synthetic.make_database(n_sizes, n_wavelengths)
+    df_AS = synthetic.make_spectrum(df_AD)
+    df_Jac = synthetic.make_jacobian(df_AD)
+    csv_url = data_url(df_AD.to_csv(index=False).encode())
+    database = databases.Database.from_frame("bench", df_AD)
+    absorbance = df_AS.Absorbance.to_numpy()
+    frequencies, _ = database.solve(absorbance)
+    sizes, jacobian = df_Jac.Size.to_numpy(), df_Jac.J.to_numpy()
+    y_data = np.asarray(pipeline.weight_frequencies(frequencies, jacobian))
+
+    def load_csv():
+        utils.parse_cache.clear()
+        utils.load_df(csv_url, "bench.csv")
+
+    def load_csv_cached():
+        utils.load_df(csv_url, "bench.csv")
+
+    def nnls_full():
+        nnls(database.matrix, absorbance)
+
+    def nnls_database():
+        database.solve(absorbance)
+
+    def nnls_warm():
+        # Next spectrum of a series, started from the previous solution
+        database.nnls(absorbance*1.01, "active-set", frequencies)
+
+    def nnls_fista():
+        database.nnls(absorbance, "fista")
+
+    def factorize():
+        databases.Database.from_frame("bench", df_AD)
+
+    def histogram():
+        weighted_histogram(sizes, y_data, 0.35)
+
+    def legacy_curve_fit():
+        try:
+            curve_fit(utils.lognormal, sizes, y_data)
+        except RuntimeError:
+            pass
+
+    def lognormal_fit():
+        fitting.fit_lognormal(sizes, y_data)
+
+    def legacy_figure():
+        traces = [go.Scatter(x=database.wavelengths, y=absorbance, mode="lines", name="Data")]
+        traces += [
+            go.Scatter(x=database.wavelengths, y=database.matrix[:, i]*frequencies[i], name=col)
+            for i, col in enumerate(database.sizes)
+        ]
+        go.Figure(data=traces).to_json()
+
+    def figure():
+        # NNLS figure of the app (downsampled Scattergl traces or a heatmap)
+        # encoded with the JSON engine of its responses
+        figure = plots.spectra_figure(
+            database.wavelengths, database.matrix*frequencies, database.sizes, "Absorption Spectra",
+            extra=[(database.wavelengths, absorbance, "Data")],
+        )
+        plotly.io.json.to_json_plotly(figure, engine=transport.JSON_ENGINE)
+
+    def end_to_end():
+        utils.parse_cache.clear()
+        for stage_cache in pipeline.stage_caches.values():
+            stage_cache.clear()
+        df = utils.load_df(csv_url, "bench.csv")
+        fresh = databases.Database.from_frame("bench", df)
+        aligned_database, spectrum = pipeline.align_spectra(fresh, df_AS.Wavelength, absorbance)
+        x, _ = aligned_database.solve(spectrum)
+        try:
+            pipeline.compute_psd(x, sizes, jacobian, None, 0.35)
+        except RuntimeError:
+            pass
+
+    steps = [
+        ("load_df_csv", load_csv),
+        ("load_df_csv_cached", load_csv_cached),
+    ]
+    if xlsx:
+        buffer = io.BytesIO()
+        df_AD.to_excel(buffer, index=False)
+        xlsx_url = data_url(buffer.getvalue())
+
+        def load_xlsx():
+            utils.parse_cache.clear()
+            utils.load_df(xlsx_url, "bench.xlsx")
+
+        steps.append(("load_df_xlsx", load_xlsx))
+    binary_urls = {}
+    for extension in (".npy", ".npz"):
+        buffer = io.BytesIO()
+        utils.write_table(df_AD, buffer, extension)
+        binary_urls[extension] = data_url(buffer.getvalue())
+
+    def load_npy():
+        utils.parse_cache.clear()
+        utils.load_df(binary_urls[".npy"], "bench.npy")
+
+    def load_npz():
+        utils.parse_cache.clear()
+        utils.load_df(binary_urls[".npz"], "bench.npz")
+
+    steps += [
+        ("load_df_npy", load_npy),
+        ("load_df_npz", load_npz),
+        ("database_factorization", factorize),
+        ("nnls_full_matrix", nnls_full),
+        ("nnls_database_qr", nnls_database),
+        ("nnls_active_set_warm", nnls_warm),
+        ("nnls_fista", nnls_fista),
+        ("weighted_histogram", histogram),
+        ("curve_fit_legacy", legacy_curve_fit),
+        ("fit_lognormal", lognormal_fit),
+        ("figure_nnls_json_legacy", legacy_figure),
+        ("figure_nnls_json", figure),
+        ("end_to_end", end_to_end),
+    ]
+    return steps
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, n_wavelengths, repeat, xlsx_limit):
+    results = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "versions": {"numpy": np.__version__, "scipy": scipy.__version__, "plotly": plotly.__version__},
+        "benchmarks": [],
+    }
+    for n_sizes in sizes:
+        for name, func in cases(n_sizes, n_wavelengths, n_sizes <= xlsx_limit):
+            result = measure(func, repeat)
+            result.update(name=name, n_sizes=n_sizes, n_wavelengths=n_wavelengths)
+            results["benchmarks"].append(result)
+            print(
+                f"{name:>24} {n_wavelengths:>5}x{n_sizes:<5} "
+                f"{result['median_s']*1000:10.3f} ms {result['peak_bytes']/1024**2:9.2f} MB",
+                file=sys.stderr,
+            )
+    return results
+
+
+def compare(before_path, after_path):
+    """
+    Prints the ratio of the median times of two result files.
+    """
+    def by_key(path):
+        with open(path) as file:
+            data = json.load(file)
+        return data, {(b["name"], b["n_sizes"], b["n_wavelengths"]): b for b in data["benchmarks"]}
+
+    before, old = by_key(before_path)
+    after, new = by_key(after_path)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for key in sorted(old.keys() & new.keys(), key=lambda key: (key[1], key[0])):
+        ratio = new[key]["median_s"]/old[key]["median_s"]
+        print(
+            f"{key[0]:>24} {key[2]:>5}x{key[1]:<5} {old[key]['median_s']*1000:10.3f} ms "
+            f"-> {new[key]['median_s']*1000:10.3f} ms  x{ratio:.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the DdD hot paths.")
+    parser.add_argument("--sizes", default="11,100,500,2000",
+                        help="Comma separated amounts of database columns (sizes)")
+    parser.add_argument("--wavelengths", type=int, default=300, help="Rows of the databases")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each step")
+    parser.add_argument("--xlsx-limit", type=int, default=500,
+                        help="Largest database also timed as XLSX (slow to generate)")
+    parser.add_argument("--output", default="bench.json", help="JSON results file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two results files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.wavelengths, args.repeat, args.xlsx_limit)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
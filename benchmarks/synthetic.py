@@ -0,0 +1,42 @@
+"""
+Synthetic inputs shaped like the sample files in data/: an absorption
+database (Wavelength column + one column per size), a spectrum that is
+a lognormal mixture of the database columns, and its Jacobian.
+"""
+import numpy as np
+import pandas as pd
+
+
+def make_database(n_sizes=11, n_wavelengths=300, seed=0):
+    """
+    DataFrame like DataAD.csv: absorption band whose position, width and
+    intensity grow with the particle size, plus a tail to the UV.
+    """
+    rng = np.random.default_rng(seed)
+    wavelengths = 340 + 0.5*np.arange(n_wavelengths)
+    sizes = np.linspace(6.42, 1.96, n_sizes)
+    span = wavelengths[-1] - wavelengths[0]
+    centers = wavelengths[0] + span*(0.1 + 0.8*(sizes - sizes.min())/max(np.ptp(sizes), 1e-9))
+    band = np.exp(-0.5*((wavelengths[:, None] - centers)/(0.04*span + 2*sizes))**2)
+    tail = np.exp(-(wavelengths[:, None] - wavelengths[0])/(0.3*span))
+    matrix = sizes**3*(band + 0.5*tail)*(1 + 0.01*rng.standard_normal((n_wavelengths, n_sizes)))
+    df = pd.DataFrame(matrix, columns=[f"{size:.4f}" for size in sizes])
+    df.insert(0, "Wavelength", wavelengths)
+    return df
+
+
+def make_jacobian(df_AD):
+    sizes = df_AD.columns[1:].astype(float)
+    return pd.DataFrame({"Size": sizes, "J": 1/sizes**3})
+
+
+def make_spectrum(df_AD, mean=3.0, sigma=0.2, noise=1e-3, seed=0):
+    """
+    Spectrum of a lognormal population of the database sizes.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = df_AD.columns[1:].astype(float).to_numpy()
+    weights = np.exp(-0.5*(np.log(sizes/mean)/sigma)**2)/sizes**3
+    absorbance = df_AD.iloc[:, 1:].to_numpy() @ weights
+    absorbance = absorbance/absorbance.max() + noise*rng.standard_normal(absorbance.size)
+    return pd.DataFrame({"Wavelength": df_AD.Wavelength, "Absorbance": absorbance})
@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+Histogram = namedtuple("Histogram", ["edges", "centers", "probabilities"])
+Stats = namedtuple("Stats", ["mean", "deviation", "mode"])
+
+
+def bin_edges(sizes, bin_size):
+    """
+    Edges of bins of width bin_size aligned to multiples of bin_size
+    and covering every size. If bin_size is empty or not positive one
+    bin per known size is used.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    low, high = sizes.min(), sizes.max()
+    if not bin_size or bin_size <= 0:
+        bin_size = (high - low)/max(sizes.size - 1, 1) or 1.0
+    start = np.floor(low/bin_size)*bin_size
+    n_bins = int(np.floor((high - start)/bin_size)) + 1
+    return start + bin_size*np.arange(n_bins + 1)
+
+
+def weighted_histogram(sizes, weights, bin_size):
+    """
+    Histogram of the sizes weighted by their (non negative) frequencies,
+    normalized to probability like plotly's histnorm="probability".
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    edges = bin_edges(sizes, bin_size)
+    counts, _ = np.histogram(sizes, bins=edges, weights=weights)
+    total = weights.sum()
+    probabilities = counts/total if total > 0 else counts
+    return Histogram(edges, 0.5*(edges[:-1] + edges[1:]), probabilities)
+
+
+def weighted_stats(sizes, weights):
+    """
+    Mean, standard deviation and mode (most frequent size) of the sizes
+    weighted by their frequencies.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    mean = np.average(sizes, weights=weights)
+    deviation = np.sqrt(np.average((sizes - mean)**2, weights=weights))
+    return Stats(mean, deviation, sizes[np.argmax(weights)])
@@ -0,0 +1,147 @@
+"""
+Uncertainty of the deconvolution by bootstrap: the fitted spectrum plus
+resampled residuals ("residual": the residuals of the fit drawn with
+replacement, or "noise": gaussian noise of the same RMS) is deconvolved
+again many times, and each resample gives a size distribution and the
+mean and deviation of its lognormal fit. Their percentiles are the
+uncertainty bands.
+
+Resamples are solved in batches (Database.solve_many, warm started from
+the original fit) by a pool of processes, until the number of samples
+or the time budget is reached, whichever comes first.
+"""
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import fitting
+
+
+SAMPLES = int(os.environ.get("DDD_BOOTSTRAP_SAMPLES", 200))
+SECONDS = float(os.environ.get("DDD_BOOTSTRAP_SECONDS", 30))
+WORKERS = int(os.environ.get("DDD_BOOTSTRAP_WORKERS", 0)) or None
+# Resamples solved together by each task of the pool
+BATCH = int(os.environ.get("DDD_BOOTSTRAP_BATCH", 25))
+# Coverage of the bands
+LEVEL = 0.95
+MODES = ("residual", "noise")
+
+# Percentiles (low, median, high) of the size distribution (sizes x 3),
+# of the lognormal mean and of the deviation, and the samples used
+Bands = namedtuple("Bands", ["distribution", "mean", "deviation", "samples", "requested", "seconds", "mode"])
+
+# Inputs of each worker process, set once by _init_worker
+_worker = {}
+
+
+def resample(rng, fitted, residuals, mode, count):
+    """
+    count resampled spectra (wavelengths x count) around the fitted one.
+    """
+    if mode == "residual":
+        noise = rng.choice(residuals - residuals.mean(), size=(fitted.size, count), replace=True)
+    elif mode == "noise":
+        noise = rng.normal(0, np.sqrt(np.mean(residuals**2)), size=(fitted.size, count))
+    else:
+        raise ValueError(f"Unknown bootstrap mode: {mode}")
+    return fitted[:, None] + noise
+
+
+def solve_resamples(inputs, seed, count):
+    """
+    Size distributions (sizes x count, normalized to a maximum of 1 like
+    pipeline.weight_frequencies) and lognormal mean and deviation
+    (count x 2, nan where the fit failed) of count resamples.
+    """
+    rng = np.random.default_rng(seed)
+    spectra = resample(rng, inputs["fitted"], inputs["residuals"], inputs["mode"], count)
+    frequencies, _ = inputs["database"].solve_many(spectra, solver=inputs["solver"], x0=inputs["frequencies"])
+    y_data = frequencies*inputs["jacobian"][:, None]
+    y_data /= np.maximum(y_data.max(axis=0), 1e-300)
+    if inputs["threshold"] is not None:
+        y_data[inputs["sizes"] < inputs["threshold"]] = 0
+    stats = np.full((count, 2), np.nan)
+    for j in range(count):
+        try:
+            fit = fitting.fit_lognormal(inputs["sizes"], y_data[:, j], inputs["components"])
+        except (RuntimeError, ValueError):
+            continue
+        stats[j] = fitting.mixture_stats(fit.components)
+    return y_data, stats
+
+
+def _init_worker(inputs):
+    _worker.update(inputs)
+
+
+def _solve(seed, count):
+    return solve_resamples(_worker, seed, count)
+
+
+def bootstrap(database, absorbance, frequencies, sizes, jacobian, threshold=None, components=1,
+              mode="residual", samples=SAMPLES, seconds=SECONDS, workers=WORKERS, solver=None,
+              progress=None, seed=0):
+    """
+    Bands of the size distribution of absorbance (on the wavelengths of
+    database) deconvolved to frequencies, from up to samples resamples
+    solved in at most about seconds. progress, if given, is called with
+    the fraction of the samples done. Raises ValueError if no resample
+    was done in time or there are too few sizes for the components.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown bootstrap mode: {mode}")
+    fitting.check_components(len(sizes), components)
+    begin = time.perf_counter()
+    absorbance = np.asarray(absorbance, dtype=float)
+    frequencies = np.asarray(frequencies, dtype=float)
+    fitted = database.matrix @ frequencies
+    inputs = dict(
+        database=database, fitted=fitted, residuals=absorbance - fitted, frequencies=frequencies,
+        sizes=np.asarray(sizes, dtype=float), jacobian=np.asarray(jacobian, dtype=float),
+        threshold=threshold, components=components, mode=mode, solver=solver,
+    )
+
+    counts = [BATCH]*(samples//BATCH) + ([samples % BATCH] if samples % BATCH else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    deadline = begin + seconds
+    results = []
+    done = 0
+    # The app runs this from a job thread: a fork server keeps the
+    # workers from inheriting the locks of the other threads
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    )
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(inputs,)
+    )
+    try:
+        pending = {executor.submit(_solve, s, count) for s, count in zip(seeds, counts)}
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            finished, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results.append(future.result())
+                done += results[-1][0].shape[1]
+            if progress is not None:
+                progress(done/samples)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if not results:
+        raise ValueError(f"No resample was solved in the time budget ({seconds:g} s), try a longer one.")
+
+    distributions = np.concatenate([y_data for y_data, _ in results], axis=1)
+    stats = np.concatenate([stats for _, stats in results])
+    q = [50*(1 - LEVEL), 50, 100 - 50*(1 - LEVEL)]
+    mean, deviation = np.full((2, 3), np.nan)
+    if np.isfinite(stats).any():
+        mean, deviation = np.nanpercentile(stats, q, axis=0).T
+    return Bands(
+        np.percentile(distributions, q, axis=1).T, mean, deviation, distributions.shape[1], samples,
+        time.perf_counter() - begin, mode,
+    )
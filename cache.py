@@ -0,0 +1,116 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Every LRUCache created, to report their statistics
+caches = []
+
+
+def pandas_types():
+    """
+    (Series, DataFrame) if pandas was imported, else () (there cannot be
+    pandas objects yet), so checking for them does not import it.
+    """
+    pd = sys.modules.get("pandas")
+    return (pd.Series, pd.DataFrame) if pd is not None else ()
+
+
+def digest(*parts):
+    """
+    Content hash of strings, bytes and numpy arrays (and tuples/lists of
+    them) to be used as cache key.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (tuple, list)):
+            h.update(digest(*part).encode())
+        elif isinstance(part, np.ndarray):
+            h.update(str((part.dtype, part.shape)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, pandas_types()):
+            h.update(digest(part.to_numpy()).encode())
+        elif isinstance(part, bytes):
+            h.update(part)
+        elif isinstance(part, str):
+            # Uploaded files arrive as (long) data URL strings, repr would copy them with escapes
+            h.update(part.encode())
+        else:
+            h.update(repr(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def sizeof(obj):
+    """
+    Approximate memory used by obj in bytes.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, pandas_types()):
+        return int(np.sum(obj.memory_usage(deep=True)))
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(sizeof(item) for item in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache bounded by the total size of
+    its values, with hit/miss counters.
+    """
+
+    def __init__(self, max_bytes, name="cache"):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        caches.append(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = sizeof(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            self._data[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._data),
+            "bytes": self.nbytes,
+        }
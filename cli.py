@@ -0,0 +1,175 @@
+"""
+Runs the DdD pipeline over many spectra files without the web app.
+
+    python cli.py --database data/DataAD.csv --jacobian data/Jacobian.csv \
+        --output results.csv "spectra/*.csv"
+
+Files are processed in parallel by a pool of processes, and the results
+(one row per spectrum) are written to the output as they complete.
+"""
+import argparse
+import glob
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pipeline
+import solvers
+from alignment import MODES
+from databases import Database
+from utils import load_file, EXTENSIONS, FORMATS
+
+
+# Database and Jacobian of each worker process, loaded once by _init_worker
+_worker = {}
+
+SPECTRA_EXTENSIONS = EXTENSIONS
+
+
+def load_inputs(database_path, jacobian_path):
+    """
+    Returns the Database and the sizes and Jacobian values.
+    """
+    df_AD = load_file(database_path)
+    df_Jac = load_file(jacobian_path, ["Size", "J"])
+    for path, df in ((database_path, df_AD), (jacobian_path, df_Jac)):
+        if type(df) == str:
+            raise ValueError(f"Only {FORMATS} are supported: {path}")
+    database = Database.from_frame(pathlib.Path(database_path).stem, df_AD)
+    if df_Jac.shape[0] != database.shape[1]:
+        raise ValueError("Jacobian values should match the database columns.")
+    return database, df_Jac["Size"].to_numpy(), df_Jac["J"].to_numpy()
+
+
+def _init_worker(database_path, jacobian_path, threshold, mode, solver):
+    database, sizes, jacobian = load_inputs(database_path, jacobian_path)
+    _worker.update(
+        database=database, sizes=sizes, jacobian=jacobian, threshold=threshold, mode=mode, solver=solver
+    )
+
+
+def _analyze(path):
+    return pipeline.analyze_file(
+        path, _worker["database"], _worker["sizes"], _worker["jacobian"],
+        _worker["threshold"], _worker["mode"], _worker["solver"],
+    )
+
+
+def expand_inputs(patterns):
+    """
+    Spectra files from a list of files, directories and glob patterns.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(
+                str(path) for path in sorted(pathlib.Path(pattern).iterdir())
+                if path.suffix.lower() in SPECTRA_EXTENSIONS
+            )
+        else:
+            paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+class ResultWriter:
+    """
+    Appends result tables to a CSV or Parquet file (by extension).
+    Parquet needs pyarrow.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = str(path).endswith(".parquet")
+        self._writer = None
+        self._header = True
+        if self.parquet:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError("Parquet output needs the pyarrow package (pip install pyarrow).")
+            self._pa = pyarrow
+
+    def write(self, table):
+        if self.parquet:
+            chunk = self._pa.Table.from_pandas(table, preserve_index=False)
+            if self._writer is None:
+                self._writer = self._pa.parquet.ParquetWriter(self.path, chunk.schema)
+            self._writer.write_table(chunk.cast(self._writer.schema))
+        else:
+            table.to_csv(self.path, mode="w" if self._header else "a", header=self._header, index=False)
+            self._header = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def run(paths, database_path, jacobian_path, output, threshold=None, mode="crop", workers=None,
+        solver=None, log=sys.stderr):
+    """
+    Analyzes every file in paths with a pool of workers and writes the
+    results to output. Returns (spectra analyzed, files failed, seconds).
+    """
+    start = time.perf_counter()
+    writer = ResultWriter(output)
+    n_spectra = 0
+    n_failed = 0
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(database_path, jacobian_path, threshold, mode, solver),
+        ) as executor:
+            futures = {executor.submit(_analyze, path): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    table = future.result()
+                except Exception as e:
+                    n_failed += 1
+                    print(f"{futures[future]}: {e}", file=log)
+                    continue
+                writer.write(table)
+                n_spectra += len(table)
+    finally:
+        writer.close()
+    return n_spectra, n_failed, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("inputs", nargs="+", help="Spectra files, directories or glob patterns")
+    parser.add_argument("-d", "--database", required=True, help="Absorption database file")
+    parser.add_argument("-j", "--jacobian", required=True, help="Jacobian file")
+    parser.add_argument("-o", "--output", default="results.csv", help="Output file (.csv or .parquet)")
+    parser.add_argument("-f", "--filter", type=float, default=None,
+                        help="Threshold to filter from left (nm)")
+    parser.add_argument("-a", "--align", choices=MODES, default="crop",
+                        help="How to put the spectra on the database wavelengths")
+    parser.add_argument("-s", "--solver", choices=list(solvers.SOLVERS), default=solvers.DEFAULT,
+                        help="NNLS solver (spectra of a file are warm started from the previous one)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Worker processes (default: number of cores)")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("No spectra files found")
+    # Fail early on bad database or Jacobian, not once per file
+    load_inputs(args.database, args.jacobian)
+
+    n_spectra, n_failed, elapsed = run(
+        paths, args.database, args.jacobian, args.output, args.filter, args.align, args.workers,
+        args.solver,
+    )
+    print(
+        f"{n_spectra} spectra from {len(paths) - n_failed} files in {elapsed:.2f} s "
+        f"({n_spectra/elapsed:.1f} spectra/s), {n_failed} files failed. Results in {args.output}",
+        file=sys.stderr,
+    )
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
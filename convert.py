@@ -0,0 +1,64 @@
+"""
+Converts databases, spectra and Jacobians to the binary formats, which
+load much faster than CSV or Excel and are smaller.
+
+    python convert.py data/DataAD.csv data/DataAS.csv data/Jacobian.csv --format npy
+    python convert.py data/DataAD.csv --format parquet --float32 --output-dir converted/
+
+Each file is written next to the original (or to --output-dir) with the
+new extension. See utils.write_table for the formats. The templates
+(template_*.csv) have text placeholders instead of numbers and are not
+converted.
+"""
+import argparse
+import pathlib
+import sys
+import time
+
+from utils import load_file, write_table
+
+
+def convert(path, extension, output_dir=None, float32=False):
+    """
+    Writes the file at path in the format of extension and returns the
+    path written.
+    """
+    path = pathlib.Path(path)
+    df = load_file(path)
+    if type(df) == str:
+        raise ValueError(f"Unsupported format: {path}")
+    target = pathlib.Path(output_dir or path.parent) / (path.stem + extension)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    write_table(df, target, target, float32)
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("inputs", nargs="+", help="Files to convert")
+    parser.add_argument("-f", "--format", choices=["npy", "npz", "parquet", "csv"], default="npy",
+                        help="Output format")
+    parser.add_argument("--float32", action="store_true", help="Store the values in single precision")
+    parser.add_argument("-o", "--output-dir", default=None, help="Directory of the converted files")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path in args.inputs:
+        start = time.perf_counter()
+        try:
+            target = convert(path, "." + args.format, args.output_dir, args.float32)
+        except Exception as e:
+            failed += 1
+            print(f"{path}: {e}", file=sys.stderr)
+            continue
+        before, after = pathlib.Path(path).stat().st_size, target.stat().st_size
+        print(
+            f"{path} -> {target} ({before/1024:.0f} KB -> {after/1024:.0f} KB, "
+            f"{time.perf_counter() - start:.2f} s)",
+            file=sys.stderr,
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
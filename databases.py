@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from cache import LRUCache, digest
+import solvers
+from utils import load_file
+from instrumentation import instrumented
+
+
+logger = logging.getLogger("ddd.databases")
+
+# Registry databases are saved here as .npy files and memory-mapped by
+# every worker of the machine, which share a single copy (empty to keep
+# a private copy per worker)
+SHARED_DIR = os.environ.get("DDD_DATABASE_SHARED_DIR", os.path.join(tempfile.gettempdir(), "ddd-databases"))
+
+
+class Database:
+    """
+    Absorption database (one column of absorbances per known size) with
+    the factorizations reused by every NNLS solve against it: column
+    norms, QR of the column-normalized matrix (and its Gram matrix and
+    largest eigenvalue, for the gradient solvers). The SVD of R, for the
+    Tikhonov path, is computed on first use (see svd).
+    """
+
+    # Arrays written by save and memory-mapped by load
+    ARRAYS = ("wavelengths", "matrix", "norms", "q", "r", "normal_gram")
+
+    def __init__(self, name, wavelengths, sizes, matrix):
+        self.name = name
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.sizes = [str(size) for size in sizes]
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.norms = np.linalg.norm(self.matrix, axis=0)
+        self.norms[self.norms == 0] = 1
+        self.q, self.r = np.linalg.qr(self.matrix/self.norms)
+        self.normal_gram = self.r.T @ self.r
+        self.lipschitz = largest_eigenvalue(self.normal_gram)
+        self.key = digest(self.wavelengths, self.matrix)
+        self._svd = None
+
+    @classmethod
+    def from_frame(cls, name, df):
+        """
+        Builds the database from a DataFrame with the wavelengths in the
+        first column and one column per size (the format of DataAD.csv).
+        """
+        return cls(name, df.iloc[:, 0], df.columns[1:], df.iloc[:, 1:])
+
+    def save(self, directory):
+        """
+        Writes the arrays of the database and its factorizations to .npy
+        files in directory, for load. The directory appears complete or
+        not at all: if another process saved it first, its copy is kept.
+        """
+        directory = pathlib.Path(directory)
+        partial = directory.with_name(f"{directory.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        partial.mkdir(parents=True)
+        try:
+            for name in self.ARRAYS:
+                np.save(partial / f"{name}.npy", getattr(self, name))
+            (partial / "meta.json").write_text(json.dumps({
+                "name": self.name, "sizes": self.sizes, "lipschitz": float(self.lipschitz), "key": self.key,
+            }))
+            os.rename(partial, directory)
+        except OSError:
+            if not (directory / "meta.json").exists():
+                raise
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Database written by save, with its arrays memory-mapped read
+        only: the processes that load it share the same pages of memory.
+        """
+        directory = pathlib.Path(directory)
+        meta = json.loads((directory / "meta.json").read_text())
+        database = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(database, name, np.asarray(np.load(directory / f"{name}.npy", mmap_mode="r")))
+        database.name = meta["name"]
+        database.sizes = meta["sizes"]
+        database.lipschitz = meta["lipschitz"]
+        database.key = meta["key"]
+        database._svd = None
+        return database
+
+    def svd(self):
+        """
+        Thin SVD (u, s, vt) of R, whose singular values and right singular
+        vectors are those of the column-normalized matrix, computed once.
+        """
+        if self._svd is None:
+            self._svd = np.linalg.svd(self.r, full_matrices=False)
+        return self._svd
+
+    def to_frame(self):
+        import pandas as pd
+
+        df = pd.DataFrame(self.matrix, columns=self.sizes)
+        df.insert(0, "Wavelength", self.wavelengths)
+        return df
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def restrict(self, rows):
+        """
+        Database with only the given wavelength rows, its factorizations
+        are computed once per set of rows.
+        """
+        if len(rows) == self.shape[0]:
+            return self
+        key = (self.key, digest(np.asarray(rows)))
+        database = database_cache.get(key)
+        if database is None:
+            database = Database(self.name, self.wavelengths[rows], self.sizes, self.matrix[rows])
+            database_cache.put(key, database, nbytes=_database_nbytes(database))
+        return database
+
+    def solve(self, absorbance, solver=None, x0=None):
+        """
+        Non-negative least squares fit of the absorbance spectrum.
+        Solved on the small triangular system of the QR factorization
+        (same solution as nnls on the full matrix). Returns the size
+        frequencies and the residual norm.
+        """
+        result = self.nnls(absorbance, solver, x0)
+        return result.x, result.rnorm
+
+    @instrumented("nnls", kind="stage")
+    def nnls(self, absorbance, solver=None, x0=None):
+        """
+        Fit of one spectrum with the given solver (see solvers.py),
+        started from the frequencies x0 if the solver supports it.
+        Returns the solvers.SolveResult with the frequencies and the
+        residual norm.
+        """
+        absorbance = np.asarray(absorbance, dtype=float)
+        qtb = self.q.T @ absorbance
+        result = solvers.get(solver)(self, qtb, None if x0 is None else np.asarray(x0)*self.norms)
+        outside = max(absorbance @ absorbance - qtb @ qtb, 0)
+        return result._replace(x=result.x/self.norms, rnorm=np.sqrt(result.rnorm**2 + outside))
+
+    @instrumented("nnls_many", kind="stage")
+    def solve_many(self, spectra, progress=None, solver=None, x0=None):
+        """
+        Solves every column of spectra (wavelengths x spectra) sharing
+        the factorization and the projection of all the spectra in a
+        single product. Each spectrum starts from the solution of the
+        previous one (x0 for the first), which suits series of similar
+        spectra with the solvers that take warm starts. Returns the
+        frequencies (sizes x spectra) and the residual norm of each
+        spectrum. progress, if given, is called with the fraction of the
+        spectra solved after each one.
+        """
+        solve = solvers.get(solver)
+        spectra = np.asarray(spectra, dtype=float).reshape(self.shape[0], -1)
+        qtb = self.q.T @ spectra
+        # Part of the spectra outside the column space of the database
+        outside = np.maximum((spectra*spectra).sum(axis=0) - (qtb*qtb).sum(axis=0), 0)
+        frequencies = np.empty((self.shape[1], spectra.shape[1]))
+        rnorms = np.empty(spectra.shape[1])
+        scaled = None if x0 is None else np.asarray(x0)*self.norms
+        for j in range(spectra.shape[1]):
+            result = solve(self, qtb[:, j], scaled)
+            scaled = result.x
+            frequencies[:, j] = scaled/self.norms
+            rnorms[j] = np.sqrt(result.rnorm**2 + outside[j])
+            if progress is not None:
+                progress((j + 1)/spectra.shape[1])
+        return frequencies, rnorms
+
+
+class DatabaseRegistry:
+    """
+    Named databases shared by every session, loaded once per process on
+    first use (or by app.prewarm).
+    """
+
+    def __init__(self, directory=None, pattern=None):
+        self._databases = {}
+        self._lock = threading.Lock()
+        self._pending = None if directory is None else (directory, pattern)
+        self._loading = threading.Lock()
+
+    @classmethod
+    def from_env(cls, default_directory):
+        """
+        Registry of the databases in DDD_DATABASE_DIR (default_directory
+        if not set) whose file names match DDD_DATABASE_GLOB
+        (DataAD*.csv), memory-mapped from SHARED_DIR.
+        """
+        return cls(
+            os.environ.get("DDD_DATABASE_DIR", default_directory),
+            os.environ.get("DDD_DATABASE_GLOB", "DataAD*.csv"),
+        )
+
+    def load(self):
+        """
+        Loads the databases of the directory given at creation, once.
+        """
+        if self._pending is None:
+            return
+        with self._loading:
+            if self._pending is not None:
+                self.load_directory(*self._pending)
+                self._pending = None
+
+    def load_directory(self, directory, pattern, shared_dir=SHARED_DIR):
+        for path in sorted(pathlib.Path(directory).glob(pattern)):
+            database = load_shared(path, shared_dir) if shared_dir else load_database(path)
+            if database is not None:
+                self.register(database)
+
+    def register(self, database):
+        with self._lock:
+            self._databases[database.name] = database
+
+    def get(self, name):
+        self.load()
+        return self._databases.get(name)
+
+    def names(self):
+        self.load()
+        return sorted(self._databases)
+
+
+def load_database(path):
+    """
+    Database of the file at path, None if the format is unsupported.
+    """
+    path = pathlib.Path(path)
+    df = load_file(path)
+    if type(df) == str:
+        return None
+    return Database.from_frame(path.stem, df)
+
+
+def load_shared(path, shared_dir=SHARED_DIR):
+    """
+    Database of the file at path memory-mapped from shared_dir. The
+    first process to load a version of the file (by path, size and
+    modification time) parses it and saves it there, the rest only map
+    it. None if the format is unsupported.
+    """
+    path = pathlib.Path(path)
+    stat = path.stat()
+    key = digest(str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    directory = pathlib.Path(shared_dir) / f"{path.stem}-{key[:16]}"
+    if not (directory / "meta.json").exists():
+        database = load_database(path)
+        if database is None:
+            return None
+        try:
+            database.save(directory)
+        except OSError as e:
+            logger.warning("Could not share the database %s in %s: %s", path, shared_dir, e)
+            return database
+        logger.info("Saved the database %s to %s", path, directory)
+    return Database.load(directory)
+
+
+# Databases uploaded by the users (by content hash) and restricted to
+# the wavelengths of the spectra
+database_cache = LRUCache(float(os.environ.get("DDD_DATABASE_CACHE_MB", 128))*1024**2, name="databases")
+
+
+def from_upload(df):
+    """
+    Database for an uploaded DataFrame, the factorizations are computed
+    once per distinct file.
+    """
+    key = digest(df.to_numpy(), list(df.columns))
+    database = database_cache.get(key)
+    if database is None:
+        database = Database.from_frame("Uploaded", df)
+        database_cache.put(key, database, nbytes=_database_nbytes(database))
+    return database
+
+
+def _database_nbytes(database):
+    return sum(getattr(database, name).nbytes for name in Database.ARRAYS)
+
+
+def largest_eigenvalue(gram, tol=1e-6, max_iter=200):
+    """
+    Upper bound of the largest eigenvalue of the symmetric positive
+    semidefinite gram, by power iteration: the Rayleigh quotient plus the
+    norm of its residual (an eigenvalue lies within it, the largest one
+    for the non-negative Gram matrices of absorption databases).
+    """
+    v = np.ones(gram.shape[0])/np.sqrt(max(gram.shape[0], 1))
+    bound = 1e-300
+    for _ in range(max_iter):
+        w = gram @ v
+        rayleigh = v @ w
+        residual = np.linalg.norm(w - rayleigh*v)
+        bound = max(rayleigh + residual, 1e-300)
+        norm = np.linalg.norm(w)
+        if norm == 0 or residual <= tol*rayleigh:
+            break
+        v = w/norm
+    return bound
@@ -0,0 +1,185 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import lognormal, lognormal_gradient
+
+
+# params: (mu, s) for one component, (a1, mu1, s1, a2, mu2, s2, ...) for
+# mixtures. components: one (weight, mu, s) row per lognormal, weights
+# add up to 1. seconds: wall time of the whole fit (every start).
+FitResult = namedtuple("FitResult", ["params", "components", "sse", "starts", "seconds"])
+
+S_BOUNDS = (1e-2, 3.0)
+
+
+def moment_estimates(sizes, y_data):
+    """
+    (mu, s) of the lognormal with the same mean and variance as the
+    sizes weighted by y_data.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    weights = np.clip(np.asarray(y_data, dtype=float), 0, None)
+    if weights.sum() <= 0:
+        return np.median(sizes), 0.5
+    mean = np.average(sizes, weights=weights)
+    variance = np.average((sizes - mean)**2, weights=weights)
+    spread = 1 + variance/mean**2
+    s = np.clip(np.sqrt(np.log(spread)), *S_BOUNDS)
+    return mean/np.sqrt(spread), s
+
+
+def check_components(n_sizes, components):
+    """
+    Raises ValueError if a fit of components lognormals has more
+    parameters (2 for one lognormal, 3 per component in a mixture) than
+    the n_sizes points of the distribution.
+    """
+    parameters = 2 if components == 1 else 3*components
+    if components < 1 or parameters > n_sizes:
+        most = max(n_sizes//3, 1 if n_sizes >= 2 else 0)
+        raise ValueError(
+            f"A fit with {components} lognormal components needs at least {parameters} sizes, "
+            f"the distribution has {n_sizes}: use at most {most} components."
+        )
+
+
+def mixture(x, *params):
+    """
+    Sum of lognormals with params (a1, mu1, s1, a2, mu2, s2, ...).
+    """
+    x = np.asarray(x, dtype=float)
+    return sum(a*lognormal(x, mu, s) for a, mu, s in np.reshape(params, (-1, 3)))
+
+
+def mixture_gradient(x, *params):
+    x = np.asarray(x, dtype=float)
+    columns = []
+    for a, mu, s in np.reshape(params, (-1, 3)):
+        gradient = lognormal_gradient(x, mu, s)
+        columns.extend([lognormal(x, mu, s), a*gradient[:, 0], a*gradient[:, 1]])
+    return np.column_stack(columns)
+
+
+def _initial_guesses(sizes, y_data, components):
+    """
+    One lognormal per quantile range of the weighted distribution, with
+    its moment estimates and amplitude matching the data maximum.
+    """
+    if components == 1:
+        return np.array(moment_estimates(sizes, y_data))
+    order = np.argsort(sizes)
+    sizes, y_data = sizes[order], np.clip(y_data[order], 0, None)
+    cumulative = np.cumsum(y_data)/max(y_data.sum(), np.finfo(float).tiny)
+    groups = np.minimum((cumulative*components).astype(int), components - 1)
+    guess = []
+    for k in range(components):
+        members = groups == k
+        if not members.any() or y_data[members].sum() <= 0:
+            members = np.ones_like(members)
+        mu, s = moment_estimates(sizes[members], y_data[members])
+        guess.extend([y_data[members].sum()/max(y_data.sum(), np.finfo(float).tiny), mu, s])
+    guess = np.array(guess)
+    peak = mixture(sizes, *guess).max()
+    if peak > 0:
+        guess[0::3] *= y_data.max()/peak
+    return guess
+
+
+def fit_lognormal(sizes, y_data, components=1, starts=1, workers=None, seed=0):
+    """
+    Least squares fit of y_data with one lognormal (same model as the
+    original curve_fit(lognormal, ...)) or a mixture of components
+    lognormals. Starts from the moment estimates of the weighted
+    distribution, with analytic gradients and bounded parameters.
+    With starts > 1 random perturbations of the first guess are also
+    fitted, in parallel threads, and the one with the lowest squared
+    error is kept. Raises RuntimeError if every start fails and
+    ValueError if there are too few sizes for the components.
+    """
+    begin = time.perf_counter()
+    sizes = np.asarray(sizes, dtype=float)
+    y_data = np.asarray(y_data, dtype=float)
+    check_components(sizes.size, components)
+    guess = _initial_guesses(sizes, y_data, components)
+
+    positive = sizes[sizes > 0]
+    mu_bounds = (positive.min()/10, positive.max()*10)
+    mu_bounds = (mu_bounds[0], max(mu_bounds[1], mu_bounds[0]*10))
+    if components == 1:
+        model, gradient = lognormal, lognormal_gradient
+        lower = [mu_bounds[0], S_BOUNDS[0]]
+        upper = [mu_bounds[1], S_BOUNDS[1]]
+    else:
+        model, gradient = mixture, mixture_gradient
+        lower = [0, mu_bounds[0], S_BOUNDS[0]]*components
+        upper = [np.inf, mu_bounds[1], S_BOUNDS[1]]*components
+
+    rng = np.random.default_rng(seed)
+    first_guesses = [guess]
+    for _ in range(starts - 1):
+        perturbed = guess*np.exp(rng.normal(0, 0.3, guess.size))
+        first_guesses.append(perturbed)
+    first_guesses = [np.clip(p0, np.add(lower, 1e-12), np.subtract(upper, 1e-12)) for p0 in first_guesses]
+
+    from scipy.optimize import curve_fit
+
+    def run(p0):
+        # Unbounded Levenberg-Marquardt is the fastest from a good first
+        # guess, the bounded trust region method is the fallback
+        with np.errstate(all="ignore"):
+            try:
+                params, _ = curve_fit(model, sizes, y_data, p0=p0, jac=gradient)
+                if np.all(params >= lower) and np.all(params <= upper):
+                    return params
+            except (RuntimeError, ValueError):
+                pass
+            try:
+                params, _ = curve_fit(
+                    model, sizes, y_data, p0=p0, bounds=(lower, upper), jac=gradient,
+                )
+            except (RuntimeError, ValueError):
+                return None
+        return params
+
+    if starts > 1:
+        with ThreadPoolExecutor(max_workers=workers or starts) as executor:
+            results = list(executor.map(run, first_guesses))
+    else:
+        results = [run(first_guesses[0])]
+    results = [result for result in results if result is not None]
+    if not results:
+        raise RuntimeError("The lognormal fit did not converge.")
+
+    best = min(results, key=lambda params: np.sum((model(sizes, *params) - y_data)**2))
+    sse = float(np.sum((model(sizes, *best) - y_data)**2))
+    if components == 1:
+        table = np.array([[1.0, best[0], best[1]]])
+    else:
+        table = np.reshape(best, (-1, 3)).copy()
+        total = table[:, 0].sum()
+        table[:, 0] = table[:, 0]/total if total > 0 else 1/components
+    return FitResult(best, table, sse, starts, time.perf_counter() - begin)
+
+
+def evaluate(result, x):
+    """
+    Values of the fitted curve at x.
+    """
+    if len(result.params) == 2:
+        return lognormal(x, *result.params)
+    return mixture(x, *result.params)
+
+
+def mixture_stats(components):
+    """
+    Mean and standard deviation of a mixture of lognormals given as
+    (weight, mu, s) rows.
+    """
+    weights, mu, s = np.asarray(components, dtype=float).T
+    means = mu*np.exp(0.5*s**2)
+    variances = means**2*(np.exp(s**2) - 1)
+    mean = np.sum(weights*means)
+    return mean, np.sqrt(np.sum(weights*(variances + means**2)) - mean**2)
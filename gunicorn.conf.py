@@ -0,0 +1,25 @@
+"""
+gunicorn settings, read from the working directory by gunicorn app:server
+(see the Procfile).
+
+With DDD_PRELOAD=1 the master imports the app once and forks the workers
+from it, which then boot in a few milliseconds and share its memory.
+Every worker pre-warms after fork (app.prewarm, unless DDD_PREWARM=0):
+the modules imported on first use, the registry databases and the layout
+are loaded in a background thread while the worker already accepts
+requests, instead of in the master or during the first request.
+"""
+import os
+import threading
+
+
+preload_app = os.environ.get("DDD_PRELOAD", "0") == "1"
+PREWARM = os.environ.get("DDD_PREWARM", "1") != "0"
+
+
+def post_worker_init(worker):
+    if not PREWARM:
+        return
+    import app
+
+    threading.Thread(target=app.prewarm, name="ddd-prewarm", daemon=True).start()
@@ -0,0 +1,181 @@
+"""
+Timing of the Dash callbacks and pipeline stages.
+
+Every instrumented call logs a JSON line (logger "ddd.metrics") with
+its wall and CPU time and the size of its inputs, and updates in-process
+counters and histograms that the /metrics route serves in the
+Prometheus text format. With several gunicorn workers each one has its
+own metrics.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+from cache import caches, pandas_types
+import startup
+
+
+logger = logging.getLogger("ddd.metrics")
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+QUANTILES = (0.5, 0.95, 0.99)
+# Samples kept per series for the quantiles
+RECENT = 1024
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    """
+    Counters and histograms by (metric name, label values).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value, buckets=SECONDS_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        """
+        Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+                recent = np.quantile(histogram.recent, QUANTILES)
+                for quantile, value in zip(QUANTILES, recent):
+                    lines.append(f"{name}_recent{_labels(labels + (('quantile', f'{quantile:g}'),))} {value:g}")
+        for phase, seconds in list(startup.phases.items()):
+            lines.append(f"ddd_startup_seconds{_labels((('phase', phase),))} {seconds:g}")
+        for stats in (cache.stats() for cache in caches):
+            labels = (("cache", stats["name"]),)
+            for key in ("hits", "misses", "entries", "bytes"):
+                lines.append(f"ddd_cache_{key}{_labels(labels)} {stats[key]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
+
+
+def input_size(value):
+    """
+    Rows x columns of tables and arrays, length of strings.
+    """
+    if isinstance(value, (np.ndarray, *pandas_types())):
+        return list(value.shape)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return None
+
+
+def instrumented(name=None, kind="callback"):
+    """
+    Decorator recording wall time, CPU time (of the calling thread),
+    input sizes and errors of every call.
+    """
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                # Dash's PreventUpdate is the normal way to skip an update
+                if type(e).__name__ != "PreventUpdate":
+                    error = type(e).__name__
+                raise
+            finally:
+                wall = time.perf_counter() - wall
+                cpu = time.thread_time() - cpu
+                labels = (("kind", kind), ("name", label))
+                metrics.inc("ddd_calls_total", labels)
+                if error is not None:
+                    metrics.inc("ddd_errors_total", labels)
+                metrics.observe("ddd_wall_seconds", labels, wall)
+                metrics.observe("ddd_cpu_seconds", labels, cpu)
+                sizes = [size for size in map(input_size, args) if size is not None]
+                logger.info(json.dumps({
+                    "event": kind, "name": label, "wall_s": round(wall, 6), "cpu_s": round(cpu, 6),
+                    "inputs": sizes, "error": error,
+                }))
+
+        return wrapper
+    return decorator
+
+
+def observe_response(output, nbytes):
+    """
+    Records the size of the response of a Dash callback (by output).
+    """
+    labels = (("output", output),)
+    metrics.observe("ddd_response_bytes", labels, nbytes, buckets=BYTES_BUCKETS)
+    logger.info(json.dumps({"event": "response", "output": output, "bytes": nbytes}))
+
+
+def install(server):
+    """
+    Adds the /metrics route and the response size hook to the Flask
+    server of the Dash app.
+    """
+    import flask
+
+    @server.route("/metrics")
+    def metrics_route():
+        return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @server.after_request
+    def record_payload(response):
+        if flask.request.path.endswith("/_dash-update-component") and not response.direct_passthrough:
+            body = flask.request.get_json(silent=True) or {}
+            observe_response(str(body.get("output", "")), response.calculate_content_length() or 0)
+        return response
@@ -0,0 +1,323 @@
+"""
+Background jobs for the slow work of the callbacks (NNLS fits and batch
+analyses), so it runs off the request path.
+
+A callback submits a job and stores its id in the page, a dcc.Interval
+polls its status and progress, and the result is rendered when it is
+done. Jobs run in a thread pool of the worker that submitted them. Their
+status, cancellation requests and results go to a backend: in-process
+(one worker) or a SQLite file that every worker of the machine shares,
+so any of them can answer the polls. Each worker refreshes the updated
+time of its queued and running jobs every few seconds (a heartbeat): a
+job without heartbeat for a while lost its worker (it died or was
+recycled) and counts as failed.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger("ddd.jobs")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+ACTIVE = (QUEUED, RUNNING)
+
+# Error of the jobs whose worker stopped sending heartbeats
+LOST = "The server process running this job stopped, please run it again."
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a job (by its progress function) when it was cancelled.
+    """
+
+
+class MemoryBackend:
+    """
+    In-process backend, the polls must reach the worker that runs the job.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, key):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id, "key": key, "status": QUEUED, "progress": 0.0, "error": None,
+                "cancel": False, "created": now, "updated": now, "result": None,
+            }
+
+    def get(self, job_id, result=False):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        if not result:
+            job.pop("result")
+        return job
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields, updated=time.time())
+
+    def heartbeat(self, job_ids):
+        now = time.time()
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._jobs and self._jobs[job_id]["status"] in ACTIVE:
+                    self._jobs[job_id]["updated"] = now
+
+    def find(self, key, stale_before):
+        """
+        Id of the newest job with key that is not failed or cancelled,
+        nor queued or running without heartbeat since stale_before.
+        """
+        with self._lock:
+            jobs = [
+                job for job in self._jobs.values()
+                if job["key"] == key and (job["status"] == DONE or job["status"] in ACTIVE and job["updated"] >= stale_before)
+            ]
+        return max(jobs, key=lambda job: job["created"])["id"] if jobs else None
+
+    def expire(self, before, stale_before):
+        """
+        Marks the queued and running jobs without heartbeat since
+        stale_before as failed and deletes the finished jobs not updated
+        since before.
+        """
+        now = time.time()
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] in ACTIVE and job["updated"] < stale_before:
+                    job.update(status=FAILED, error=LOST, updated=now)
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job["status"] in FINISHED and job["updated"] < before]:
+                del self._jobs[job_id]
+
+
+class SQLiteBackend:
+    """
+    Jobs table in a SQLite file, shared by every worker of the machine.
+    Results are stored pickled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, key TEXT, status TEXT, progress REAL, error TEXT, "
+                "cancel INTEGER, created REAL, updated REAL, result BLOB)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _execute(self, query, parameters=()):
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(query, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def create(self, job_id, key):
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs VALUES (?, ?, ?, 0, NULL, 0, ?, ?, NULL)",
+            (job_id, key, QUEUED, now, now),
+        )
+
+    def get(self, job_id, result=False):
+        columns = "*" if result else "id, key, status, progress, error, cancel, created, updated"
+        rows = self._execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["cancel"] = bool(job["cancel"])
+        if result:
+            job["result"] = pickle.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = pickle.dumps(fields["result"], protocol=pickle.HIGHEST_PROTOCOL)
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def heartbeat(self, job_ids):
+        job_ids = list(job_ids)
+        if job_ids:
+            self._execute(
+                f"UPDATE jobs SET updated = ? WHERE status IN (?, ?) AND id IN ({', '.join('?'*len(job_ids))})",
+                (time.time(), *ACTIVE, *job_ids),
+            )
+
+    def find(self, key, stale_before):
+        rows = self._execute(
+            "SELECT id FROM jobs WHERE key = ? AND (status = ? OR status IN (?, ?) AND updated >= ?) "
+            "ORDER BY created DESC LIMIT 1",
+            (key, DONE, *ACTIVE, stale_before),
+        )
+        return rows[0]["id"] if rows else None
+
+    def expire(self, before, stale_before):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status IN (?, ?) AND updated < ?",
+                    (FAILED, LOST, time.time(), *ACTIVE, stale_before),
+                )
+                connection.execute(
+                    f"DELETE FROM jobs WHERE status IN ({', '.join('?'*len(FINISHED))}) AND updated < ?",
+                    (*FINISHED, before),
+                )
+        finally:
+            connection.close()
+
+
+class JobQueue:
+    """
+    Runs functions in a pool of workers threads and keeps their status
+    and results for ttl seconds after they finish. Jobs submitted with
+    the same key as a queued, running or done job reuse it instead of
+    running again. Queued and running jobs without heartbeat for stale
+    seconds are failed.
+    """
+
+    def __init__(self, backend, workers=2, ttl=3600, stale=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ddd-job")
+        # Jobs queued or running in this process, and the thread that
+        # sends their heartbeats (started by the first submit, so after
+        # the fork of the worker)
+        self._active = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the queue from environment variables: DDD_JOB_BACKEND
+        (memory or sqlite), DDD_JOB_DB, DDD_JOB_WORKERS, DDD_JOB_TTL and
+        DDD_JOB_STALE.
+        """
+        kind = os.environ.get("DDD_JOB_BACKEND", "memory")
+        if kind == "memory":
+            backend = MemoryBackend()
+        elif kind == "sqlite":
+            backend = SQLiteBackend(
+                os.environ.get("DDD_JOB_DB", os.path.join(tempfile.gettempdir(), "ddd-jobs.sqlite"))
+            )
+        else:
+            raise ValueError(f"Unknown job queue backend: {kind}")
+        return cls(
+            backend,
+            workers=int(os.environ.get("DDD_JOB_WORKERS", 2)),
+            ttl=float(os.environ.get("DDD_JOB_TTL", 3600)),
+            stale=float(os.environ.get("DDD_JOB_STALE", 60)),
+        )
+
+    def submit(self, func, *args, key=None):
+        """
+        Queues func(progress, *args) and returns the job id. The job
+        should call progress(fraction) now and then to report how far it
+        is; progress raises Cancelled once the job has been cancelled.
+        """
+        now = time.time()
+        self.backend.expire(now - self.ttl, now - self.stale)
+        if key is not None:
+            job_id = self.backend.find(key, now - self.stale)
+            if job_id is not None:
+                return job_id
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._active.add(job_id)
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._beat, name="ddd-job-heartbeat", daemon=True)
+                self._heartbeat.start()
+        self.backend.create(job_id, key)
+        self._executor.submit(self._run, job_id, func, args)
+        return job_id
+
+    def _beat(self):
+        while True:
+            time.sleep(self.stale/4)
+            with self._lock:
+                job_ids = list(self._active)
+            try:
+                self.backend.heartbeat(job_ids)
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def _run(self, job_id, func, args):
+        def progress(fraction):
+            job = self.backend.get(job_id)
+            if job is None or job["cancel"]:
+                raise Cancelled()
+            self.backend.update(job_id, progress=float(fraction))
+
+        try:
+            progress(0)
+            self.backend.update(job_id, status=RUNNING)
+            result = func(progress, *args)
+        except Cancelled:
+            self.backend.update(job_id, status=CANCELLED)
+        except ValueError as e:
+            # Problems with the user's data, the message is for them
+            logger.warning("Job %s failed: %s", job_id, e)
+            self.backend.update(job_id, status=FAILED, error=str(e))
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self.backend.update(job_id, status=FAILED, error=str(e) or type(e).__name__)
+        else:
+            self.backend.update(job_id, status=DONE, progress=1.0, result=result)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def status(self, job_id):
+        """
+        Returns a dict with the status, progress (0 to 1) and error
+        message of the job, None if the job is unknown or expired.
+        """
+        if not job_id:
+            return None
+        job = self.backend.get(job_id)
+        if job is not None and job["status"] in ACTIVE and job["updated"] < time.time() - self.stale:
+            self.backend.update(job_id, status=FAILED, error=LOST)
+            job = self.backend.get(job_id)
+        return job
+
+    def result(self, job_id):
+        """
+        Returns what the function of the job returned (None until it is done).
+        """
+        job = self.backend.get(job_id, result=True)
+        return job["result"] if job is not None else None
+
+    def cancel(self, job_id):
+        """
+        Asks the job to stop, it does at its next progress report.
+        """
+        job = self.backend.get(job_id)
+        if job is not None and job["status"] not in FINISHED:
+            self.backend.update(job_id, cancel=True)
@@ -0,0 +1,374 @@
+"""
+Live kinetics: spectra taken during a synthesis are deconvolved as they
+arrive, each one started from the frequencies of the previous one, and
+the mean and deviation of their lognormal fits form a time series.
+
+Spectra come from a directory watched for new files (inside
+DDD_KINETICS_DIR, disabled if not set) or are posted to
+/kinetics/<session id> (the file in the body, its name in the filename
+query parameter). A run computes in a thread of the worker that started
+it, but is controlled through SPOOL_DIR, which every worker of the
+machine shares: whichever worker receives a posted spectrum writes it to
+the directory of the run, Stop renames that directory away, and the run
+looks at it every SCAN_SECONDS without loading the session. The session
+state only has the id of the run, and the last HISTORY points, which the
+run publishes after every spectrum and the page polls. The work per
+spectrum does not depend on how long the run is.
+"""
+import io
+import logging
+import os
+import pathlib
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+import fitting
+import pipeline
+from store import SESSION_ID_RE
+from utils import read_table
+
+
+logger = logging.getLogger("ddd.kinetics")
+
+# Points kept in the time series
+HISTORY = int(os.environ.get("DDD_KINETICS_HISTORY", 500))
+# Directory under which the watched directories must be ("" disables watching)
+WATCH_ROOT = os.environ.get("DDD_KINETICS_DIR", "")
+# Seconds between checks of the posted spectra, the stop flag and the
+# watched directory
+SCAN_SECONDS = float(os.environ.get("DDD_KINETICS_SCAN_S", 1))
+# Files modified more recently than this may still be being written
+SETTLE_SECONDS = 0.5
+# Posted spectra waiting for the run, more are refused
+MAX_PENDING = int(os.environ.get("DDD_KINETICS_MAX_PENDING", 100))
+# Posted spectra waiting for their run, SPOOL_DIR/<session id>/<run id>
+SPOOL_DIR = os.environ.get("DDD_KINETICS_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "ddd-kinetics"))
+
+# Key of the session state with the id of the live run
+CONTROL = "kinetics_control"
+
+
+class Run:
+    """
+    Deconvolution of a stream of spectra against one database with the
+    PSD settings of the session. publish(snapshot) is called after each
+    spectrum with the series to show (start sets it).
+    Raises ValueError if there are too few sizes for the components.
+    """
+
+    def __init__(self, database, sizes, jacobian, threshold=None, components=1, align_mode="crop",
+                 solver=None, x0=None, history=HISTORY, publish=None):
+        fitting.check_components(len(sizes), components)
+        self.database = database
+        self.sizes = np.asarray(sizes, dtype=float)
+        self.jacobian = np.asarray(jacobian, dtype=float)
+        self.threshold = threshold
+        self.components = components
+        self.align_mode = align_mode
+        self.solver = solver
+        self.x = x0
+        # Size distribution of the last spectrum
+        self.y_data = None
+        self.points = deque(maxlen=history)
+        self.count = 0
+        self.error = None
+        self.started = time.time()
+        self.publish = publish
+        self.directory = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, name, wavelengths, absorbance):
+        """
+        Deconvolves one spectrum and appends its point to the series.
+        Returns the point.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            database, absorbance = pipeline.align_spectra(self.database, wavelengths, absorbance, self.align_mode)
+            x0 = self.x if self.x is not None and self.x.shape[0] == database.shape[1] else None
+            result = database.nnls(absorbance, self.solver, x0)
+            self.x = result.x
+            # Same as the PSD stages, without filling their caches
+            y_data = result.x*self.jacobian
+            y_data = y_data/max(y_data.max(), 1e-300)
+            if self.threshold is not None:
+                y_data[self.sizes < self.threshold] = 0
+            try:
+                fit = fitting.fit_lognormal(self.sizes, y_data, self.components)
+                mean, deviation = fitting.mixture_stats(fit.components)
+            except (RuntimeError, ValueError):
+                mean, deviation = np.nan, np.nan
+            self.count += 1
+            point = {
+                "time": time.time() - self.started, "name": name, "mean": float(mean),
+                "deviation": float(deviation), "residual": float(result.rnorm),
+                "latency": time.perf_counter() - start,
+            }
+            self.points.append(point)
+            self.y_data = y_data
+            self.error = None
+            snapshot = self.snapshot()
+        if self.publish is not None:
+            self.publish(snapshot)
+        return point
+
+    def add_file(self, name, source):
+        """
+        Reads a spectrum file (path or file-like object, the format from
+        the extension of name: Wavelength and Absorbance columns) and adds it.
+        """
+        df = read_table(source, name, ["Wavelength", "Absorbance"])
+        if type(df) == str:
+            raise ValueError(f"Unsupported format: {name}")
+        return self.add(name, df.Wavelength.to_numpy(), df.Absorbance.to_numpy())
+
+    def snapshot(self):
+        return {
+            "points": list(self.points), "count": self.count, "running": not self._stop.is_set(),
+            "directory": self.directory, "error": self.error,
+            "sizes": self.sizes.tolist(), "y": None if self.y_data is None else self.y_data.tolist(),
+        }
+
+    def follow(self, receive, directory=None):
+        """
+        Adds, from a background thread and until stop, the spectra
+        returned by receive() (a list of (name or None, bytes), None once
+        the run was stopped) and the files that appear in directory (the ones
+        already there are skipped).
+        """
+        self.directory = None if directory is None else str(directory)
+        self._thread = threading.Thread(
+            target=self._follow, args=(receive, None if directory is None else pathlib.Path(directory)),
+            daemon=True, name="ddd-kinetics",
+        )
+        self._thread.start()
+
+    def _follow(self, receive, directory):
+        # Files are taken in order of modification time, newer than the
+        # last one added: nothing grows with the number of spectra seen
+        last = (time.time(), "")
+        while not self._stop.wait(SCAN_SECONDS):
+            try:
+                posted = receive()
+            except Exception as e:
+                self._fail(f"Cannot read the posted spectra: {e}")
+                continue
+            if posted is None:
+                # Stopped or replaced, stop marked it in the store
+                self._stop.set()
+                break
+            for name, data in posted:
+                self._add_safely(name or f"spectrum-{self.count + 1}.csv", io.BytesIO(data))
+            if directory is None:
+                continue
+            settled = time.time() - SETTLE_SECONDS
+            try:
+                entries = sorted(
+                    (entry.stat().st_mtime, entry.name) for entry in os.scandir(directory) if entry.is_file()
+                )
+            except OSError as e:
+                self._fail(f"Cannot read {directory}: {e}")
+                continue
+            for mtime, name in entries:
+                if self._stop.is_set():
+                    break
+                if (mtime, name) <= last or mtime > settled:
+                    continue
+                last = (mtime, name)
+                self._add_safely(name, directory / name)
+
+    def _add_safely(self, name, source):
+        try:
+            self.add_file(name, source)
+        except Exception as e:
+            self._fail(f"{name}: {e}")
+
+    def _fail(self, message):
+        logger.warning("Live kinetics: %s", message)
+        with self._lock:
+            self.error = message
+            snapshot = self.snapshot()
+        if self.publish is not None:
+            self.publish(snapshot)
+
+    def stop(self):
+        self._stop.set()
+        if self.publish is not None:
+            with self._lock:
+                self.publish(self.snapshot())
+
+
+def watched_directory(name):
+    """
+    Directory to watch for name (relative to WATCH_ROOT). ValueError if
+    watching is disabled or name points outside WATCH_ROOT.
+    """
+    if not WATCH_ROOT:
+        raise ValueError("Watching directories is disabled (set DDD_KINETICS_DIR).")
+    root = pathlib.Path(WATCH_ROOT).resolve()
+    directory = (root / name).resolve()
+    if directory != root and root not in directory.parents:
+        raise ValueError(f"The directory must be inside {root}.")
+    if not directory.is_dir():
+        raise ValueError(f"No such directory: {directory}")
+    return directory
+
+
+def _session_dir(session_id):
+    if not session_id or not SESSION_ID_RE.match(session_id):
+        raise ValueError("Invalid session id")
+    return os.path.join(SPOOL_DIR, session_id)
+
+
+def _run_dir(session_id, run_id):
+    return os.path.join(_session_dir(session_id), run_id)
+
+
+def _current(session_id):
+    """
+    Id of the live run of the session, None if it has none.
+    """
+    try:
+        with open(os.path.join(_session_dir(session_id), "current")) as file:
+            run_id = file.read()
+    except FileNotFoundError:
+        return None
+    return run_id if os.path.isdir(_run_dir(session_id, run_id)) else None
+
+
+def _discard(session_id, run_id):
+    # Renamed first: from then on take and post no longer find it
+    stopped = _run_dir(session_id, run_id) + f".{uuid.uuid4().hex}.stopped"
+    try:
+        os.rename(_run_dir(session_id, run_id), stopped)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(stopped, ignore_errors=True)
+
+
+def start(store, session_id, run, directory=None):
+    """
+    Makes run the live run of the session (the previous one, in any
+    worker, stops at its next check) and starts following the spectra
+    posted to it and the files of directory. Its snapshots are published
+    to the "kinetics" key of the session state.
+    """
+    run_id = uuid.uuid4().hex
+
+    def publish(snapshot):
+        def func(state):
+            control = state.get(CONTROL)
+            # A replaced run does not overwrite the series of the new one
+            if control is not None and control["id"] == run_id:
+                state["kinetics"] = snapshot
+
+        store.modify(session_id, func)
+
+    previous = _current(session_id)
+    os.makedirs(_run_dir(session_id, run_id))
+    fd, tmp = tempfile.mkstemp(dir=_session_dir(session_id), suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        file.write(run_id)
+    os.replace(tmp, os.path.join(_session_dir(session_id), "current"))
+    if previous is not None:
+        _discard(session_id, previous)
+
+    run.publish = publish
+    store.modify(session_id, lambda state: state.update({CONTROL: {"id": run_id}, "kinetics": run.snapshot()}))
+    run.follow(lambda: take(session_id, run_id), directory)
+
+
+def take(session_id, run_id):
+    """
+    Posted spectra of the run not taken yet, in the order they arrived,
+    None if it was stopped or replaced by another run.
+    """
+    directory = _run_dir(session_id, run_id)
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".pkl"))
+    except FileNotFoundError:
+        return None
+    posted = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            with open(path, "rb") as file:
+                posted.append(pickle.load(file))
+            os.remove(path)
+        except FileNotFoundError:
+            # Stopped meanwhile
+            return None
+    return posted
+
+
+def stop(store, session_id):
+    """
+    Asks the live run of the session to stop, from any worker.
+    """
+    run_id = _current(session_id)
+    if run_id is not None:
+        _discard(session_id, run_id)
+
+    def func(state):
+        # Shown as stopped even if the worker of the run is gone
+        if state.get("kinetics") is not None:
+            state["kinetics"]["running"] = False
+
+    store.modify(session_id, func)
+
+
+def post(session_id, name, data):
+    """
+    Queues a spectrum (its file name, None for a default one, and bytes)
+    for the live run of the session. Returns the number of spectra
+    waiting, None if the session has no live run. ValueError if too
+    many are waiting.
+    """
+    run_id = _current(session_id)
+    if run_id is None:
+        return None
+    directory = _run_dir(session_id, run_id)
+    try:
+        pending = sum(entry.endswith(".pkl") for entry in os.listdir(directory))
+        if pending >= MAX_PENDING:
+            raise ValueError(f"{MAX_PENDING} spectra are already waiting for the run, retry later.")
+        # Named by arrival, written whole before take can see it
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump((name, data), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(directory, f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.pkl"))
+    except FileNotFoundError:
+        # Stopped meanwhile
+        return None
+    return pending + 1
+
+
+def install(server):
+    """
+    Adds the route that receives the spectra of the live runs.
+    """
+    import flask
+
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+
+    @server.route("/kinetics/<session_id>", methods=["POST"])
+    def kinetics_post(session_id):
+        if not SESSION_ID_RE.match(session_id):
+            return flask.jsonify({"error": "No live run for this session"}), 404
+        try:
+            pending = post(session_id, flask.request.args.get("filename"), flask.request.get_data())
+        except ValueError as e:
+            return flask.jsonify({"error": str(e)}), 429
+        if pending is None:
+            return flask.jsonify({"error": "No live run for this session"}), 404
+        # Deconvolved by the run within SCAN_SECONDS, the page shows it
+        return flask.jsonify({"pending": pending}), 202
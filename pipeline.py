@@ -0,0 +1,212 @@
+"""
+Deconvolution pipeline (AS -> AD -> NNLS -> Jacobian -> lognormal), used
+by the Dash callbacks and the command line (cli.py).
+
+The PSD computation is split in stages: parse Jacobian -> weight
+frequencies -> apply filter -> fit lognormal -> bin. Every stage is
+memoized by the content hash of its inputs, so changing the bin size
+only runs the binning stage, and changing the filter only the filter,
+fit and binning stages (the fit is reused too if the filter does not
+change the data).
+"""
+import functools
+import os
+import pathlib
+from collections import namedtuple
+
+import numpy as np
+
+from cache import LRUCache, digest
+from utils import load_df, load_file, FORMATS
+from binning import Stats, weighted_histogram, weighted_stats
+import alignment
+import fitting
+from instrumentation import instrumented
+
+
+STAGE_CACHE_BYTES = float(os.environ.get("DDD_STAGE_CACHE_MB", 16))*1024**2
+
+# Starts of the lognormal fits (run in parallel when more than one)
+FIT_STARTS = int(os.environ.get("DDD_FIT_STARTS", 1))
+
+# Every stage cache, by stage name
+stage_caches = {}
+
+PSD = namedtuple("PSD", ["y_data", "fit", "mean", "deviation", "histogram"])
+
+
+def _freeze(result):
+    """
+    Makes the arrays in result read-only, cached results are shared
+    between callers.
+    """
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, tuple):
+        for item in result:
+            _freeze(item)
+    return result
+
+
+def stage(func):
+    """
+    Memoizes func by the content hash of its arguments. Only the actual
+    computations (cache misses) are timed.
+    """
+    cache = LRUCache(STAGE_CACHE_BYTES, name=func.__name__)
+    stage_caches[func.__name__] = cache
+    timed = instrumented(func.__name__, kind="stage")(func)
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = digest(*args)
+        result = cache.get(key)
+        if result is None:
+            result = _freeze(timed(*args))
+            cache.put(key, result)
+        return result
+
+    wrapper.cache = cache
+    return wrapper
+
+
+def parse_jacobian(contents, filename):
+    """
+    Returns the Jacobian file as a DataFrame with Size and J columns,
+    or a string if the format is unsupported. Already cached by content
+    hash in load_df.
+    """
+    return load_df(contents, filename, ["Size", "J"])
+
+
+@stage
+def weight_frequencies(frequencies, jacobian):
+    """
+    Size frequencies from the NNLS coefficients times the Jacobian,
+    normalized to a maximum of 1.
+    """
+    y_data = np.asarray(frequencies, dtype=float)*np.asarray(jacobian, dtype=float)
+    return y_data/y_data.max()
+
+
+@stage
+def apply_filter(sizes, y_data, threshold):
+    """
+    Sets to zero the frequencies of the sizes below threshold
+    (None to not filter).
+    """
+    y_data = np.array(y_data, dtype=float)
+    if threshold is not None:
+        y_data[np.asarray(sizes) < threshold] = 0
+    return y_data
+
+
+@stage
+def fit_lognormal(sizes, y_data, components=1):
+    """
+    Returns the fitting.FitResult of the lognormal (or mixture of
+    lognormals) fit.
+    """
+    return fitting.fit_lognormal(sizes, y_data, components, starts=FIT_STARTS)
+
+
+@stage
+def bin_psd(sizes, y_data, bin_size):
+    return weighted_histogram(sizes, y_data, bin_size)
+
+
+@instrumented(kind="stage")
+def align_spectra(database, wavelengths, spectra, mode="crop"):
+    """
+    Puts the spectra (wavelengths x spectra) on the wavelengths of the
+    database, see alignment.alignment for the modes. Returns the
+    database restricted to the wavelengths used and the aligned spectra.
+    """
+    rows, matrix = alignment.alignment(wavelengths, database.wavelengths, mode)
+    return database.restrict(rows), alignment.align(matrix, spectra)
+
+
+def compute_psd(frequencies, sizes, jacobian, threshold=None, bin_size=None, components=1):
+    """
+    Runs the PSD stages for the NNLS frequencies of one spectrum.
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    y_data = weight_frequencies(frequencies, jacobian)
+    y_data = apply_filter(sizes, y_data, threshold)
+    fit = fit_lognormal(sizes, y_data, components)
+    mean, dev = fitting.mixture_stats(fit.components)
+    return PSD(y_data, fit, mean, dev, bin_psd(sizes, y_data, bin_size))
+
+
+def analyze_batch(database, spectra, names, sizes, jacobian, threshold=None, progress=None, solver=None):
+    """
+    Deconvolves every column of spectra (wavelengths x spectra) against
+    database (with the given NNLS solver, see solvers.py) and computes
+    its PSD with the Jacobian.
+    Returns the table of results (one row per spectrum) and the
+    normalized PSDs (sizes x spectra). progress, if given, is called
+    with the fraction of the work done (NNLS the first half, fits the
+    second).
+    """
+    import pandas as pd
+
+    frequencies, rnorms = database.solve_many(
+        spectra, None if progress is None else lambda fraction: progress(fraction/2), solver
+    )
+    sizes = np.asarray(sizes, dtype=float)
+    psds = np.empty_like(frequencies)
+    rows = []
+    for j, name in enumerate(names):
+        y_data = weight_frequencies(frequencies[:, j], jacobian)
+        y_data = apply_filter(sizes, y_data, threshold)
+        psds[:, j] = y_data
+        try:
+            mean, dev = fitting.mixture_stats(fit_lognormal(sizes, y_data).components)
+        except (RuntimeError, ValueError):
+            # The fit did not converge, the rest of the batch is still useful
+            mean, dev = np.nan, np.nan
+        if y_data.sum() > 0:
+            stats = weighted_stats(sizes, y_data)
+        else:
+            stats = Stats(np.nan, np.nan, np.nan)
+        rows.append({
+            "Spectrum": name,
+            "Residual": rnorms[j],
+            "Lognormal mean (nm)": mean,
+            "Lognormal deviation (nm)": dev,
+            "Weighted mean (nm)": stats.mean,
+            "Weighted deviation (nm)": stats.deviation,
+            "Mode (nm)": stats.mode,
+        })
+        if progress is not None:
+            progress(0.5 + (j + 1)/len(names)/2)
+    return pd.DataFrame(rows), psds
+
+
+def read_spectra(path):
+    """
+    Reads a spectra file: wavelengths in the first column and one
+    absorbance column per spectrum. Returns the wavelengths, the spectra
+    (wavelengths x spectra) and their names (the file name, followed by
+    the column name if there are several).
+    """
+    path = pathlib.Path(path)
+    df = load_file(path)
+    if type(df) == str:
+        raise ValueError(f"Only {FORMATS} are supported: {path}")
+    if df.shape[1] == 2:
+        names = [path.stem]
+    else:
+        names = [f"{path.stem}/{col}" for col in df.columns[1:]]
+    return df.iloc[:, 0].to_numpy(), df.iloc[:, 1:].to_numpy(), names
+
+
+def analyze_file(path, database, sizes, jacobian, threshold=None, mode="crop", solver=None):
+    """
+    Results table of every spectrum in the file at path.
+    """
+    wavelengths, spectra, names = read_spectra(path)
+    database, spectra = align_spectra(database, wavelengths, spectra, mode)
+    table, _ = analyze_batch(database, spectra, names, sizes, jacobian, threshold, solver=solver)
+    table.insert(0, "File", str(path))
+    return table
@@ -0,0 +1,256 @@
+"""
+Figures of spectra that stay light with large databases: WebGL traces
+downsampled with LTTB (Largest Triangle Three Buckets) to a budget of
+points per trace, and a heatmap instead of one trace per column when
+there are too many columns. Zooming in sends the relayout data back to
+the server, which redraws only the visible range, at full resolution if
+it fits in the budget.
+
+Their arrays are sent as base64 typed arrays of single precision (dtype
+and bdata, about a third of the bytes of JSON numbers) when the
+plotly.js of dash-core-components reads them (2.28 and later), else as
+single precision numbers if the JSON engine is orjson (which writes them
+in half the digits of double precision ones, see transport.py).
+"""
+import base64
+import functools
+import importlib.util
+import os
+import pathlib
+import re
+
+import numpy as np
+
+
+# Points per trace sent to the browser
+POINTS = int(os.environ.get("DDD_PLOT_POINTS", 1000))
+# More columns than this are shown as a heatmap
+MAX_TRACES = int(os.environ.get("DDD_PLOT_MAX_TRACES", 50))
+# Cells of the heatmaps sent to the browser
+CELLS = int(os.environ.get("DDD_PLOT_CELLS", 100000))
+# Significant digits of the heatmap values (relative to the largest)
+DIGITS = 4
+# Typed arrays: "auto" (if plotly.js reads them), "1" or "0"
+TYPED_ARRAYS = os.environ.get("DDD_PLOT_TYPED_ARRAYS", "auto")
+# First plotly.js that decodes typed arrays
+TYPED_ARRAYS_PLOTLYJS = (2, 28)
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of the points of each column of y (points x series) kept by
+    the Largest Triangle Three Buckets downsampling to n_out points
+    (n_out x series), which keeps the peaks and the shape of the curves.
+    Every series is processed at once, bucket by bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(x.size, -1)
+    n, n_series = y.shape
+    if n_out >= n or n_out < 3:
+        return np.repeat(np.arange(n)[:, None], n_series, axis=1)
+
+    columns = np.arange(n_series)
+    # First and last points are always kept, the rest is split in buckets
+    bounds = (np.arange(n_out - 1)*(n - 2)/(n_out - 2)).astype(int) + 1
+    bounds[-1] = n - 1
+    indices = np.empty((n_out, n_series), dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    for i in range(n_out - 2):
+        start, stop = bounds[i], bounds[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        if i < n_out - 3:
+            next_x = x[stop:bounds[i + 2]].mean()
+            next_y = y[stop:bounds[i + 2]].mean(axis=0)
+        else:
+            next_x, next_y = x[-1], y[-1]
+        a = indices[i]
+        ax, ay = x[a], y[a, columns]
+        areas = np.abs(
+            (ax - next_x)*(y[start:stop] - ay) - (ax - x[start:stop, None])*(next_y - ay)
+        )
+        indices[i + 1] = start + areas.argmax(axis=0)
+    return indices
+
+
+def visible(x, x_range):
+    """
+    Indices of x inside x_range (and one more at each side so the lines
+    reach the edges of the plot), every index if x_range is None.
+    """
+    x = np.asarray(x, dtype=float)
+    if x_range is None:
+        return np.arange(x.size)
+    low, high = sorted(x_range)
+    inside = np.flatnonzero((x >= low) & (x <= high))
+    if inside.size == 0:
+        return inside
+    return np.arange(max(inside[0] - 1, 0), min(inside[-1] + 2, x.size))
+
+
+def x_range_from(relayout):
+    """
+    Visible x range from the relayoutData of a dcc.Graph, None when
+    zoomed out (autorange). Raises KeyError if the x axis did not change.
+    """
+    for key, value in relayout.items():
+        if key.startswith("xaxis") and key.endswith(".autorange") and value:
+            return None
+    for key in relayout:
+        if key.startswith("xaxis") and key.endswith(".range[0]"):
+            axis = key[:-len(".range[0]")]
+            return relayout[key], relayout[axis + ".range[1]"]
+        if key.startswith("xaxis") and key.endswith(".range"):
+            return tuple(relayout[key])
+    raise KeyError("xaxis")
+
+
+@functools.lru_cache(maxsize=None)
+def plotlyjs_version():
+    """
+    (major, minor) version of the plotly.js bundled with
+    dash-core-components, None if it is not found.
+    """
+    for package in ("dash_core_components", "dash.dcc"):
+        try:
+            spec = importlib.util.find_spec(package)
+        except ImportError:
+            continue
+        if spec is None or spec.origin is None:
+            continue
+        for bundle in pathlib.Path(spec.origin).parent.glob("plotly*.js"):
+            with open(bundle, "rb") as file:
+                match = re.search(rb"plotly\.js v(\d+)\.(\d+)", file.read(1024))
+            if match:
+                return int(match[1]), int(match[2])
+    return None
+
+
+def typed_arrays():
+    if TYPED_ARRAYS == "auto":
+        version = plotlyjs_version()
+        return version is not None and version >= TYPED_ARRAYS_PLOTLYJS
+    return TYPED_ARRAYS == "1"
+
+
+def short_floats():
+    """
+    Whether the JSON engine of plotly (used by Dash for the responses)
+    writes single precision numbers shorter than double precision ones.
+    """
+    import plotly.io.json
+
+    engine = plotly.io.json.config.default_engine
+    return engine == "orjson" or (engine == "auto" and importlib.util.find_spec("orjson") is not None)
+
+
+def encode_array(values, typed, single=True):
+    """
+    Float array as a plotly.js typed array spec (dtype, bdata and
+    shape) of single precision if typed, else as single precision if
+    single, else unchanged.
+    """
+    if not typed and not single:
+        return values
+    values = np.ascontiguousarray(values, dtype="<f4")
+    if not typed:
+        return values
+    spec = {"dtype": "f4", "bdata": base64.b64encode(values.data).decode()}
+    if values.ndim > 1:
+        spec["shape"] = ", ".join(map(str, values.shape))
+    return spec
+
+
+def compact(figure, typed=None):
+    """
+    Encodes the float arrays (x, y and z) of the traces of figure (a
+    dict) in place with encode_array. typed defaults to typed_arrays().
+    The heatmap values stay numbers: rounded to DIGITS they compress to
+    less than their binary.
+    """
+    typed = typed_arrays() if typed is None else typed
+    single = typed or short_floats()
+    for trace in figure["data"]:
+        for key in ("x", "y", "z"):
+            value = trace.get(key)
+            if isinstance(value, np.ndarray) and value.dtype.kind == "f":
+                trace[key] = encode_array(value, typed and key != "z", single)
+    return figure
+
+
+def line_traces(x, y, names, x_range=None, points=POINTS, **kwargs):
+    """
+    Scattergl traces of the columns of y (points x series), restricted to
+    x_range and downsampled to points per trace.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(x.size, -1)
+    shown = visible(x, x_range)
+    x, y = x[shown], y[shown]
+    indices = lttb(x, y, points)
+    return [
+        dict(type="scattergl", x=x[indices[:, j]], y=y[indices[:, j], j], mode="lines", name=name, **kwargs)
+        for j, name in enumerate(names)
+    ]
+
+
+def heatmap_trace(x, y, names, x_range=None, cells=CELLS, **kwargs):
+    """
+    Heatmap of the columns of y (points x series) along x, one row per
+    column. Restricted to x_range and averaged in blocks along x down to
+    about cells values, rounded to DIGITS significant digits.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(x.size, -1)
+    shown = visible(x, x_range)
+    x, y = x[shown], y[shown]
+    points = max(cells//max(y.shape[1], 1), 2)
+    if x.size > points:
+        starts = np.linspace(0, x.size, points, endpoint=False).astype(int)
+        counts = np.diff(np.append(starts, x.size))
+        x = np.add.reduceat(x, starts)/counts
+        y = np.add.reduceat(y, starts, axis=0)/counts[:, None]
+    largest = np.abs(y).max() if y.size else 0
+    if largest > 0:
+        y = np.round(y, DIGITS - 1 - int(np.floor(np.log10(largest))))
+    return dict(type="heatmap", x=x, y=[str(name) for name in names], z=y.T, **kwargs)
+
+
+def spectra_figure(x, y, names, title, x_range=None, extra=(), revision=None):
+    """
+    Figure of the spectra in the columns of y (points x series) along x
+    (wavelengths): lines, or a heatmap with more than MAX_TRACES columns
+    (then extra, a list of (x, y, name) lines, goes to a panel above).
+    Zoom and hidden traces are kept while revision does not change.
+    The arrays are encoded by compact.
+    """
+    y = np.asarray(y, dtype=float).reshape(len(x), -1)
+    layout = {
+        "title": title,
+        "yaxis": dict(title="Absorbance"),
+        "uirevision": revision or title,
+    }
+    xaxis = dict(title="Wavelength (nm)")
+    if x_range is not None:
+        xaxis.update(range=list(x_range), autorange=False)
+
+    extra_traces = [trace for ex, ey, name in extra for trace in line_traces(ex, ey, [name], x_range)]
+    if y.shape[1] <= MAX_TRACES:
+        layout["xaxis"] = xaxis
+        return compact({"data": [*extra_traces, *line_traces(x, y, names, x_range)], "layout": layout})
+
+    heatmap = heatmap_trace(x, y, names, x_range, colorbar=dict(title="Absorbance"))
+    if not extra_traces:
+        layout.update(xaxis=xaxis, yaxis=dict(title="Size"))
+        return compact({"data": [heatmap], "layout": layout})
+    # Lines on top, heatmap below sharing the wavelength axis
+    heatmap.update(xaxis="x", yaxis="y2", colorbar=dict(title="Absorbance", y=0.3, len=0.6))
+    for trace in extra_traces:
+        trace.update(xaxis="x", yaxis="y")
+    xaxis.update(anchor="y2")
+    layout.update(
+        xaxis=xaxis,
+        yaxis=dict(title="Absorbance", domain=[0.65, 1]),
+        yaxis2=dict(title="Size", domain=[0, 0.6]),
+    )
+    return compact({"data": [*extra_traces, heatmap], "layout": layout})
@@ -0,0 +1,128 @@
+"""
+Tikhonov regularized NNLS, for smoother size distributions with fine
+databases:
+
+    min ||A z - b||^2 + lambda^2 ||z||^2,  z >= 0
+
+(A column-normalized, see databases.Database) over a whole grid of
+lambdas, as a path. The unconstrained solutions of every lambda come
+from the SVD of the database (Database.svd, computed once): where one is
+non-negative it is the solution, otherwise the warm-started active set
+(solvers.active_set) goes from the largest lambda down to the smallest,
+each one started from the previous solution, so every lambda takes a
+few iterations. The lambda is chosen by generalized cross validation
+(GCV) or the corner of the L-curve.
+"""
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import solvers
+
+
+# Lambdas of the grid, log spaced between LAMBDA_RANGE times the largest
+# singular value of the database
+N_LAMBDAS = int(os.environ.get("DDD_REG_LAMBDAS", 24))
+LAMBDA_RANGE = (1e-6, 1e-1)
+METHODS = ("gcv", "lcurve")
+
+Path = namedtuple("Path", [
+    "lambdas", "frequencies", "rnorms", "norms", "dofs", "gcv", "curvature", "best", "method", "iterations",
+    "converged",
+])
+
+
+def lambdas_for(database, n=N_LAMBDAS):
+    low, high = LAMBDA_RANGE
+    return np.sqrt(database.lipschitz)*np.logspace(np.log10(low), np.log10(high), n)
+
+
+def unconstrained(database, qtb, lambdas):
+    """
+    Tikhonov solutions without the non-negativity constraint for every
+    lambda (sizes x lambdas), in normalized units.
+    """
+    u, s, vt = database.svd()
+    projection = s*(u.T @ qtb)
+    return vt.T @ (projection[:, None]/(s[:, None]**2 + np.asarray(lambdas)[None, :]**2))
+
+
+def degrees_of_freedom(database, lambdas):
+    """
+    Trace of the influence matrix of the unconstrained problem for every
+    lambda, the usual approximation for the constrained one.
+    """
+    s = database.svd()[1]
+    return np.sum(s[:, None]**2/(s[:, None]**2 + np.asarray(lambdas)[None, :]**2), axis=0)
+
+
+def l_curve_curvature(rnorms, norms, lambdas):
+    """
+    Curvature of the L-curve (log residual norm, log solution norm)
+    parametrized by log lambda. The ends are -inf, they have no corner.
+    """
+    t = np.log(lambdas)
+    x, y = np.log(rnorms), np.log(np.maximum(norms, 1e-300))
+    dx, dy = np.gradient(x, t), np.gradient(y, t)
+    ddx, ddy = np.gradient(dx, t), np.gradient(dy, t)
+    curvature = (dx*ddy - ddx*dy)/np.maximum((dx*dx + dy*dy)**1.5, 1e-300)
+    curvature[[0, -1]] = -np.inf
+    return curvature
+
+
+def tikhonov_path(database, absorbance, lambdas=None, method="gcv", progress=None):
+    """
+    Regularized solutions of the absorbance spectrum for every lambda
+    (sorted in increasing order), with the GCV score and the L-curve
+    curvature of each, and the index of the one chosen by method ("gcv"
+    or "lcurve"). The frequencies (sizes x lambdas) are in the units of
+    Database.solve.
+    progress, if given, is called with the fraction of lambdas solved.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown regularization method: {method}")
+    absorbance = np.asarray(absorbance, dtype=float)
+    lambdas = lambdas_for(database) if lambdas is None else np.sort(np.asarray(lambdas, dtype=float))
+    qtb = database.q.T @ absorbance
+    outside = max(absorbance @ absorbance - qtb @ qtb, 0)
+    free = unconstrained(database, qtb, lambdas)
+    z = np.maximum(free[:, -1], 0)
+
+    m, n = database.shape
+    solutions = np.empty((n, lambdas.size))
+    rnorms = np.empty(lambdas.size)
+    converged = np.ones(lambdas.size, dtype=bool)
+    iterations = 0
+    for done, k in enumerate(range(lambdas.size - 1, -1, -1), 1):
+        lam = lambdas[k]
+        if free[:, k].min() >= 0:
+            z = solutions[:, k] = free[:, k]
+            rnorms[k] = np.sqrt(np.sum((database.r @ z - qtb)**2) + outside)
+        else:
+            result = solvers.active_set(database, qtb, z, ridge=lam**2)
+            z = solutions[:, k] = result.x
+            rnorms[k] = np.sqrt(result.rnorm**2 + outside)
+            converged[k] = result.converged
+            iterations += result.iterations or 0
+        if progress is not None:
+            progress(done/lambdas.size)
+
+    norms = np.linalg.norm(solutions, axis=0)
+    dofs = degrees_of_freedom(database, lambdas)
+    gcv = m*rnorms**2/np.maximum(m - dofs, 1)**2
+    curvature = l_curve_curvature(rnorms, norms, lambdas)
+    best = int(np.argmin(gcv) if method == "gcv" else np.argmax(curvature))
+    return Path(
+        lambdas, solutions/database.norms[:, None], rnorms, norms, dofs, gcv, curvature, best, method,
+        iterations, converged,
+    )
+
+
+def chosen(path):
+    """
+    solvers.SolveResult of the lambda chosen in path.
+    """
+    return solvers.SolveResult(
+        path.frequencies[:, path.best], path.rnorms[path.best], path.iterations, bool(path.converged[path.best]),
+    )
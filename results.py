@@ -0,0 +1,197 @@
+"""
+Persistent cache of analysis results, kept across restarts: a SQLite
+index and one .npz file of arrays per result, in DDD_RESULT_CACHE_DIR.
+Results are keyed by the content hashes of their inputs, so the same
+spectrum, database, Jacobian and settings opened another day get their
+NNLS solution and lognormal fit back without computing them. The least
+recently used results are deleted past DDD_RESULT_CACHE_MB.
+Every worker of the machine shares the same directory.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from binning import Histogram
+from cache import caches
+from fitting import FitResult
+from pipeline import PSD
+from regularization import Path
+from solvers import SolveResult
+
+
+logger = logging.getLogger("ddd.results")
+
+
+class ResultCache:
+    """
+    Arrays (a dict of numpy arrays) and metadata (a JSON serializable
+    dict) stored on disk by key, bounded by max_bytes of arrays.
+    """
+
+    def __init__(self, directory, max_bytes, name="results"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, meta TEXT, nbytes INTEGER, created REAL, accessed REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        caches.append(self)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Cache in DDD_RESULT_CACHE_DIR (a temporary directory by default,
+        None if set empty) of up to DDD_RESULT_CACHE_MB (256).
+        """
+        directory = os.environ.get("DDD_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ddd-results"))
+        if not directory:
+            return None
+        return cls(directory, float(os.environ.get("DDD_RESULT_CACHE_MB", 256))*1024**2)
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.directory, "results.sqlite"), timeout=30)
+
+    def _execute(self, query, parameters=()):
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(query, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """
+        Returns (arrays, meta) stored under key, None if there is none.
+        """
+        rows = self._execute("SELECT meta FROM results WHERE key = ?", (key,))
+        arrays = None
+        if rows:
+            try:
+                with np.load(self._path(key), allow_pickle=False) as npz:
+                    arrays = {name: npz[name] for name in npz.files}
+            except (OSError, ValueError) as e:
+                # Deleted by another worker's eviction or truncated
+                logger.warning("Dropping result %s: %s", key, e)
+                self._execute("DELETE FROM results WHERE key = ?", (key,))
+        with self._lock:
+            if arrays is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        return arrays, json.loads(rows[0][0])
+
+    def put(self, key, arrays, meta=None):
+        """
+        Stores arrays and meta under key, then deletes the least recently
+        used results over max_bytes.
+        """
+        path = self._path(key)
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(partial, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(partial, path)
+        nbytes = os.path.getsize(path)
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(meta or {}), nbytes, now, now),
+        )
+        self._evict()
+
+    def _evict(self):
+        rows = self._execute("SELECT key, nbytes FROM results ORDER BY accessed DESC")
+        total = 0
+        evicted = []
+        for key, nbytes in rows:
+            total += nbytes
+            if total > self.max_bytes:
+                evicted.append(key)
+        for key in evicted:
+            self._execute("DELETE FROM results WHERE key = ?", (key,))
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for (key,) in self._execute("SELECT key FROM results"):
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        self._execute("DELETE FROM results")
+
+    def stats(self):
+        entries, nbytes = self._execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM results")[0]
+        return {"name": self.name, "hits": self.hits, "misses": self.misses, "entries": entries, "bytes": nbytes}
+
+
+def pack_fit(result, path=None):
+    """
+    Arrays and metadata of an NNLS fit (solvers.SolveResult) and its
+    regularization.Path (None without regularization).
+    """
+    arrays = {"x": result.x}
+    meta = {
+        "rnorm": float(result.rnorm), "converged": bool(result.converged),
+        "iterations": None if result.iterations is None else int(result.iterations),
+    }
+    if path is not None:
+        arrays.update({f"path_{name}": getattr(path, name) for name in (
+            "lambdas", "frequencies", "rnorms", "norms", "dofs", "gcv", "curvature", "converged",
+        )})
+        meta["path"] = {"best": int(path.best), "method": path.method, "iterations": int(path.iterations)}
+    return arrays, meta
+
+
+def unpack_fit(arrays, meta):
+    result = SolveResult(arrays["x"], meta["rnorm"], meta["iterations"], meta["converged"])
+    path = None
+    if "path" in meta:
+        path = Path(
+            arrays["path_lambdas"], arrays["path_frequencies"], arrays["path_rnorms"], arrays["path_norms"],
+            arrays["path_dofs"], arrays["path_gcv"], arrays["path_curvature"], meta["path"]["best"],
+            meta["path"]["method"], meta["path"]["iterations"],
+            arrays.get("path_converged", np.ones(len(arrays["path_lambdas"]), dtype=bool)),
+        )
+    return result, path
+
+
+def pack_psd(psd):
+    """
+    Arrays and metadata of a pipeline.PSD: weighted distribution, fit
+    parameters, summary statistics and histogram.
+    """
+    arrays = {
+        "y_data": psd.y_data, "params": psd.fit.params, "components": psd.fit.components,
+        "edges": psd.histogram.edges, "centers": psd.histogram.centers,
+        "probabilities": psd.histogram.probabilities,
+    }
+    meta = {
+        "sse": float(psd.fit.sse), "starts": int(psd.fit.starts), "seconds": float(psd.fit.seconds),
+        "mean": float(psd.mean), "deviation": float(psd.deviation),
+    }
+    return arrays, meta
+
+
+def unpack_psd(arrays, meta):
+    fit = FitResult(arrays["params"], arrays["components"], meta["sse"], meta["starts"], meta["seconds"])
+    histogram = Histogram(arrays["edges"], arrays["centers"], arrays["probabilities"])
+    return PSD(arrays["y_data"], fit, meta["mean"], meta["deviation"], histogram)
@@ -0,0 +1,254 @@
+"""
+Non-negative least squares solvers for the Database.
+
+Every solver minimizes ||R z - qtb|| with z >= 0, where R is the
+triangular factor of the QR of the column-normalized database (see
+databases.Database), and has the same signature:
+
+    solver(database, qtb, z0=None, tol=TOL, max_iter=MAX_ITER) -> SolveResult
+
+z0 is a starting point (solvers without warm start ignore it), tol the
+relative tolerance of the optimality conditions and max_iter the limit
+of iterations. The result reports the iterations used (None if the
+solver does not tell) and whether it converged.
+"""
+import logging
+import os
+from collections import namedtuple
+
+import numpy as np
+
+
+logger = logging.getLogger("ddd.solvers")
+
+SolveResult = namedtuple("SolveResult", ["x", "rnorm", "iterations", "converged"])
+
+TOL = float(os.environ.get("DDD_SOLVER_TOL", 1e-8))
+MAX_ITER = int(os.environ.get("DDD_SOLVER_MAX_ITER", 5000))
+# Relative tolerance of the optimality check of active_set
+KKT_TOL = float(os.environ.get("DDD_SOLVER_KKT_TOL", 1e-6))
+
+
+def _rnorm(database, z, qtb):
+    return np.linalg.norm(database.r @ z - qtb)
+
+
+def scipy_active_set(database, qtb, z0=None, tol=TOL, max_iter=MAX_ITER):
+    """
+    Lawson-Hanson active set of scipy.optimize.nnls, without warm start.
+    The reference solution.
+    """
+    from scipy.optimize import nnls
+
+    z, rnorm = nnls(database.r, qtb, maxiter=max_iter)
+    return SolveResult(z, rnorm, None, True)
+
+
+def active_set(database, qtb, z0=None, tol=TOL, max_iter=MAX_ITER, ridge=0.0):
+    """
+    Lawson-Hanson active set started from the support of z0 (the sizes
+    with positive frequencies), so a solution close to the previous one
+    takes a few iterations instead of adding every size one by one.
+    Subproblems are solved by least squares on the columns of R of the
+    support (a QR, downdated when sizes leave the support), not on their
+    normal equations, which square the condition number (neighbouring sizes of a database are nearly collinear). It
+    stops when no size outside the support would lower the squared
+    residual by more than a fraction tol of it, and falls back to
+    scipy.optimize.nnls if the result fails the optimality (KKT) check.
+    ridge adds ridge*||z||^2 to the objective (Tikhonov regularization,
+    see regularization.py), the reported rnorm is still ||R z - qtb||.
+    """
+    import scipy.linalg
+
+    r = database.r
+    n = r.shape[1]
+    if ridge:
+        # ridge*||z||^2 is the squared residual of sqrt(ridge)*z against 0
+        a = np.vstack([r, np.sqrt(ridge)*np.eye(n)])
+        b = np.concatenate([qtb, np.zeros(n)])
+    else:
+        a, b = r, qtb
+    norms = np.linalg.norm(a, axis=0)
+
+    # Q of the QR of the support of the last subproblem, reused by gains
+    # QR of the support of the last subproblem (and the rows of a it
+    # uses), downdated when sizes leave the support and reused by gains
+    factor = {"passive": None, "q": None, "triangular": None, "rows": None}
+
+    def factorize(passive):
+        old = factor["passive"]
+        if old is not None and passive.any() and not (passive & ~old).any():
+            # Sizes only left: delete their columns, last first (their
+            # rows of sqrt(ridge)*I are now zero, they can stay)
+            q, triangular = factor["q"], factor["triangular"]
+            for k in np.flatnonzero(~passive[old])[::-1]:
+                q, triangular = scipy.linalg.qr_delete(q, triangular, k, which="col", overwrite_qr=True)
+            # From a square Q the result is a full QR, back to the thin one
+            q, triangular = q[:, :triangular.shape[1]], triangular[:triangular.shape[1]]
+            rows = factor["rows"]
+        else:
+            # The rows of sqrt(ridge)*I of the sizes outside the support
+            # are zero on it: only those of R and the support are needed
+            rows = np.arange(a.shape[0]) if not ridge else np.concatenate(
+                [np.arange(r.shape[0]), r.shape[0] + np.flatnonzero(passive)])
+            q, triangular = np.linalg.qr(a[np.ix_(rows, passive)])
+        factor.update(passive=passive.copy(), q=q, triangular=triangular, rows=rows)
+
+    def least_squares(passive):
+        s = np.zeros(n)
+        if passive.any():
+            factorize(passive)
+            q, triangular, rows = factor["q"], factor["triangular"], factor["rows"]
+            diagonal = np.abs(np.diag(triangular))
+            if diagonal.min() > 1e-12*diagonal.max():
+                s[passive] = scipy.linalg.solve_triangular(triangular, q.T @ b[rows])
+            else:
+                # Dependent columns (a warm start can bring any support)
+                s[passive] = np.linalg.lstsq(a[np.ix_(rows, passive)], b[rows], rcond=None)[0]
+        return s
+
+    def gains(z, passive):
+        # Decrease of the squared residual if each size joined the support:
+        # w_j^2 over the squared norm of the part of column j outside the
+        # span of the support (a small gradient can still be a large
+        # decrease for a size almost collinear with the support)
+        w = a.T @ (b - a @ z)
+        candidates = ~passive & (w > 0)
+        gain = np.zeros(n)
+        if candidates.any():
+            if passive.any():
+                if factor["passive"] is None or not np.array_equal(factor["passive"], passive):
+                    least_squares(passive)
+                q, rows = factor["q"], factor["rows"]
+                rest = a[np.ix_(rows, candidates)]
+                rest = rest - q @ (q.T @ rest)
+                # Plus the sqrt(ridge) of the candidates whose row is left out
+                left_out = np.ones(n, dtype=bool)
+                left_out[rows[rows >= r.shape[0]] - r.shape[0]] = False
+                rest_norms = np.sqrt(np.sum(rest**2, axis=0) + ridge*left_out[candidates])
+            else:
+                rest_norms = norms[candidates]
+            # Columns in the span of the support cannot lower it
+            independent = rest_norms > 1e-10*norms[candidates]
+            gain[candidates] = np.where(independent, w[candidates]/np.maximum(rest_norms, 1e-300), 0)**2
+        return gain
+
+    z = np.zeros(n) if z0 is None else np.maximum(np.asarray(z0, dtype=float), 0)
+    passive = z > 0
+    # Sizes that left the support as soon as they joined it, skipped
+    # until another size joins
+    rejected = np.zeros(n, dtype=bool)
+    iterations = 0
+    converged = False
+    # Without a warm start the first pass of the loop has nothing to fix
+    first = passive.any()
+    while iterations < max_iter:
+        j = None
+        if not first:
+            gain = gains(z, passive)
+            gain[rejected] = 0
+            j = np.argmax(gain)
+            residual = a @ z - b
+            if gain[j] <= tol*(residual @ residual):
+                converged = not rejected.any()
+                break
+            passive[j] = True
+        first = False
+        s = least_squares(passive)
+        # Step back towards z until every passive size is positive
+        while iterations < max_iter and passive.any() and s[passive].min() <= 0:
+            iterations += 1
+            negative = passive & (s <= 0)
+            alpha = np.min(z[negative]/(z[negative] - s[negative]))
+            z = z + alpha*(s - z)
+            passive &= z > 1e-15*max(z.max(), 1)
+            z[~passive] = 0
+            s = least_squares(passive)
+        z = s
+        iterations += 1
+        if j is not None:
+            if passive[j]:
+                rejected[:] = False
+            else:
+                rejected[j] = True
+    return _checked(database, qtb, a, b, z, iterations, converged, max_iter)
+
+
+def _checked(database, qtb, a, b, z, iterations, converged, max_iter):
+    """
+    SolveResult of active_set if z meets the optimality (KKT) conditions
+    of ||a z - b|| with z >= 0 (non-negative, zero gradient on the
+    positive sizes; the rest were checked by the loop), otherwise the
+    solution of scipy.optimize.nnls, without iteration count and
+    converged only if scipy did (else z is kept).
+    """
+    gradient = a.T @ (a @ z - b)
+    positive = z > 0
+    scale = max(np.abs(a.T @ b).max(), 1e-300)
+    if converged and z.min() >= 0 and np.abs(gradient[positive]).max(initial=0) <= KKT_TOL*scale:
+        return SolveResult(z, _rnorm(database, z, qtb), iterations, True)
+    from scipy.optimize import nnls
+
+    logger.info("Active set not optimal after %d iterations, solving with scipy", iterations)
+    try:
+        z, _ = nnls(a, b, maxiter=max_iter)
+    except RuntimeError as e:
+        logger.warning("scipy.optimize.nnls did not converge either: %s", e)
+        return SolveResult(z, _rnorm(database, z, qtb), None, False)
+    return SolveResult(z, _rnorm(database, z, qtb), None, True)
+
+
+def fista(database, qtb, z0=None, tol=TOL, max_iter=MAX_ITER):
+    """
+    Projected accelerated gradient (FISTA with adaptive restart) on the
+    normal equations, with the precomputed Gram matrix: one product per
+    iteration, but absorption databases are ill conditioned, so it needs
+    thousands and usually stops at max_iter without converging. An
+    approximate solver, kept for comparison.
+    """
+    gram = database.normal_gram
+    c = database.r.T @ qtb
+    step = 1/database.lipschitz
+    z = np.zeros(c.size) if z0 is None else np.maximum(np.asarray(z0, dtype=float), 0)
+    y = z.copy()
+    t = 1.0
+    scale = max(np.linalg.norm(c), 1e-300)
+    converged = False
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        z_new = np.maximum(y - step*(gram @ y - c), 0)
+        # Optimality (checked every few iterations, it costs a product):
+        # zero gradient on positive sizes, non negative on the rest
+        if iterations % 10 == 0 or iterations == max_iter:
+            gradient = gram @ z_new - c
+            if np.linalg.norm(np.minimum(z_new, gradient)) <= tol*scale:
+                z = z_new
+                converged = True
+                break
+        if np.dot(y - z_new, z_new - z) > 0:
+            # Momentum going uphill, restart it
+            t = 1.0
+        t_new = (1 + np.sqrt(1 + 4*t*t))/2
+        y = z_new + (t - 1)/t_new*(z_new - z)
+        z, t = z_new, t_new
+    return SolveResult(z, _rnorm(database, z, qtb), iterations, converged)
+
+
+SOLVERS = {
+    "scipy": scipy_active_set,
+    "active-set": active_set,
+    "fista": fista,
+}
+
+# Solver used when none is given
+DEFAULT = os.environ.get("DDD_SOLVER", "scipy")
+
+
+def get(name=None):
+    """
+    Solver function by name (DEFAULT if None).
+    """
+    try:
+        return SOLVERS[name or DEFAULT]
+    except KeyError:
+        raise ValueError(f"Unknown NNLS solver: {name} (choose from {', '.join(SOLVERS)})")
@@ -0,0 +1,54 @@
+"""
+Startup profile: how long each phase of the boot of a process takes
+(the imports of app.py, the creation of the server and the shared
+state, the layout, the pre-warming after fork). Phases are logged as a
+JSON line (logger "ddd.startup") by report and served by /metrics as
+ddd_startup_seconds.
+
+Only the standard library is imported here, app.py imports it first.
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger("ddd.startup")
+
+# Seconds of each phase by name, in the order they happened
+phases = {}
+_last = time.perf_counter()
+
+
+def mark(name):
+    """
+    Records the time since the previous mark (or the import of this
+    module) as the phase name.
+    """
+    global _last
+    now = time.perf_counter()
+    phases[name] = phases.get(name, 0.0) + now - _last
+    _last = now
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Records the time spent in the with block as the phase name (the
+    next mark counts from its end).
+    """
+    global _last
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _last = time.perf_counter()
+        phases[name] = phases.get(name, 0.0) + _last - start
+
+
+def report(event="startup"):
+    logger.info(json.dumps({
+        "event": event, "pid": os.getpid(), "total_s": round(sum(phases.values()), 6),
+        "phases": {name: round(seconds, 6) for name, seconds in phases.items()},
+    }))
@@ -0,0 +1,302 @@
+import os
+import re
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows, the disk backend is then only safe with one worker
+    fcntl = None
+
+
+# Session ids are generated with uuid4 in the layout, anything else is refused
+# (the disk backend uses them as file names)
+SESSION_ID_RE = re.compile(r"^[0-9a-fA-F-]{8,64}$")
+
+
+class MemoryBackend:
+    """
+    In-process backend. Only shared between the threads of one worker,
+    use it for local development or single worker deployments.
+    """
+    self_evicting = False
+
+    def __init__(self):
+        self._data = OrderedDict()
+
+    def load(self, session_id):
+        entry = self._data.get(session_id)
+        if entry is None:
+            return None
+        self._data.move_to_end(session_id)
+        self._data[session_id] = (entry[0], time.time())
+        return entry[0]
+
+    def save(self, session_id, blob):
+        self._data[session_id] = (blob, time.time())
+        self._data.move_to_end(session_id)
+
+    def delete(self, session_id):
+        self._data.pop(session_id, None)
+
+    def lock(self, session_id, blocking=True):
+        # The store lock already serializes the threads of this process
+        return nullcontext(True)
+
+    def entries(self):
+        """
+        Returns (session_id, last_access, nbytes) tuples, least recently
+        used first.
+        """
+        return [(sid, last, len(blob)) for sid, (blob, last) in self._data.items()]
+
+
+class DiskBackend:
+    """
+    Stores one pickle file per session in a directory. Every worker and
+    thread pointing to the same directory sees the same sessions, the
+    file modification time is used as last access time.
+    """
+    self_evicting = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.pkl")
+
+    def load(self, session_id):
+        path = self._path(session_id)
+        try:
+            with open(path, "rb") as file:
+                blob = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return blob
+
+    def save(self, session_id, blob):
+        # Write to a temporary file first so readers never see half a pickle
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(blob)
+        os.replace(tmp, self._path(session_id))
+
+    def delete(self, session_id):
+        for path in (self._path(session_id), os.path.join(self.directory, f"{session_id}.lock")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def lock(self, session_id, blocking=True):
+        """
+        Exclusive lock on the session shared between processes, so two
+        workers updating the same session do not lose each other's keys.
+        Yields whether it was acquired: without blocking, False at once
+        if someone else holds it.
+        """
+        if fcntl is None:
+            yield True
+            return
+        path = os.path.join(self.directory, f"{session_id}.lock")
+        while True:
+            file = open(path, "a")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                break
+            # delete removes the lock file: if it did while we waited, the
+            # lock we hold is no one else's, lock the new file instead
+            try:
+                if os.stat(path).st_ino == os.fstat(file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            file.close()
+        if file.closed:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+            file.close()
+
+    def entries(self):
+        entries = []
+        for item in os.scandir(self.directory):
+            if not item.name.endswith(".pkl"):
+                continue
+            try:
+                stat = item.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((item.name[:-4], stat.st_mtime, stat.st_size))
+        return sorted(entries, key=lambda entry: entry[1])
+
+
+class RedisBackend:
+    """
+    Stores sessions in a Redis server (or anything speaking its protocol).
+    Expiration is delegated to Redis with the TTL, and the memory budget
+    to the server's maxmemory-policy (use allkeys-lru).
+    """
+    self_evicting = True
+
+    def __init__(self, url, ttl, prefix="ddd:session:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                "DDD_STORE_BACKEND=redis needs the redis package, which is optional and not in "
+                "requirements.txt: pip install redis"
+            )
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def load(self, session_id):
+        key = self.prefix + session_id
+        blob = self.client.get(key)
+        if blob is not None:
+            self.client.expire(key, int(self.ttl))
+        return blob
+
+    def save(self, session_id, blob):
+        self.client.set(self.prefix + session_id, blob, ex=int(self.ttl))
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+    def lock(self, session_id, blocking=True):
+        return self.client.lock(self.prefix + session_id + ":lock", timeout=30, blocking=blocking)
+
+    def entries(self):
+        return []
+
+
+class SessionStore:
+    """
+    Server side state of each user session (uploaded DataFrames, NNLS
+    results, etc.) keyed by the session id stored in the browser.
+    Sessions are evicted when they are older than ttl seconds, when there
+    are more than max_sessions or when all of them together use more than
+    max_bytes (least recently used first).
+    """
+
+    def __init__(self, backend, max_sessions=100, ttl=3600, max_bytes=512*1024**2):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the store from environment variables:
+        DDD_STORE_BACKEND (memory, disk or redis), DDD_STORE_DIR,
+        DDD_REDIS_URL, DDD_STORE_MAX_SESSIONS, DDD_STORE_TTL and
+        DDD_STORE_MAX_MB.
+        """
+        ttl = float(os.environ.get("DDD_STORE_TTL", 3600))
+        kind = os.environ.get("DDD_STORE_BACKEND", "memory")
+        if kind == "memory":
+            backend = MemoryBackend()
+        elif kind == "disk":
+            directory = os.environ.get(
+                "DDD_STORE_DIR", os.path.join(tempfile.gettempdir(), "ddd-sessions")
+            )
+            backend = DiskBackend(directory)
+        elif kind == "redis":
+            backend = RedisBackend(os.environ.get("DDD_REDIS_URL", "redis://localhost:6379/0"), ttl)
+        else:
+            raise ValueError(f"Unknown session store backend: {kind}")
+        return cls(
+            backend,
+            max_sessions=int(os.environ.get("DDD_STORE_MAX_SESSIONS", 100)),
+            ttl=ttl,
+            max_bytes=float(os.environ.get("DDD_STORE_MAX_MB", 512))*1024**2,
+        )
+
+    def get(self, session_id):
+        """
+        Returns the state of the session as a dict (empty if the session
+        is unknown or expired). Modifying it does not change the store,
+        use update for that.
+        """
+        if not session_id or not SESSION_ID_RE.match(session_id):
+            return {}
+        with self._lock:
+            self._evict()
+            blob = self.backend.load(session_id)
+        if blob is None:
+            return {}
+        return pickle.loads(blob)
+
+    def update(self, session_id, **values):
+        """
+        Sets the given keys in the session state.
+        """
+        self.modify(session_id, lambda state: state.update(values))
+        with self._lock:
+            self._evict(keep=session_id)
+
+    def modify(self, session_id, func):
+        """
+        Calls func with the state of the session and saves the changes
+        it makes to it, with no other update in between (from any worker
+        sharing the backend). Returns what func returns.
+        """
+        if not session_id or not SESSION_ID_RE.match(session_id):
+            raise ValueError("Invalid session id")
+        with self._lock, self.backend.lock(session_id):
+            blob = self.backend.load(session_id)
+            state = pickle.loads(blob) if blob is not None else {}
+            value = func(state)
+            new_blob = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            # Unchanged or still empty (an unknown session) is not saved
+            if new_blob != blob and (state or blob is not None):
+                self.backend.save(session_id, new_blob)
+        return value
+
+    def delete(self, session_id):
+        with self._lock, self.backend.lock(session_id):
+            self.backend.delete(session_id)
+
+    def _evict(self, keep=None):
+        if self.backend.self_evicting:
+            return
+        entries = self.backend.entries()
+        now = time.time()
+        alive = []
+        for session_id, last_access, nbytes in entries:
+            if now - last_access > self.ttl and session_id != keep and self._discard(session_id):
+                continue
+            alive.append((session_id, nbytes))
+        count = len(alive)
+        total = sum(nbytes for _, nbytes in alive)
+        # alive is ordered least recently used first
+        for session_id, nbytes in alive:
+            if count <= self.max_sessions and total <= self.max_bytes:
+                break
+            if session_id == keep or not self._discard(session_id):
+                continue
+            count -= 1
+            total -= nbytes
+
+    def _discard(self, session_id):
+        # Sessions being modified (by another worker) are skipped rather
+        # than deleted under their lock, the next eviction gets them
+        with self.backend.lock(session_id, blocking=False) as locked:
+            if locked:
+                self.backend.delete(session_id)
+        return locked
@@ -0,0 +1,31 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+import databases  # noqa: E402
+
+
+def make_database(n_sizes=12, seed=0):
+    """
+    Database of n_sizes overlapping Gaussian bands (nearly collinear
+    neighbours, like real ones) over 150 wavelengths.
+    """
+    rng = np.random.default_rng(seed)
+    wavelengths = np.linspace(400, 700, 150)
+    centers = np.linspace(420, 680, n_sizes)
+    matrix = np.exp(-0.5*((wavelengths[:, None] - centers)/40)**2)*(1 + 0.05*rng.random(n_sizes))
+    return databases.Database("test", wavelengths, np.arange(n_sizes), matrix)
+
+
+def spectrum(database, noise, seed=0):
+    """
+    Absorbance of a Gaussian size distribution x with noise relative to
+    its largest value, and x.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.exp(-0.5*((np.arange(database.shape[1]) - database.shape[1]/2)/2)**2)
+    clean = database.matrix @ x
+    return clean + noise*clean.max()*rng.standard_normal(clean.size), x
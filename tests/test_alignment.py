@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import alignment
+
+
+def grids(seed=0):
+    rng = np.random.default_rng(seed)
+    # Unsorted, irregular source grid narrower than the target
+    source = rng.permutation(np.sort(rng.uniform(400, 700, 120)))
+    target = np.linspace(350, 750, 201)
+    spectra = rng.standard_normal((source.size, 3))
+    return source, target, spectra
+
+
+def interp(source, target, spectra):
+    order = np.argsort(source)
+    return np.column_stack([np.interp(target, source[order], column[order]) for column in spectra.T])
+
+
+def test_crop_matches_interp():
+    source, target, spectra = grids()
+    rows, matrix = alignment.alignment(source, target, "crop")
+    np.testing.assert_array_equal(rows, np.flatnonzero((target >= source.min()) & (target <= source.max())))
+    np.testing.assert_allclose(alignment.align(matrix, spectra), interp(source, target[rows], spectra),
+                               rtol=0, atol=1e-12)
+
+
+def test_resample_matches_interp():
+    # np.interp repeats the edge values outside the source range too
+    source, target, spectra = grids(1)
+    rows, matrix = alignment.alignment(source, target, "resample")
+    np.testing.assert_array_equal(rows, np.arange(target.size))
+    np.testing.assert_allclose(alignment.align(matrix, spectra), interp(source, target, spectra),
+                               rtol=0, atol=1e-12)
+    # Rows of an interpolation add up to 1
+    np.testing.assert_allclose(np.asarray(matrix.sum(axis=1)).ravel(), 1)
+
+
+def test_same_grid_is_identity():
+    source, _, spectra = grids()
+    rows, matrix = alignment.alignment(source, source.copy())
+    assert matrix is None
+    np.testing.assert_array_equal(alignment.align(matrix, spectra), spectra)
+
+
+def test_cached_per_grid_pair():
+    source, target, _ = grids(2)
+    _, first = alignment.alignment(source, target, "crop")
+    _, second = alignment.alignment(source.copy(), target.copy(), "crop")
+    assert second is first
+
+
+@pytest.mark.parametrize("source, target", [
+    (np.array([1.0, 2.0]), np.array([3.0, 4.0])),
+    (np.array([1.0]), np.array([2.0, 3.0])),
+])
+def test_invalid(source, target):
+    with pytest.raises(ValueError):
+        alignment.alignment(source, target, "crop")
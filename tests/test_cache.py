@@ -0,0 +1,58 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import cache
+
+
+def test_lru_evicts_least_recently_used_by_size():
+    lru = cache.LRUCache(100, name="test")
+    lru.put("a", np.zeros(5))      # 40 bytes
+    lru.put("b", np.zeros(5))
+    assert lru.nbytes == 80
+    lru.get("a")
+    lru.put("c", np.zeros(5))
+    assert lru.get("b") is None
+    assert lru.get("a") is not None and lru.get("c") is not None
+    assert lru.nbytes == 80 and len(lru) == 2
+    assert lru.stats() == {"name": "test", "hits": 3, "misses": 1, "entries": 2, "bytes": 80}
+
+
+def test_lru_replace_and_oversized():
+    lru = cache.LRUCache(100)
+    lru.put("a", "x", nbytes=60)
+    lru.put("a", "y", nbytes=30)
+    assert lru.nbytes == 30 and lru.get("a") == "y"
+    lru.put("big", "z", nbytes=101)
+    assert lru.get("big") is None and lru.get("a") == "y"
+    lru.clear()
+    assert lru.nbytes == 0 and len(lru) == 0
+
+
+def test_lru_threads_keep_size_consistent():
+    lru = cache.LRUCache(1000)
+
+    def work(offset):
+        for k in range(2000):
+            lru.put((offset, k % 50), k, nbytes=10 + k % 7)
+            lru.get((offset, (k*7) % 50))
+
+    threads = [threading.Thread(target=work, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert lru.nbytes == sum(nbytes for _, nbytes in lru._data.values()) <= 1000
+
+
+def test_sizeof_and_digest():
+    df = pd.DataFrame({"a": np.arange(10.0), "b": np.arange(10.0)})
+    assert cache.sizeof(df) >= 160
+    assert cache.sizeof([np.zeros(10), np.zeros(5)]) >= 120
+    assert cache.digest(df) == cache.digest(df.copy())
+    assert cache.digest(np.zeros(3)) != cache.digest(np.zeros(3, dtype=np.float32))
+    assert cache.digest(np.zeros(4)) != cache.digest(np.zeros((2, 2)))
+    assert cache.digest("data:text/csv;base64,QQ==") == cache.digest("data:text/csv;base64,QQ==")
+    assert cache.digest("a", "b") != cache.digest("ab")
+    assert cache.digest("µm") != cache.digest("um")
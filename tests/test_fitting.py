@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import fitting
+from utils import lognormal
+
+
+def test_fit_recovers_lognormal():
+    sizes = np.linspace(1.96, 6.42, 11)
+    fit = fitting.fit_lognormal(sizes, lognormal(sizes, 3.0, 0.2))
+    np.testing.assert_allclose(fit.params, [3.0, 0.2], rtol=1e-6)
+
+
+@pytest.mark.parametrize("n_sizes, components", [(11, 4), (5, 2), (1, 1)])
+def test_too_many_components(n_sizes, components):
+    sizes = np.linspace(2, 6, n_sizes)
+    with pytest.raises(ValueError, match=f"the distribution has {n_sizes}"):
+        fitting.fit_lognormal(sizes, lognormal(sizes, 3.0, 0.3), components)
+
+
+def test_most_components_fit():
+    sizes = np.linspace(1.96, 6.42, 11)
+    y_data = lognormal(sizes, 2.5, 0.1) + 0.5*lognormal(sizes, 5.0, 0.1)
+    fit = fitting.fit_lognormal(sizes, y_data, 3)
+    assert fit.components.shape == (3, 3)
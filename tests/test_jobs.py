@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return jobs.MemoryBackend()
+    return jobs.SQLiteBackend(str(tmp_path / "jobs.sqlite"))
+
+
+def wait(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while queue.status(job_id)["status"] not in jobs.FINISHED:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    return queue.status(job_id)
+
+
+def test_job_of_a_dead_worker_fails_and_is_not_reused(backend):
+    queue = jobs.JobQueue(backend, stale=0.2)
+    # Left running by a worker that died
+    backend.create("lost", "key")
+    backend.update("lost", status=jobs.RUNNING)
+    time.sleep(0.3)
+
+    job_id = queue.submit(lambda progress: 42, key="key")
+    assert job_id != "lost"
+    assert backend.get("lost")["status"] == jobs.FAILED
+    assert backend.get("lost")["error"] == jobs.LOST
+    assert wait(queue, job_id)["status"] == jobs.DONE
+    assert queue.result(job_id) == 42
+
+
+def test_heartbeat_keeps_a_slow_job_alive(backend):
+    queue = jobs.JobQueue(backend, stale=0.2)
+    job_id = queue.submit(lambda progress: time.sleep(0.6) or "slow", key="slow")
+    time.sleep(0.4)
+    assert queue.status(job_id)["status"] == jobs.RUNNING
+    assert queue.submit(lambda progress: "again", key="slow") == job_id
+    assert wait(queue, job_id)["status"] == jobs.DONE
+    assert queue.result(job_id) == "slow"
+
+
+def test_cancel(backend):
+    queue = jobs.JobQueue(backend)
+
+    def func(progress):
+        for _ in range(500):
+            progress(0.5)
+            time.sleep(0.01)
+
+    job_id = queue.submit(func)
+    time.sleep(0.05)
+    queue.cancel(job_id)
+    assert wait(queue, job_id)["status"] == jobs.CANCELLED
@@ -0,0 +1,105 @@
+import io
+import time
+
+import numpy as np
+import pytest
+
+import databases
+import kinetics
+from store import DiskBackend, SessionStore
+
+SESSION = "0123456789abcdef"
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """
+    Two session stores on the same directory, like two gunicorn workers,
+    and the spool directory they share.
+    """
+    monkeypatch.setattr(kinetics, "SCAN_SECONDS", 0.02)
+    monkeypatch.setattr(kinetics, "SPOOL_DIR", str(tmp_path / "spool"))
+    sessions = str(tmp_path / "sessions")
+    return SessionStore(DiskBackend(sessions)), SessionStore(DiskBackend(sessions))
+
+
+def make_run():
+    wavelengths = np.linspace(400, 700, 61)
+    sizes = np.array([2.0, 3.0, 4.0, 5.0])
+    matrix = np.exp(-0.5*((wavelengths[:, None] - 400 - 60*sizes)/30)**2)*sizes**3
+    database = databases.Database("test", wavelengths, sizes, matrix)
+    return kinetics.Run(database, sizes, 1/sizes**3), database
+
+
+def spectrum(database, weights):
+    text = io.StringIO()
+    np.savetxt(text, np.column_stack([database.wavelengths, database.matrix @ weights]), delimiter=",",
+               header="Wavelength,Absorbance", comments="")
+    return text.getvalue().encode()
+
+
+def wait_for(func, timeout=5):
+    deadline = time.time() + timeout
+    while not func():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_posts_and_stop_from_another_worker(workers):
+    owner, other = workers
+    run, database = make_run()
+    kinetics.start(owner, SESSION, run)
+
+    for k in range(3):
+        assert kinetics.post(SESSION, f"s{k}.csv", spectrum(database, np.array([0, 1, 2, 0.5])/(k + 1)))
+    wait_for(lambda: other.get(SESSION)["kinetics"]["count"] == 3)
+    snapshot = other.get(SESSION)["kinetics"]
+    assert [point["name"] for point in snapshot["points"]] == ["s0.csv", "s1.csv", "s2.csv"]
+    assert snapshot["error"] is None and snapshot["running"]
+
+    kinetics.stop(other, SESSION)
+    run._thread.join(5)
+    assert not run._thread.is_alive()
+    assert not other.get(SESSION)["kinetics"]["running"]
+    assert kinetics.post(SESSION, "late.csv", b"") is None
+
+
+def test_new_run_replaces_the_previous_one(workers):
+    owner, other = workers
+    first, database = make_run()
+    kinetics.start(owner, SESSION, first)
+    second, _ = make_run()
+    kinetics.start(other, SESSION, second)
+    first._thread.join(5)
+    assert not first._thread.is_alive()
+
+    kinetics.post(SESSION, "s.csv", spectrum(database, np.array([1, 1, 0, 0])))
+    wait_for(lambda: owner.get(SESSION)["kinetics"]["count"] == 1)
+    assert first.count == 0 and second.count == 1
+    kinetics.stop(owner, SESSION)
+    second._thread.join(5)
+
+
+def test_posted_spectra_wait_outside_the_session(workers, monkeypatch):
+    owner, other = workers
+    # The run does not look for them during the test
+    monkeypatch.setattr(kinetics, "SCAN_SECONDS", 60)
+    monkeypatch.setattr(kinetics, "MAX_PENDING", 2)
+    run, database = make_run()
+    kinetics.start(owner, SESSION, run)
+    data = spectrum(database, np.array([1, 1, 0, 0]))
+    assert kinetics.post(SESSION, "a.csv", data) == 1
+    assert kinetics.post(SESSION, None, data) == 2
+    with pytest.raises(ValueError):
+        kinetics.post(SESSION, "c.csv", data)
+    state = owner.get(SESSION)
+    assert set(state[kinetics.CONTROL]) == {"id"}
+    assert kinetics.take(SESSION, state[kinetics.CONTROL]["id"]) == [("a.csv", data), (None, data)]
+    assert kinetics.take(SESSION, state[kinetics.CONTROL]["id"]) == []
+    kinetics.stop(other, SESSION)
+    assert kinetics.take(SESSION, state[kinetics.CONTROL]["id"]) is None
+    run.stop()
+
+
+def test_post_without_run(workers):
+    assert kinetics.post(SESSION, "s.csv", b"") is None
@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+import pytest
+
+import plots
+
+
+def reference_lttb(x, y, n_out):
+    """
+    Largest Triangle Three Buckets as published by Steinarsson (2013),
+    one series, point by point.
+    """
+    n = len(x)
+    every = (n - 2)/(n_out - 2)
+    kept = [0]
+    a = 0
+    for i in range(n_out - 2):
+        next_start = int(math.floor((i + 1)*every)) + 1
+        next_stop = min(int(math.floor((i + 2)*every)) + 1, n)
+        next_x = sum(x[next_start:next_stop])/(next_stop - next_start)
+        next_y = sum(y[next_start:next_stop])/(next_stop - next_start)
+        start = int(math.floor(i*every)) + 1
+        stop = int(math.floor((i + 1)*every)) + 1
+        best, best_area = start, -1.0
+        for j in range(start, stop):
+            area = abs((x[a] - next_x)*(y[j] - y[a]) - (x[a] - x[j])*(next_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
+
+
+@pytest.mark.parametrize("n, n_out", [(1000, 100), (1001, 37), (5000, 1000), (10, 3)])
+def test_lttb_matches_reference(n, n_out):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.uniform(300, 800, n))
+    y = np.cumsum(rng.standard_normal((n, 4)), axis=0)
+    indices = plots.lttb(x, y, n_out)
+    assert indices.shape == (n_out, 4)
+    for j in range(y.shape[1]):
+        assert indices[:, j].tolist() == reference_lttb(x.tolist(), y[:, j].tolist(), n_out)
+
+
+def test_lttb_keeps_peaks():
+    x = np.linspace(300, 800, 10000)
+    y = np.exp(-0.5*((x - 523.4)/0.2)**2)
+    indices = plots.lttb(x, y, 200)[:, 0]
+    assert np.argmax(y) in indices
+    assert np.all(np.diff(indices) > 0)
+
+
+@pytest.mark.parametrize("n_out", [2, 50, 60])
+def test_lttb_short_series_kept_whole(n_out):
+    x = np.arange(50.0)
+    indices = plots.lttb(x, np.column_stack([x, -x]), n_out)
+    np.testing.assert_array_equal(indices, np.repeat(np.arange(50)[:, None], 2, axis=1))
+
+
+def test_line_traces_downsampled_in_range():
+    x = np.linspace(300, 800, 5001)
+    y = np.column_stack([np.sin(x/10), np.cos(x/7)])
+    traces = plots.line_traces(x, y, ["a", "b"], x_range=(400, 600), points=100)
+    assert [trace["name"] for trace in traces] == ["a", "b"]
+    for trace in traces:
+        assert trace["type"] == "scattergl"
+        assert len(trace["x"]) == 100
+        assert trace["x"][0] >= 400 - 0.2 and trace["x"][-1] <= 600 + 0.2
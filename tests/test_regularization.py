@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from scipy.optimize import nnls
+
+from conftest import make_database, spectrum
+import regularization
+import solvers
+
+
+@pytest.mark.parametrize("method", regularization.METHODS)
+def test_path_matches_augmented_nnls(method):
+    database = make_database()
+    absorbance, _ = spectrum(database, 0.05)
+    path = regularization.tikhonov_path(database, absorbance, method=method)
+    a = database.matrix/database.norms
+    n = database.shape[1]
+    for k, lam in enumerate(path.lambdas):
+        z, _ = nnls(np.vstack([a, lam*np.eye(n)]), np.concatenate([absorbance, np.zeros(n)]), maxiter=100*n)
+        np.testing.assert_allclose(path.frequencies[:, k]*database.norms, z, rtol=1e-6, atol=1e-9*np.abs(z).max())
+        assert path.rnorms[k] == pytest.approx(np.linalg.norm(a @ z - absorbance), rel=1e-6)
+    # More regularization: larger residual, smaller solution
+    assert np.all(np.diff(path.rnorms) >= -1e-9*path.rnorms.max())
+    assert np.all(np.diff(path.norms) <= 1e-9*path.norms.max())
+
+
+def test_path_with_more_sizes_than_wavelengths():
+    # R is wider than tall: its SVD is thin, the solutions are optimal up
+    # to the stopping tolerance of the active set
+    database = make_database(200)
+    absorbance, _ = spectrum(database, 0.05)
+    path = regularization.tikhonov_path(database, absorbance)
+    a = database.matrix/database.norms
+    n = database.shape[1]
+    for k, lam in enumerate(path.lambdas):
+        z, _ = nnls(np.vstack([a, lam*np.eye(n)]), np.concatenate([absorbance, np.zeros(n)]), maxiter=100*n)
+        x = path.frequencies[:, k]*database.norms
+        assert x.min() >= 0
+        objective = np.sum((a @ z - absorbance)**2) + lam**2*(z @ z)
+        assert np.sum((a @ x - absorbance)**2) + lam**2*(x @ x) == pytest.approx(objective, rel=10*solvers.TOL)
+
+
+def test_gcv_of_positive_path_matches_closed_form():
+    # Little noise and a positive distribution: every solution is positive,
+    # so the path is the unconstrained Tikhonov one
+    database = make_database()
+    absorbance, _ = spectrum(database, 1e-4)
+    lambdas = regularization.lambdas_for(database)[:8]
+    path = regularization.tikhonov_path(database, absorbance, lambdas=lambdas, method="gcv")
+    assert (path.frequencies > 0).all()
+
+    a = database.matrix/database.norms
+    m, n = a.shape
+    for k, lam in enumerate(lambdas):
+        influence = a @ np.linalg.solve(a.T @ a + lam**2*np.eye(n), a.T)
+        residual = np.linalg.norm(influence @ absorbance - absorbance)
+        assert path.dofs[k] == pytest.approx(np.trace(influence), rel=1e-8)
+        assert path.gcv[k] == pytest.approx(m*residual**2/(m - np.trace(influence))**2, rel=1e-6)
+    assert path.best == np.argmin(path.gcv)
+
+
+def test_gcv_beats_the_extremes():
+    database = make_database(30)
+    absorbance, x = spectrum(database, 0.02)
+    path = regularization.tikhonov_path(database, absorbance, method="gcv")
+    errors = np.linalg.norm(path.frequencies - x[:, None], axis=0)
+    assert 0 < path.best < path.lambdas.size - 1
+    assert errors[path.best] < errors[0]
+    assert errors[path.best] < errors[-1]
+
+
+def test_l_curve_curvature_of_a_circle():
+    # (log rnorm, log norm) on the unit circle, parametrized by log lambda
+    t = np.linspace(0, np.pi, 2001)
+    curvature = regularization.l_curve_curvature(np.exp(np.cos(t)), np.exp(np.sin(t)), np.exp(t))
+    assert np.isneginf(curvature[[0, -1]]).all()
+    np.testing.assert_allclose(curvature[2:-2], 1, rtol=1e-5)
+
+
+def test_lcurve_picks_the_corner():
+    database = make_database()
+    absorbance, _ = spectrum(database, 0.05)
+    path = regularization.tikhonov_path(database, absorbance, method="lcurve")
+    assert path.best == np.argmax(path.curvature)
+    assert 0 < path.best < path.lambdas.size - 1
+
+
+def test_chosen_reports_the_convergence_of_its_lambda(monkeypatch):
+    database = make_database()
+    absorbance, _ = spectrum(database, 0.05)
+    path = regularization.tikhonov_path(database, absorbance)
+    assert path.converged.all()
+    assert regularization.chosen(path).converged
+
+    def stopped(*args, **kwargs):
+        return result._replace(converged=False)
+
+    result = regularization.solvers.active_set(database, database.q.T @ absorbance, ridge=1.0)
+    monkeypatch.setattr(regularization.solvers, "active_set", stopped)
+    path = regularization.tikhonov_path(database, absorbance)
+    assert not path.converged.all()
+    assert regularization.chosen(path).converged == path.converged[path.best]
+
+
+def test_unknown_method():
+    database = make_database()
+    with pytest.raises(ValueError):
+        regularization.tikhonov_path(database, spectrum(database, 0)[0], method="aic")
@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+
+import regularization
+import results
+import solvers
+from conftest import make_database, spectrum
+
+
+def test_put_get_and_restart(tmp_path):
+    store = results.ResultCache(str(tmp_path), 1024**2)
+    store.put("k", {"x": np.arange(5.0)}, {"rnorm": 1.5})
+    arrays, meta = store.get("k")
+    np.testing.assert_array_equal(arrays["x"], np.arange(5.0))
+    assert meta == {"rnorm": 1.5}
+    assert store.get("missing") is None
+    # Another process (or a restart) on the same directory
+    arrays, _ = results.ResultCache(str(tmp_path), 1024**2).get("k")
+    np.testing.assert_array_equal(arrays["x"], np.arange(5.0))
+    assert store.stats()["hits"] == 1 and store.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = results.ResultCache(str(tmp_path), 1024**2)
+    store.put("probe", {"x": np.zeros(1000)})
+    nbytes = store.stats()["bytes"]
+    store.clear()
+    store.max_bytes = 2.5*nbytes
+    for key in ("a", "b"):
+        store.put(key, {"x": np.zeros(1000)})
+        time.sleep(0.01)
+    store.get("a")
+    time.sleep(0.01)
+    store.put("c", {"x": np.zeros(1000)})
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats()["entries"] == 2 and store.stats()["bytes"] <= store.max_bytes
+    assert not (tmp_path / "b.npz").exists() and not (tmp_path / "probe.npz").exists()
+
+
+def test_missing_file_is_a_miss(tmp_path):
+    store = results.ResultCache(str(tmp_path), 1024**2)
+    store.put("k", {"x": np.zeros(3)})
+    (tmp_path / "k.npz").unlink()
+    assert store.get("k") is None
+    assert store.stats()["entries"] == 0
+
+
+def test_fit_round_trip(tmp_path):
+    store = results.ResultCache(str(tmp_path), 1024**2)
+    database = make_database()
+    absorbance, _ = spectrum(database, 0.05)
+    path = regularization.tikhonov_path(database, absorbance)
+    result = regularization.chosen(path)
+    store.put("fit", *results.pack_fit(result, path))
+    unpacked, unpacked_path = results.unpack_fit(*store.get("fit"))
+    assert isinstance(unpacked, solvers.SolveResult)
+    np.testing.assert_array_equal(unpacked.x, result.x)
+    assert unpacked.rnorm == result.rnorm and unpacked_path.best == path.best
+    np.testing.assert_array_equal(unpacked_path.gcv, path.gcv)
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+from scipy.optimize import nnls
+
+import databases
+import solvers
+
+
+def absorption_database(n_sizes, noise, seed=0):
+    """
+    Database shaped like DataAD.csv (a band that shifts and widens with
+    the size, plus a UV tail): neighbouring sizes are nearly collinear,
+    more so with less noise.
+    """
+    rng = np.random.default_rng(seed)
+    wavelengths = 340 + 0.5*np.arange(300)
+    sizes = np.linspace(6.42, 1.96, n_sizes)
+    span = wavelengths[-1] - wavelengths[0]
+    centers = wavelengths[0] + span*(0.1 + 0.8*(sizes - sizes.min())/np.ptp(sizes))
+    band = np.exp(-0.5*((wavelengths[:, None] - centers)/(0.04*span + 2*sizes))**2)
+    tail = np.exp(-(wavelengths[:, None] - wavelengths[0])/(0.3*span))
+    matrix = sizes**3*(band + 0.5*tail)*(1 + noise*rng.standard_normal(band.shape))
+    return databases.Database("test", wavelengths, sizes, matrix)
+
+
+def spectrum(database, seed=0):
+    rng = np.random.default_rng(seed)
+    return database.matrix @ (0.1*rng.random(database.shape[1])) + rng.standard_normal(database.shape[0])
+
+
+def condition(database):
+    return np.linalg.cond(database.matrix/database.norms)
+
+
+@pytest.mark.parametrize("n_sizes, noise, seed", [(40, 1e-4, 0), (60, 1e-6, 2), (100, 1e-6, 0), (150, 1e-7, 0)])
+@pytest.mark.parametrize("name", list(solvers.SOLVERS))
+def test_ill_conditioned_matches_scipy(name, n_sizes, noise, seed):
+    database = absorption_database(n_sizes, noise, seed)
+    assert condition(database) > 1e4
+    absorbance = spectrum(database, seed)
+    _, reference = nnls(database.matrix, absorbance, maxiter=100*n_sizes)
+
+    result = database.nnls(absorbance, name)
+    assert result.x.min() >= 0
+    assert result.rnorm >= reference*(1 - 1e-9)
+    if name != "fista":
+        assert result.converged
+    if result.converged:
+        assert result.rnorm == pytest.approx(reference, rel=1e-7)
+
+
+@pytest.mark.parametrize("name", list(solvers.SOLVERS))
+def test_well_conditioned_matches_scipy(name):
+    database = absorption_database(11, 0.2)
+    absorbance = spectrum(database)
+    x, reference = nnls(database.matrix, absorbance)
+
+    result = database.nnls(absorbance, name)
+    assert result.converged
+    assert result.rnorm == pytest.approx(reference, rel=1e-7)
+    np.testing.assert_allclose(result.x, x, rtol=1e-4, atol=1e-6*np.abs(x).max())
+
+
+@pytest.mark.parametrize("n_sizes, noise", [(11, 1e-2), (100, 1e-6)])
+def test_active_set_warm_start(n_sizes, noise):
+    database = absorption_database(n_sizes, noise)
+    absorbance = spectrum(database)
+    _, reference = nnls(database.matrix, absorbance, maxiter=100*n_sizes)
+    rng = np.random.default_rng(1)
+    for x0 in (rng.random(n_sizes), database.solve(absorbance*1.05)[0]):
+        result = database.nnls(absorbance, "active-set", x0)
+        assert result.converged
+        assert result.rnorm == pytest.approx(reference, rel=1e-7)
+
+
+@pytest.mark.parametrize("ridge", [1e-6, 1e-2, 1.0])
+def test_active_set_ridge_matches_augmented_scipy(ridge):
+    database = absorption_database(60, 1e-6)
+    qtb = database.q.T @ spectrum(database)
+    n = database.shape[1]
+    augmented = np.vstack([database.r, np.sqrt(ridge)*np.eye(n)])
+    z, _ = nnls(augmented, np.concatenate([qtb, np.zeros(n)]), maxiter=100*n)
+
+    result = solvers.active_set(database, qtb, ridge=ridge)
+    assert result.converged
+    assert result.rnorm == pytest.approx(np.linalg.norm(database.r @ z - qtb), rel=1e-6)
+    objective = lambda z: np.sum((database.r @ z - qtb)**2) + ridge*(z @ z)
+    assert objective(result.x) <= objective(z)*(1 + 1e-9)
+
+
+def test_unknown_solver():
+    with pytest.raises(ValueError):
+        solvers.get("simplex")
+
+
+def test_active_set_fallback_is_reported(monkeypatch):
+    database = absorption_database(40, 1e-4)
+    qtb = database.q.T @ spectrum(database)
+    # Every result fails the check: solved again by scipy
+    monkeypatch.setattr(solvers, "KKT_TOL", -1.0)
+    result = solvers.active_set(database, qtb)
+    reference = solvers.scipy_active_set(database, qtb)
+    assert result.iterations is None and result.converged
+    assert result.rnorm == pytest.approx(reference.rnorm, rel=1e-12)
+    # Neither converges in one iteration
+    result = solvers.active_set(database, qtb, max_iter=1)
+    assert result.iterations is None and not result.converged
+
+
+def test_lipschitz_bounds_the_largest_eigenvalue():
+    for n_sizes, noise in [(11, 1e-2), (100, 1e-6)]:
+        database = absorption_database(n_sizes, noise)
+        largest = np.linalg.eigvalsh(database.normal_gram)[-1]
+        assert largest <= database.lipschitz <= largest*(1 + 1e-5)
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import store
+
+
+@pytest.fixture(params=["memory", "disk"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return store.MemoryBackend()
+    return store.DiskBackend(str(tmp_path / "sessions"))
+
+
+def session_id():
+    return str(uuid.uuid4())
+
+
+def age(backend, session_id, seconds):
+    # Last access seconds ago
+    if isinstance(backend, store.MemoryBackend):
+        blob, last = backend._data[session_id]
+        backend._data[session_id] = (blob, last - seconds)
+    else:
+        path = backend._path(session_id)
+        past = os.stat(path).st_mtime - seconds
+        os.utime(path, (past, past))
+
+
+def test_sessions_are_isolated(backend):
+    sessions = store.SessionStore(backend)
+    first, second = session_id(), session_id()
+    sessions.update(first, value=1)
+    sessions.update(second, value=2, other="x")
+    assert sessions.get(first) == {"value": 1}
+    assert sessions.get(second) == {"value": 2, "other": "x"}
+    # Changing the returned state does not change the store
+    sessions.get(first)["value"] = 3
+    assert sessions.get(first) == {"value": 1}
+    assert sessions.get(session_id()) == {}
+    assert sessions.get("../not-a-session") == {}
+    with pytest.raises(ValueError):
+        sessions.update("../not-a-session", value=1)
+
+
+def test_idle_sessions_expire(backend):
+    sessions = store.SessionStore(backend, ttl=60)
+    idle, active = session_id(), session_id()
+    sessions.update(idle, value=1)
+    sessions.update(active, value=2)
+    age(backend, idle, 120)
+    assert sessions.get(idle) == {}
+    assert sessions.get(active) == {"value": 2}
+
+
+def test_least_recently_used_are_evicted_over_the_limits(backend):
+    sessions = store.SessionStore(backend, max_sessions=2)
+    ids = [session_id() for _ in range(3)]
+    for sid in ids:
+        sessions.update(sid, value=sid)
+        time.sleep(0.01)
+    assert sessions.get(ids[0]) == {}
+    assert sessions.get(ids[1]) == {"value": ids[1]}
+    assert sessions.get(ids[2]) == {"value": ids[2]}
+
+
+def test_byte_budget_spares_the_session_being_updated(backend):
+    sessions = store.SessionStore(backend, max_bytes=1500)
+    small, large = session_id(), session_id()
+    sessions.update(small, value="x")
+    time.sleep(0.01)
+    # Over the budget on its own: the others go, not the one just written
+    sessions.update(large, value="x"*2000)
+    assert [entry[0] for entry in backend.entries()] == [large]
+
+
+def test_eviction_skips_sessions_locked_elsewhere(tmp_path):
+    directory = str(tmp_path / "sessions")
+    sessions = store.SessionStore(store.DiskBackend(directory), ttl=60)
+    busy = session_id()
+    sessions.update(busy, value=1)
+    age(sessions.backend, busy, 120)
+    # Another worker is modifying it
+    with store.DiskBackend(directory).lock(busy):
+        sessions.get(session_id())
+        assert os.path.exists(sessions.backend._path(busy))
+    sessions.get(session_id())
+    assert not os.path.exists(sessions.backend._path(busy))
+
+
+def test_modify_is_atomic_across_workers(tmp_path):
+    # One store per worker on the same directory: only the file lock
+    # keeps their read-modify-writes apart
+    directory = str(tmp_path / "sessions")
+    workers = [store.SessionStore(store.DiskBackend(directory)) for _ in range(4)]
+    sid = session_id()
+
+    def increment(state):
+        count = state.get("count", 0)
+        time.sleep(0.001)
+        state["count"] = count + 1
+
+    def work(sessions):
+        for _ in range(25):
+            sessions.modify(sid, increment)
+
+    threads = [threading.Thread(target=work, args=(sessions,)) for sessions in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert workers[0].get(sid) == {"count": 100}
+
+
+def test_modify_does_not_save_an_unknown_session_left_empty(backend):
+    sessions = store.SessionStore(backend)
+    sid = session_id()
+    assert sessions.modify(sid, lambda state: state.get("missing")) is None
+    assert [entry[0] for entry in backend.entries()] == []
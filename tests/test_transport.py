@@ -0,0 +1,112 @@
+import gzip
+import json
+
+import flask
+import numpy as np
+import plotly.io.json
+import plotly.utils
+import pytest
+
+import transport
+
+
+BODY = {"values": list(range(1000))}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # install replaces the JSON encoder of plotly, put back after the test
+    monkeypatch.setattr(plotly.utils, "PlotlyJSONEncoder", plotly.utils.PlotlyJSONEncoder)
+    monkeypatch.setattr(plotly.io.json.config, "default_engine", plotly.io.json.config.default_engine)
+    monkeypatch.setattr(transport, "COMPRESS", ["br", "gzip"])
+    monkeypatch.setattr(transport, "static_cache", transport.LRUCache(1024**2, name="test"))
+    server = flask.Flask(__name__)
+
+    @server.route("/large", methods=["GET", "POST"])
+    def large():
+        return flask.jsonify(BODY)
+
+    @server.route("/small")
+    def small():
+        return flask.jsonify({"value": 1})
+
+    @server.route("/image")
+    def image():
+        return flask.Response(b"\0"*2000, mimetype="image/png")
+
+    transport.install(server)
+    return server.test_client()
+
+
+@pytest.mark.parametrize("header, available, expected", [
+    ("gzip, deflate, br", ["br", "gzip"], "br"),
+    ("gzip, deflate, br", ["gzip", "br"], "gzip"),
+    ("gzip", ["br", "gzip"], "gzip"),
+    ("br;q=0, gzip;q=0.5", ["br", "gzip"], "gzip"),
+    ("*", ["br", "gzip"], "br"),
+    ("*, br;q=0", ["br", "gzip"], "gzip"),
+    ("identity", ["br", "gzip"], None),
+    ("", ["br", "gzip"], None),
+    ("gzip;q=oops", ["gzip"], "gzip"),
+])
+def test_choose(header, available, expected):
+    assert transport.choose(header, available) == expected
+
+
+def test_gzip_response(client):
+    response = client.post("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert json.loads(gzip.decompress(response.data)) == BODY
+
+
+def test_brotli_response(client):
+    brotli = pytest.importorskip("brotli")
+    response = client.post("/large", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert json.loads(brotli.decompress(response.data)) == BODY
+
+
+@pytest.mark.parametrize("path, header", [
+    ("/large", ""),
+    ("/large", "identity"),
+    ("/small", "gzip"),
+    ("/image", "gzip"),
+])
+def test_left_uncompressed(client, path, header):
+    response = client.get(path, headers={"Accept-Encoding": header})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_get_responses_are_compressed_once(client, monkeypatch):
+    calls = []
+    compress = transport.compress
+    monkeypatch.setattr(transport, "compress", lambda data, encoding: calls.append(encoding) or compress(data, encoding))
+    first = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert calls == ["gzip"]
+    assert first.data == second.data
+    # POST (callback) responses are compressed every time
+    client.post("/large", headers={"Accept-Encoding": "gzip"})
+    client.post("/large", headers={"Accept-Encoding": "gzip"})
+    assert calls == ["gzip"]*3
+
+
+def test_json_engine_is_reversible():
+    pytest.importorskip("orjson")
+    original = plotly.utils.PlotlyJSONEncoder
+    engine = plotly.io.json.config.default_engine
+    restore = transport.use_json_engine("orjson")
+    try:
+        # A second call does not wrap the wrapped encoder
+        transport.use_json_engine("orjson")()
+        assert plotly.utils.PlotlyJSONEncoder.original is original
+        value = {"x": np.arange(3.0)}
+        assert json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder) == plotly.io.json.to_json_plotly(
+            value, engine="orjson"
+        )
+    finally:
+        restore()
+    assert plotly.utils.PlotlyJSONEncoder is original
+    assert plotly.io.json.config.default_engine == engine
@@ -0,0 +1,101 @@
+import os
+import time
+import uuid
+
+import flask
+import pytest
+
+import uploads
+
+
+CSV = b"Wavelength,Absorbance\n400,0.1\n410,0.2\n420,0.3\n"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "SPOOL_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(uploads, "EXPIRE_EVERY", 0)
+    server = flask.Flask(__name__)
+    uploads.install(server)
+    return server.test_client()
+
+
+@pytest.fixture
+def session():
+    return str(uuid.uuid4())
+
+
+def start(client, session, filename="data.csv"):
+    response = client.post("/upload/start", json={"filename": filename, "session": session})
+    assert response.status_code == 200
+    return response.get_json()["handle"]
+
+
+def put(client, session, handle, data, offset=0):
+    return client.put(f"/upload/{handle}?session={session}&offset={offset}", data=data)
+
+
+def test_upload_in_chunks(client, session):
+    handle = start(client, session)
+    assert put(client, session, handle, CSV[:20]).get_json() == {"received": 20}
+    assert put(client, session, handle, CSV[20:], offset=20).get_json() == {"received": len(CSV)}
+    response = client.post(f"/upload/{handle}/finish?session={session}")
+    assert response.get_json() == {"handle": handle, "size": len(CSV)}
+    df = uploads.load_upload(handle, session)
+    assert list(df.columns) == ["Wavelength", "Absorbance"]
+    assert df.Absorbance.tolist() == [0.1, 0.2, 0.3]
+
+
+def test_resume_rewrites_from_the_offset(client, session):
+    handle = start(client, session)
+    put(client, session, handle, CSV[:30])
+    # The last chunk is sent again after a failure
+    assert put(client, session, handle, CSV[10:], offset=10).get_json() == {"received": len(CSV)}
+    assert put(client, session, handle, CSV, offset=len(CSV) + 1).status_code == 400
+    client.post(f"/upload/{handle}/finish?session={session}")
+    with open(uploads.path_for(handle, session), "rb") as file:
+        assert file.read() == CSV
+
+
+def test_unsupported_extension(client, session):
+    response = client.post("/upload/start", json={"filename": "data.exe", "session": session})
+    assert response.status_code == 400
+
+
+def test_too_large_removes_the_upload(client, session, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_BYTES", 10)
+    handle = start(client, session)
+    assert put(client, session, handle, CSV).status_code == 413
+    assert not os.path.exists(uploads.path_for(handle, session, partial=True))
+    assert put(client, session, handle, CSV[:5]).status_code == 404
+
+
+def test_handles_belong_to_their_session(client, session):
+    handle = start(client, session)
+    other = str(uuid.uuid4())
+    assert put(client, other, handle, CSV).status_code == 404
+    assert put(client, "../escape", handle, CSV).status_code == 400
+    assert client.post("/upload/start", json={"filename": "data.csv"}).status_code == 400
+    put(client, session, handle, CSV)
+    assert client.post(f"/upload/{handle}/finish?session={other}").status_code == 404
+    client.post(f"/upload/{handle}/finish?session={session}")
+    with pytest.raises(FileNotFoundError):
+        uploads.load_upload(handle, other)
+
+
+def test_old_uploads_expire_on_any_request(client, session, monkeypatch):
+    monkeypatch.setattr(uploads, "TTL", 60)
+    old = start(client, session)
+    put(client, session, old, CSV)
+    past = time.time() - 120
+    os.utime(uploads.path_for(old, session, partial=True), (past, past))
+    other = str(uuid.uuid4())
+    recent = start(client, other)
+    # A chunk of another upload is enough to clean up the old one
+    assert put(client, other, recent, CSV).status_code == 200
+    assert not os.path.exists(uploads.path_for(old, session, partial=True))
+    # Its session directory goes once nothing happened in it for TTL
+    os.utime(os.path.dirname(uploads.path_for(old, session)), (past, past))
+    assert client.post(f"/upload/{recent}/finish?session={other}").status_code == 200
+    assert not os.path.exists(os.path.dirname(uploads.path_for(old, session)))
+    assert os.path.exists(uploads.path_for(recent, other))
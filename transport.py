@@ -0,0 +1,170 @@
+"""
+Smaller and faster responses: compression of the responses of the Flask
+server (brotli or gzip, whichever the browser accepts first in
+DDD_COMPRESS) and the orjson engine for the JSON of the callbacks.
+
+Callback responses are compressed every time, at a fast level; the
+responses of GET requests (the Dash and plotly.js bundles) once per
+content and encoding, then served from a cache. Compressed sizes and
+compression times are recorded in the /metrics of instrumentation.py.
+"""
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import time
+
+from cache import LRUCache, digest
+from instrumentation import metrics, BYTES_BUCKETS
+
+
+logger = logging.getLogger("ddd.transport")
+
+# Encodings in order of preference ("" disables compression)
+COMPRESS = [name for name in os.environ.get("DDD_COMPRESS", "br,gzip").split(",") if name]
+GZIP_LEVEL = int(os.environ.get("DDD_COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("DDD_COMPRESS_BR_QUALITY", 5))
+# Smaller responses are sent as they are
+MIN_BYTES = int(os.environ.get("DDD_COMPRESS_MIN_BYTES", 500))
+MIMETYPES = {"application/json", "application/javascript", "text/javascript", "text/html", "text/css", "text/plain"}
+# JSON engine of plotly.io.json ("orjson" if installed, else "json")
+JSON_ENGINE = os.environ.get("DDD_JSON_ENGINE", "orjson" if importlib.util.find_spec("orjson") else "json")
+
+static_cache = LRUCache(float(os.environ.get("DDD_COMPRESS_CACHE_MB", 16))*1024**2, name="compressed")
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def encodings():
+    """
+    Encodings of COMPRESS available in this environment.
+    """
+    available = [name for name in COMPRESS if name == "gzip" or (name == "br" and _brotli() is not None)]
+    unknown = set(COMPRESS) - {"br", "gzip"}
+    if unknown:
+        logger.warning("Unknown encodings in DDD_COMPRESS: %s", ", ".join(sorted(unknown)))
+    return available
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return _brotli().compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def choose(accept_encoding, available):
+    """
+    First of available accepted by the Accept-Encoding header, None if
+    there is none.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                pass
+        accepted[name.strip().lower()] = quality
+    for name in available:
+        if accepted.get(name, accepted.get("*", 0)) > 0:
+            return name
+    return None
+
+
+def use_json_engine(engine=JSON_ENGINE):
+    """
+    Makes plotly.io.json (which Dash 2 uses for the responses) and the
+    JSON encoder of Dash 1 (plotly.utils.PlotlyJSONEncoder) use engine.
+    Dash 1 on Flask 2.0 has no JSON provider to plug it into, so the
+    encoder is replaced in plotly.utils; returns a function that puts
+    back the previous one and the previous default engine.
+    """
+    import plotly.io.json
+    import plotly.utils
+
+    previous = plotly.io.json.config.default_engine, plotly.utils.PlotlyJSONEncoder
+
+    def restore():
+        plotly.io.json.config.default_engine, plotly.utils.PlotlyJSONEncoder = previous
+
+    plotly.io.json.config.default_engine = engine
+    # Not an encoder of a previous call
+    base = getattr(previous[1], "original", previous[1])
+    if engine != "orjson":
+        plotly.utils.PlotlyJSONEncoder = base
+        return restore
+
+    class EngineEncoder(base):
+        original = base
+
+        # json.dumps(value, cls=EngineEncoder) calls encode
+        def encode(self, o):
+            return plotly.io.json.to_json_plotly(o, engine=engine)
+
+    plotly.utils.PlotlyJSONEncoder = EngineEncoder
+    return restore
+
+
+def install(server):
+    """
+    Adds the compression hook to the Flask server of the Dash app (which
+    must be created with compress=False) and sets the JSON engine.
+    Install it before instrumentation.install, so the sizes recorded by
+    the latter are the ones before compression.
+    """
+    import flask
+
+    use_json_engine()
+    available = encodings()
+    logger.info("Compression: %s, JSON engine: %s", ", ".join(available) or "none", JSON_ENGINE)
+    if not available:
+        return
+
+    @server.after_request
+    def compress_response(response):
+        encoding = choose(flask.request.headers.get("Accept-Encoding", ""), available)
+        if (
+            encoding is None or response.status_code != 200 or "Content-Encoding" in response.headers
+            or response.mimetype not in MIMETYPES or response.is_streamed and not response.direct_passthrough
+        ):
+            return response
+        response.direct_passthrough = False
+        raw = response.get_data()
+        if len(raw) < MIN_BYTES:
+            return response
+        # GET responses are the static files and the layout
+        key = (encoding, digest(raw)) if flask.request.method == "GET" else None
+        data = None if key is None else static_cache.get(key)
+        if data is None:
+            start = time.perf_counter()
+            data = compress(raw, encoding)
+            seconds = time.perf_counter() - start
+            if key is not None:
+                static_cache.put(key, data, len(data))
+            if flask.request.path.endswith("/_dash-update-component"):
+                body = flask.request.get_json(silent=True) or {}
+                labels = (("output", str(body.get("output", ""))), ("encoding", encoding))
+                metrics.observe("ddd_response_compressed_bytes", labels, len(data), buckets=BYTES_BUCKETS)
+                metrics.observe("ddd_compress_seconds", labels, seconds)
+                logger.debug(json.dumps({
+                    "event": "compress", "output": labels[0][1], "encoding": encoding, "bytes": len(raw),
+                    "compressed_bytes": len(data), "seconds": round(seconds, 6),
+                }))
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Content-Length"] = str(len(data))
+        response.vary.add("Accept-Encoding")
+        etag, _ = response.get_etag()
+        if etag:
+            # A different representation than the uncompressed one
+            response.set_etag(f"{etag}-{encoding}")
+        return response
@@ -0,0 +1,170 @@
+"""
+Chunked upload of large files straight to disk.
+
+The browser (assets/chunked_upload.js) sends the raw bytes of the file
+in chunks to these routes on the Flask server, and the callbacks only
+receive a small handle to parse the spooled file, instead of the whole
+file as base64 inside the callback JSON. Uploads are spooled in a
+directory per session and a handle only works with the session id that
+started it.
+
+    POST /upload/start {"filename": ..., "session": ...}  -> {"handle": ...}
+    PUT  /upload/<handle>?session=<id>&offset=<n> (bytes) -> {"received": ...}
+    POST /upload/<handle>/finish?session=<id>             -> {"handle": ..., "size": ...}
+"""
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from store import SESSION_ID_RE
+from utils import load_file, parse_cache, EXTENSIONS
+
+
+SPOOL_DIR = os.environ.get("DDD_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "ddd-uploads"))
+MAX_BYTES = float(os.environ.get("DDD_UPLOAD_MAX_MB", 256))*1024**2
+TTL = float(os.environ.get("DDD_UPLOAD_TTL", 24*3600))
+# Expired files are looked for at most this often (seconds)
+EXPIRE_EVERY = 60
+# Bytes copied from the request to the file at a time
+BLOCK = 1024**2
+
+HANDLE_RE = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]+$")
+
+
+def path_for(handle, session_id, partial=False):
+    """
+    Path of the spooled file of handle in the directory of session_id,
+    ValueError for invalid handles or session ids.
+    """
+    if not handle or not HANDLE_RE.match(handle):
+        raise ValueError("Invalid upload handle")
+    if not session_id or not SESSION_ID_RE.match(session_id):
+        raise ValueError("Invalid session id")
+    return os.path.join(SPOOL_DIR, session_id, handle + (".part" if partial else ""))
+
+
+def load_upload(handle, session_id, col_names=None):
+    """
+    Parses the spooled file of handle, uploaded by session_id (same
+    rules as utils.load_df). Handles are never reused, so the result is
+    cached by handle.
+    """
+    import pandas as pd
+
+    key = ("upload", session_id, handle, tuple(col_names or ()))
+    cached = parse_cache.get(key)
+    if cached is None:
+        df = load_file(path_for(handle, session_id), col_names)
+        if type(df) == str:
+            return df
+        values = df.to_numpy()
+        values.flags.writeable = False
+        cached = (values, list(df.columns))
+        parse_cache.put(key, cached, nbytes=values.nbytes)
+    values, columns = cached
+    return pd.DataFrame(values.copy(), columns=columns)
+
+
+_expired = 0
+
+
+def _expire():
+    """
+    Deletes the spooled files (finished or not) older than TTL, and the
+    session directories left empty, at most every EXPIRE_EVERY seconds.
+    """
+    global _expired
+    now = time.time()
+    if now - _expired < EXPIRE_EVERY:
+        return
+    _expired = now
+    for directory in os.scandir(SPOOL_DIR):
+        if not directory.is_dir():
+            continue
+        try:
+            # Nothing started or finished in it for TTL
+            stale = now - directory.stat().st_mtime > TTL
+            for item in os.scandir(directory.path):
+                if now - item.stat().st_mtime > TTL:
+                    os.remove(item.path)
+            if stale:
+                os.rmdir(directory.path)
+        except FileNotFoundError:
+            pass
+        except OSError:  # Not empty, a new upload started
+            pass
+
+
+def install(server):
+    """
+    Adds the upload routes to the Flask server.
+    """
+    import flask
+
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+
+    def error(message, status=400):
+        return flask.jsonify({"error": message}), status
+
+    @server.route("/upload/start", methods=["POST"])
+    def upload_start():
+        body = flask.request.get_json(silent=True) or {}
+        extension = os.path.splitext(body.get("filename", ""))[1].lower()
+        if extension not in EXTENSIONS:
+            return error(f"Only {', '.join(EXTENSIONS)} files are supported.")
+        _expire()
+        handle = uuid.uuid4().hex + extension
+        try:
+            path = path_for(handle, body.get("session"), partial=True)
+        except ValueError as e:
+            return error(str(e))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        return flask.jsonify({"handle": handle})
+
+    @server.route("/upload/<handle>", methods=["PUT"])
+    def upload_chunk(handle):
+        _expire()
+        try:
+            path = path_for(handle, flask.request.args.get("session"), partial=True)
+        except ValueError as e:
+            return error(str(e))
+        if not os.path.exists(path):
+            return error("Unknown upload", 404)
+        offset = flask.request.args.get("offset", 0, type=int)
+        if offset < 0 or offset > os.path.getsize(path):
+            return error("Invalid offset")
+        too_large = False
+        with open(path, "r+b") as file:
+            file.seek(offset)
+            while True:
+                block = flask.request.stream.read(BLOCK)
+                if not block:
+                    break
+                if file.tell() + len(block) > MAX_BYTES:
+                    too_large = True
+                    break
+                file.write(block)
+            file.truncate()
+            received = file.tell()
+        if too_large:
+            # The upload cannot go on, its spooled part goes now
+            os.remove(path)
+            return error("File too large", 413)
+        return flask.jsonify({"received": received})
+
+    @server.route("/upload/<handle>/finish", methods=["POST"])
+    def upload_finish(handle):
+        _expire()
+        session_id = flask.request.args.get("session")
+        try:
+            partial = path_for(handle, session_id, partial=True)
+        except ValueError as e:
+            return error(str(e))
+        if not os.path.exists(partial):
+            return error("Unknown upload", 404)
+        path = path_for(handle, session_id)
+        os.replace(partial, path)
+        return flask.jsonify({"handle": handle, "size": os.path.getsize(path)})
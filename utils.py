@@ -1,7 +1,21 @@
 import base64
+import importlib.util
 import io
+import os
 import numpy as np
-import pandas as pd
+
+from cache import LRUCache, digest
+
+
+# Parsed uploads keyed by content hash, so callbacks fired again with the
+# same file (e.g. on bin size changes) skip the decoding and parsing
+parse_cache = LRUCache(float(os.environ.get("DDD_PARSE_CACHE_MB", 64))*1024**2, name="parse")
+
+# Extensions read by read_table and written by write_table (not Excel)
+EXTENSIONS = (".csv", ".xls", ".xlsx", ".npz", ".npy", ".parquet")
+FORMATS = "csv, xls, xlsx, npz, npy and parquet"
+# Parquet needs pyarrow, an optional dependency
+PARQUET = importlib.util.find_spec("pyarrow") is not None
 
 
 # Lognormal function
@@ -13,47 +27,147 @@ def lognormal(x, mu, s):
     return (1/(x*s*np.sqrt(2*np.pi))) * (np.exp(-(((np.log(x/mu))**2)/(2*s**2))))
 
 
+def lognormal_gradient(x, mu, s):
+    """
+    Analytic partial derivatives of lognormal with respect to mu and s,
+    as a (len(x), 2) array (the jac argument of optimize.curve_fit).
+    """
+    x = np.asarray(x, dtype=float)
+    f = lognormal(x, mu, s)
+    log_ratio = np.log(x/mu)
+    return np.column_stack([
+        f*log_ratio/(mu*s**2),
+        f*(log_ratio**2/s**3 - 1/s),
+    ])
+
+
 def load_df(contents, filename, col_names=None):
     """
     Recieves file contents string from Upload component.
     Returns pandas.DataFrame or a string if unsupported file format.
-    Supported filetypes: csv, xls, xlsx. Check templates in data folder.
+    Supported filetypes: see EXTENSIONS. Check templates in data folder.
     Parsing: assumes first row is headers and replaces it with
-    col_names if passed.
+    col_names if passed. Every value must be numeric (ValueError
+    otherwise). Parsed files are cached by content hash.
     """
+    import pandas as pd
+
     _, content_string = contents.split(",")
+    extension = os.path.splitext(filename)[1].lower()
+    key = (digest(content_string), extension, tuple(col_names or ()))
+    cached = parse_cache.get(key)
+    if cached is not None:
+        values, columns = cached
+        return pd.DataFrame(values.copy(), columns=columns)
+
     decoded = base64.b64decode(content_string)
+    if extension == ".csv":
+        df = read_table(io.StringIO(decoded.decode("utf-8")), filename, col_names)
+    else:
+        df = read_table(io.BytesIO(decoded), filename, col_names)
+    if type(df) == str:
+        return df
+
+    values = df.to_numpy()
+    values.flags.writeable = False
+    parse_cache.put(key, (values, list(df.columns)), nbytes=values.nbytes)
+    return pd.DataFrame(values.copy(), columns=df.columns)
+
 
+def read_table(source, filename, col_names=None):
+    """
+    Parses source (path or file-like object) with the format given by
+    the extension of filename, same rules as load_df.
+    Binary formats (see write_table): .npz with "values" and "columns"
+    arrays, .npy with a 2-D array whose first row holds the (numeric)
+    column headers like a CSV, and .parquet (needs pyarrow).
+    Returns pandas.DataFrame of floats or "EXT_ERROR".
+    """
+    import pandas as pd
+
+    filename = str(filename).lower()
+    # Binary formats are already numeric
+    if filename.endswith(".npz"):
+        with np.load(source, allow_pickle=False) as npz:
+            return pd.DataFrame(
+                npz["values"].astype(float), columns=col_names or npz["columns"].astype(str).tolist()
+            )
+    elif filename.endswith(".npy"):
+        # Files on disk are read from a memory map
+        array = np.load(source, mmap_mode="r" if isinstance(source, (str, os.PathLike)) else None,
+                        allow_pickle=False)
+        array = array.reshape(array.shape[0], -1)
+        columns = col_names or [
+            f"{header:g}" if np.isfinite(header) else f"Column {i}" for i, header in enumerate(array[0])
+        ]
+        return pd.DataFrame(array[1:].astype(float), columns=columns)
+    elif filename.endswith(".parquet"):
+        _require_pyarrow()
+        df = pd.read_parquet(source).astype(float)
+        if col_names is not None:
+            df.columns = col_names
+        return df
     if filename.endswith(".csv"):
         df = pd.read_csv(
-            io.StringIO(decoded.decode("utf-8")),
+            source,
             names=col_names,
-            header=0
+            header=0,
+            # Files on disk are parsed from a memory map, without a copy
+            memory_map=isinstance(source, (str, os.PathLike)),
         )
     elif filename.endswith(".xls") or filename.endswith(".xlsx"):
         df = pd.read_excel(
-            io.BytesIO(decoded),
+            source,
             names=col_names,
             header=0
         )
     else:
         return "EXT_ERROR"
 
-    return df
+    return df.apply(pd.to_numeric).astype(float)
+
+
+def load_file(path, col_names=None):
+    """
+    Reads a file from disk, same rules as load_df.
+    """
+    return read_table(path, path, col_names)
 
 
-def extend_list(y_data, sizes, n=10000):  # , scaling=None):
+def write_table(df, target, filename, float32=False):
     """
-    This function creates a list to be able to plot an histogram
-    using the frequencies obtained (y_data).
-    'sizes' is the sizes pd.Series from the jacobian file
+    Writes df to target (path or binary file-like object) in the format
+    given by the extension of filename: .csv, .npz (compressed), .npy
+    (the headers in the first row, nan if they are not numbers) or
+    .parquet (needs pyarrow). With float32 the values are stored in
+    single precision, half the size.
     """
-    freqs = [round(i/y_data.sum()*n) for i in y_data]
-    extended_list = []
-    for i, freq in enumerate(freqs):
-        if freq == 0:
-            continue
-        for _ in range(freq):
-            # Append the corresponding particle size 'freq' times
-            extended_list.append(sizes.iloc[i])
-    return pd.Series(extended_list)
+    import pandas as pd
+
+    filename = str(filename).lower()
+    dtype = np.float32 if float32 else np.float64
+    columns = [str(column) for column in df.columns]
+    if filename.endswith(".npz"):
+        np.savez_compressed(target, values=df.to_numpy(dtype=dtype), columns=np.array(columns))
+    elif filename.endswith(".npy"):
+        headers = pd.to_numeric(pd.Series(columns), errors="coerce").to_numpy(dtype=dtype)
+        np.save(target, np.vstack([headers, df.to_numpy(dtype=dtype)]), allow_pickle=False)
+    elif filename.endswith(".parquet"):
+        _require_pyarrow()
+        frame = df.astype(dtype)
+        frame.columns = columns
+        frame.to_parquet(target, index=False)
+    elif filename.endswith(".csv"):
+        text = df.to_csv(index=False, float_format="%.7g" if float32 else None)
+        if hasattr(target, "write"):
+            target.write(text.encode("utf-8"))
+        else:
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(text)
+    else:
+        raise ValueError(f"Only {FORMATS.replace('xls, xlsx, ', '')} files can be written: {filename}")
+
+
+def _require_pyarrow():
+    if not PARQUET:
+        raise RuntimeError("Parquet files need the pyarrow package (pip install pyarrow).")